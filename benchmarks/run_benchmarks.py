@@ -0,0 +1,267 @@
+# run_benchmarks.py
+"""
+Stage-by-stage benchmarks on synthetic knowledge graphs.
+
+    python benchmarks/run_benchmarks.py [--scales 1000 10000 100000] [--output report.json]
+                                        [--baseline old_report.json]
+
+For every scale (number of users) a graph is generated with synthetic_kg.py
+into benchmarks/data/<scale> and timed through:
+
+    generate     writing triples.tsv, its integer encoding and the serving artifact
+    export       the TSV export of download_kg.py, fed the triples as SPARQL bindings,
+                 without and with --int-triples
+    load         loading the artifact, building the user and profile indexes
+                 and fitting the shared projection
+    clustering   every stage of perform_clustering, for each case in CLUSTERING_CASES
+    abox         scripts/abox.py on synthetic trusted zone rows, up to --abox-max-users
+
+Each stage reports wall time and rows processed, and with --memory the peak
+memory allocated (tracemalloc, as debug jobs do; it slows the pure-Python
+stages such as the ABox several times, so compare timings of runs made with
+the same flags). The report is JSON with the commit it was run at; --baseline
+prints the ratio of every stage to the same stage of an earlier report.
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "python-backend"))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+sys.path.insert(0, ROOT)
+
+import synthetic_kg
+from metrics import StageRecorder
+
+DEFAULT_SCALES = (1000, 10000, 100000)
+
+# (name, perform_clustering parameters)
+CLUSTERING_CASES = (
+    ("dbscan_10k", {"algorithm": "dbscan", "eps": 4.0, "min_samples": 5, "max_users": 10000}),
+    ("minibatch_kmeans_all", {"algorithm": "minibatch_kmeans", "n_clusters": synthetic_kg.N_TASTES,
+                              "max_users": 0}),
+)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def triples_as_bindings(triples_path: str):
+    """The triples file read back as the SPARQL JSON bindings download_kg.py receives."""
+    with open(triples_path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f, delimiter="\t")
+        next(reader)
+        for s, p, o in reader:
+            yield {"s": {"value": s}, "p": {"value": p}, "o": {"value": o}}
+
+
+def count_lines(path: str) -> int:
+    with open(path, "rb") as f:
+        return sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1 << 20), b"")) - 1
+
+
+def bench_generate(recorder, out_dir: str, n_users: int, seed: int) -> dict:
+    # Start from scratch so no index or projection is reused from the cache/ of a previous run
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+    triples_path = os.path.join(out_dir, "triples.tsv")
+    model_path = os.path.join(out_dir, "kg")
+    recorder.start("triples", rows=n_users)
+    tastes = synthetic_kg.write_triples(triples_path, n_users, seed)
+    recorder.start("int_triples", rows=n_users)
+    synthetic_kg.encode_tsv(triples_path)
+    recorder.start("artifact", rows=n_users)
+    synthetic_kg.write_model(model_path, tastes, seed)
+    recorder.close()
+    return {"triples_path": triples_path, "model_path": model_path}
+
+
+def bench_export(recorder, triples_path: str, n_triples: int):
+    from download_kg import write_triples
+    from term_dictionary import TermEncoder
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output_file = os.path.join(tmp, "triples.tsv")
+        recorder.start("tsv_export", rows=n_triples)
+        write_triples(triples_as_bindings(triples_path), output_file)
+        recorder.start("int_export", rows=n_triples)
+        encoder = TermEncoder()
+        write_triples(triples_as_bindings(triples_path), output_file, encoder)
+        encoder.write(tmp, output_file)
+        recorder.close()
+
+
+def bench_load(recorder, model_path: str, triples_path: str, n_triples: int):
+    from model_registry import load_model
+    from profiles import build_profile_index
+    from projection import load_projection
+    from user_index import build_user_index
+
+    recorder.start("artifact")
+    model = load_model(model_path)
+    recorder.start("user_index", rows=n_triples)
+    users = build_user_index(model, triples_path)
+    recorder.start("profile_index", rows=n_triples)
+    build_profile_index(model, users, triples_path)
+    recorder.start("projection", rows=len(users.rows))
+    load_projection(model, users)
+    recorder.close()
+    return model, users
+
+
+def bench_clustering(recorder, model, users, params: dict):
+    from clustering import perform_clustering
+
+    perform_clustering(model, users, progress=recorder.start, **params)
+    recorder.close()
+
+
+def bench_abox(recorder, n_users: int, seed: int):
+    import abox
+    from ntriples_sink import NTriplesSink
+    from user_generator import UserGenerator, build_candidates, write_users
+
+    rows = synthetic_kg.catalogue_rows(seed)
+    tmp = tempfile.TemporaryDirectory()
+    g = NTriplesSink(os.path.join(tmp.name, "abox.nt.gz"), dedupe_predicates=abox.DEDUPE_PREDICATES)
+
+    recorder.start("keywords", rows=sum(len(rows[t]) for t in ("entertainment", "sports", "technology")))
+    keywords = {topic: abox.extract_keywords([f"{r.content} {r.title} {r.description}" for r in rows[topic]],
+                                             top_n=15)
+                for topic in ("entertainment", "sports", "technology")}
+
+    recorder.start("catalogue", rows=sum(len(table) for table in rows.values()))
+    abox.add_matches(g, rows["matches"])
+    abox.add_competitions(g, rows["leagues"])
+    abox.add_teams(g, rows["teams"])
+    abox.add_venues(g, rows["venues"])
+    abox.add_movies(g, rows["movie"])
+    abox.add_movie_genres(g, rows["movie_genre"])
+    abox.add_movie_flags(g, rows["trending"], abox.DBO.trending_movie)
+    abox.add_movie_flags(g, rows["upcoming"], abox.DBO.upcoming_movie)
+    abox.add_movie_flags(g, rows["now_playing"], abox.DBO.now_playing_movie)
+    abox.add_genres(g, rows["genre"])
+    for topic, news_class in (("entertainment", abox.DBO.Entertainment_News),
+                              ("sports", abox.DBO.Sports_News),
+                              ("technology", abox.DBO.Tech_News)):
+        abox.add_news(g, rows[topic], news_class, keywords[topic])
+
+    recorder.start("close", rows=len(g))
+    g.close()
+
+    recorder.start("users", rows=n_users)
+    candidates = build_candidates(
+        [c.code for c in {r.country for r in rows["leagues"]} if c.code is not None],
+        [r.film_id for r in rows["movie"]], [r.genre_id for r in rows["genre"]],
+        [r.team_id for r in rows["teams"]], [r.league_id for r in rows["leagues"]],
+        [kw for topic in keywords.values() for kw in topic], abox.consistent_hash)
+    write_users(UserGenerator(candidates, seed), n_users, os.path.join(tmp.name, "abox-users"))
+    recorder.close()
+    tmp.cleanup()
+
+
+def run_scale(n_users: int, data_dir: str, seed: int, abox_max_users: int, trace_memory: bool) -> list:
+    results = []
+
+    def record(benchmark, recorder):
+        for stage in recorder.stages:
+            results.append({"scale": n_users, "benchmark": benchmark, **stage})
+            memory = stage["peak_memory_bytes"]
+            print(f"  {benchmark:<32} {stage['stage']:<16} {stage['seconds']:9.3f}s"
+                  + ("" if memory is None else f" {memory / 2 ** 20:9.1f}MiB"))
+
+    print(f"Scale {n_users} users")
+    recorder = StageRecorder(trace_memory)
+    paths = bench_generate(recorder, os.path.join(data_dir, str(n_users)), n_users, seed)
+    record("generate", recorder)
+    n_triples = count_lines(paths["triples_path"])
+
+    recorder = StageRecorder(trace_memory)
+    bench_export(recorder, paths["triples_path"], n_triples)
+    record("export", recorder)
+
+    recorder = StageRecorder(trace_memory)
+    model, users = bench_load(recorder, paths["model_path"], paths["triples_path"], n_triples)
+    record("load", recorder)
+
+    for name, params in CLUSTERING_CASES:
+        recorder = StageRecorder(trace_memory)
+        bench_clustering(recorder, model, users, params)
+        record(f"clustering/{name}", recorder)
+
+    if n_users <= abox_max_users:
+        recorder = StageRecorder(trace_memory)
+        bench_abox(recorder, n_users, seed)
+        record("abox", recorder)
+    return results
+
+
+def compare(report: dict, baseline: dict):
+    previous = {(r["scale"], r["benchmark"], r["stage"]): r for r in baseline["results"]}
+    print(f"Compared with {baseline.get('commit') or 'baseline'}:")
+    if baseline.get("trace_memory") != report["trace_memory"]:
+        print("  (only one of the two runs traced memory, timings are not comparable)")
+    for r in report["results"]:
+        old = previous.get((r["scale"], r["benchmark"], r["stage"]))
+        if old is None or old["seconds"] <= 0:
+            continue
+        ratio = r["seconds"] / old["seconds"]
+        flag = "  slower" if ratio > 1.2 else ""
+        print(f"  {r['scale']:>8} {r['benchmark']:<32} {r['stage']:<16} {old['seconds']:9.3f}s -> "
+              f"{r['seconds']:9.3f}s  x{ratio:.2f}{flag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic knowledge graphs")
+    parser.add_argument("--scales", type=int, nargs="+", default=list(DEFAULT_SCALES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=os.path.join(ROOT, "benchmarks", "data"))
+    parser.add_argument("--abox-max-users", type=int, default=1000000,
+                        help="Skip the ABox benchmark above this many users")
+    parser.add_argument("--memory", action="store_true", help="Also record the peak memory of every stage")
+    parser.add_argument("--output", default=None,
+                        help="Report file, benchmark_report.json in --data-dir by default")
+    parser.add_argument("--baseline", default=None, help="Earlier report to compare against")
+    args = parser.parse_args()
+    args.output = args.output or os.path.join(args.data_dir, "benchmark_report.json")
+
+    started = time.time()
+    results = []
+    for n_users in args.scales:
+        results.extend(run_scale(n_users, args.data_dir, args.seed, args.abox_max_users, args.memory))
+
+    report = {
+        "commit": git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(started)),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": args.seed,
+        "trace_memory": args.memory,
+        "scales": args.scales,
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
@@ -0,0 +1,242 @@
+# synthetic_kg.py
+"""
+Seeded synthetic knowledge graph for the benchmarks.
+
+    python benchmarks/synthetic_kg.py [n_users] [out_dir] [--seed 0]
+
+writes, under out_dir (default benchmarks/data/<n_users>):
+
+    triples.tsv                        # as download_kg.py exports it
+    triples.npy, entity_*, relation_*  # its integer encoding (term_dictionary.py)
+    kg/training_triples/
+    ├── entity_to_id.tsv.gz            # the term dictionary, as PyKEEN saves it
+    └── relation_to_id.tsv.gz
+    kg/serving/                        # serving artifact with random embeddings
+
+The catalogue (films, genres, teams, competitions, keywords, countries) is
+small and fixed, as in the real trusted zone; only the users scale. Users
+like items around one of a few "tastes" and their embeddings are drawn around
+that taste's centre, so the clustering has structure to find. There is no
+trained_model.pkl: the embeddings go straight into the serving artifact, which
+is all the backend reads.
+
+catalogue_rows() also returns trusted zone rows for scripts/abox.py, so the
+ABox generation can be timed without Spark.
+"""
+import argparse
+import csv
+import gzip
+import os
+import shutil
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python-backend"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from serving_artifact import write_artifact
+from term_dictionary import encode_tsv
+
+DBO = "http://sdm_upc.org/ontology/"
+DBR = "http://sdm_upc.org/resource/"
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+
+N_FILMS = 2000
+N_GENRES = 19
+N_TEAMS = 500
+N_COMPETITIONS = 100
+N_KEYWORDS = 45
+N_COUNTRIES = 50
+N_TASTES = 8
+EMBEDDING_DIM = 64
+CHUNK_USERS = 100000
+
+FIRST_NAMES = ("Ana", "Marc", "Laura", "Pau", "Marta", "Jordi", "Sara", "Alex", "Nuria", "David")
+LAST_NAMES = ("Garcia", "Puig", "Serra", "Vidal", "Roca", "Soler", "Font", "Mas", "Ferrer", "Costa")
+
+# Users like 1-3 of each item kind and 1-5 keywords, as scripts/abox.py does
+LIKES = (
+    ("likes_movie", "film", N_FILMS, 3),
+    ("likes_genre", "genre", N_GENRES, 3),
+    ("likes_team", "team", N_TEAMS, 3),
+    ("likes_competition", "competition", N_COMPETITIONS, 3),
+    ("interested_in", "keyword", N_KEYWORDS, 5),
+)
+SIZES = {kind: n_items for _, kind, n_items, _ in LIKES}
+NAMES = {"film": "movie_title", "genre": "genre_name", "team": "team_name",
+         "competition": "competition_name", "keyword": "keyword_text"}
+
+
+def item_uri(kind: str, i: int) -> str:
+    return f"{DBR}{kind}_{i}"
+
+
+def user_uri(i: int) -> str:
+    return f"{DBR}user_{i}"
+
+
+def catalogue_triples():
+    """Names of every catalogue item."""
+    for kind, name in NAMES.items():
+        for i in range(SIZES[kind]):
+            yield item_uri(kind, i), DBO + name, f"{kind.capitalize()} {i}"
+    for i in range(N_COUNTRIES):
+        yield item_uri("country", i), DBO + "country_name", f"Country {i}"
+
+
+def user_likes(rng, tastes: np.ndarray, n_items: int, most: int):
+    """1..most distinct items per user, biased towards the user's taste."""
+    counts = rng.integers(1, most + 1, size=len(tastes))
+    users = np.repeat(np.arange(len(tastes)), counts)
+    # Each taste prefers its own slice of the items, with some noise
+    width = max(1, n_items // N_TASTES)
+    items = (tastes[users] * width + rng.integers(0, width, size=len(users))) % n_items
+    noise = rng.random(len(users)) < 0.2
+    items[noise] = rng.integers(0, n_items, size=int(noise.sum()))
+    pairs = np.unique(np.stack([users, items], axis=1), axis=0)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def write_triples(path: str, n_users: int, seed: int = 0) -> np.ndarray:
+    """Write triples.tsv and return the taste of every user."""
+    rng = np.random.default_rng(seed)
+    tastes = rng.integers(0, N_TASTES, size=n_users)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("subject\tpredicate\tobject\n")
+        f.writelines(f"{s}\t{p}\t{o}\n" for s, p, o in catalogue_triples())
+        for start in range(0, n_users, CHUNK_USERS):
+            ids = np.arange(start, min(n_users, start + CHUNK_USERS))
+            first = rng.integers(0, len(FIRST_NAMES), size=len(ids))
+            last = rng.integers(0, len(LAST_NAMES), size=len(ids))
+            country = rng.integers(0, N_COUNTRIES, size=len(ids))
+            lines = []
+            for i, a, b, c in zip(ids.tolist(), first.tolist(), last.tolist(), country.tolist()):
+                uri = user_uri(i)
+                lines.append(f"{uri}\t{RDF_TYPE}\t{DBO}User\n")
+                lines.append(f"{uri}\t{DBO}user_name\t{FIRST_NAMES[a]} {LAST_NAMES[b]}\n")
+                lines.append(f"{uri}\t{DBO}user_country\t{item_uri('country', c)}\n")
+            for link, kind, n_items, most in LIKES:
+                users, items = user_likes(rng, tastes[ids], n_items, most)
+                lines.extend(f"{user_uri(start + u)}\t{DBO}{link}\t{item_uri(kind, k)}\n"
+                             for u, k in zip(users.tolist(), items.tolist()))
+            f.writelines(lines)
+    return tastes
+
+
+def _read_mapping(path: str) -> dict:
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f, delimiter="\t")
+        next(reader)
+        return {label: int(i) for i, label in reader}
+
+
+def write_model(model_dir: str, tastes: np.ndarray, seed: int = 0) -> str:
+    """
+    PyKEEN mappings and a serving artifact for the triples of write_triples.
+    The mappings are the term dictionary next to them, as for a model trained
+    on triples.npy, so model_dir goes in the same folder as triples.tsv.
+    """
+    rng = np.random.default_rng(seed + 1)
+    data_dir = os.path.dirname(os.path.abspath(model_dir))
+    mapping_dir = os.path.join(model_dir, "training_triples")
+    os.makedirs(mapping_dir, exist_ok=True)
+    for name in ("entity_to_id.tsv.gz", "relation_to_id.tsv.gz"):
+        shutil.copyfile(os.path.join(data_dir, name), os.path.join(mapping_dir, name))
+    entity_to_id = _read_mapping(os.path.join(mapping_dir, "entity_to_id.tsv.gz"))
+    relation_to_id = _read_mapping(os.path.join(mapping_dir, "relation_to_id.tsv.gz"))
+
+    entity_embeddings = rng.normal(size=(len(entity_to_id), EMBEDDING_DIM)).astype(np.float32)
+    centres = rng.normal(scale=4.0, size=(N_TASTES, EMBEDDING_DIM)).astype(np.float32)
+    user_ids = np.array([entity_to_id[user_uri(i)] for i in range(len(tastes))], dtype=np.int64)
+    entity_embeddings[user_ids] += centres[tastes]
+    relation_embeddings = rng.normal(size=(len(relation_to_id), EMBEDDING_DIM)).astype(np.float32)
+
+    return write_artifact(os.path.join(model_dir, "serving"), entity_to_id, entity_embeddings,
+                          relation_to_id, relation_embeddings,
+                          metadata={"model": "synthetic", "scoring_fct_norm": 1, "seed": seed})
+
+
+def generate(out_dir: str, n_users: int, seed: int = 0) -> dict:
+    os.makedirs(out_dir, exist_ok=True)
+    triples_path = os.path.join(out_dir, "triples.tsv")
+    model_path = os.path.join(out_dir, "kg")
+    tastes = write_triples(triples_path, n_users, seed)
+    encode_tsv(triples_path)
+    version = write_model(model_path, tastes, seed)
+    return {"triples_path": triples_path, "model_path": model_path, "model_version": version}
+
+
+# Rows with the columns scripts/abox.py reads from each trusted zone table
+Country = namedtuple("Country", "code name")
+Match = namedtuple("Match", "fixture_id status_long team_home_id team_away_id goals_home goals_away "
+                            "fixture_date league referee venue_id")
+League = namedtuple("League", "league_id league_type league_name country")
+Team = namedtuple("Team", "team_id team_name")
+Venue = namedtuple("Venue", "venue_id venue_name venue_city")
+Movie = namedtuple("Movie", "film_id title original_title release_date revenue budget runtime adult "
+                            "popularity vote_average vote_count")
+MovieGenre = namedtuple("MovieGenre", "film_id genre_id")
+FilmRef = namedtuple("FilmRef", "film_id")
+Genre = namedtuple("Genre", "genre_id genre")
+News = namedtuple("News", "url author source title publishedAt content description")
+
+WORDS = ("league", "final", "season", "coach", "transfer", "premiere", "director", "festival", "award",
+         "streaming", "series", "actor", "chip", "startup", "launch", "model", "privacy", "battery",
+         "market", "record", "stadium", "fans", "album", "trailer", "update")
+
+
+def catalogue_rows(seed: int = 0, n_matches: int = 5000, n_news: int = 1000) -> dict:
+    """One list of rows per trusted zone table, keyed by table name."""
+    rng = np.random.default_rng(seed)
+    countries = [Country(f"C{i}", f"Country {i}") for i in range(N_COUNTRIES)] + [Country(None, "World")]
+
+    def text(n_words):
+        return " ".join(WORDS[k] for k in rng.integers(0, len(WORDS), size=n_words))
+
+    rows = {
+        "matches": [
+            Match(i, "match finished", int(rng.integers(N_TEAMS)), int(rng.integers(N_TEAMS)),
+                  int(rng.integers(6)), int(rng.integers(6)), f"2024-05-{1 + i % 28:02d}T20:00:00",
+                  int(rng.integers(N_COMPETITIONS)), f"Referee {i % 300}", int(rng.integers(400)))
+            for i in range(n_matches)
+        ],
+        "leagues": [
+            League(i, "cup" if i % 4 == 0 else "league", f"Competition {i}",
+                   countries[int(rng.integers(len(countries)))])
+            for i in range(N_COMPETITIONS)
+        ],
+        "teams": [Team(i, f"Team {i}") for i in range(N_TEAMS)],
+        "venues": [Venue(i, f"Venue {i}", f"City {i % 80}") for i in range(400)],
+        "movie": [
+            Movie(i, f"Film {i}", "en", f"2020-01-{1 + i % 28:02d}", int(rng.integers(10 ** 8)),
+                  int(rng.integers(10 ** 8)), float(rng.integers(80, 180)) if i % 10 else float("nan"),
+                  False, float(rng.random() * 100), float(rng.random() * 10), int(rng.integers(10 ** 4)))
+            for i in range(N_FILMS)
+        ],
+        "movie_genre": [MovieGenre(i, int(rng.integers(N_GENRES))) for i in range(N_FILMS)],
+        "trending": [FilmRef(i) for i in range(0, N_FILMS, 50)],
+        "upcoming": [FilmRef(i) for i in range(1, N_FILMS, 50)],
+        "now_playing": [FilmRef(i) for i in range(2, N_FILMS, 50)],
+        "genre": [Genre(i, f"Genre {i}") for i in range(N_GENRES)],
+    }
+    for topic in ("entertainment", "sports", "technology"):
+        rows[topic] = [
+            News(f"https://news.example/{topic}/{i}", f"Author {i % 40}", f"Source {i % 12}", text(6),
+                 "2024-05-01T10:00:00", text(60), text(20))
+            for i in range(n_news)
+        ]
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic knowledge graph")
+    parser.add_argument("n_users", type=int, nargs="?", default=10000)
+    parser.add_argument("out_dir", nargs="?", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    out_dir = args.out_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", str(args.n_users))
+    info = generate(out_dir, args.n_users, args.seed)
+    print(f"Wrote {info['triples_path']} and serving artifact {info['model_version']} to {info['model_path']}")
@@ -1,10 +1,326 @@
+"""
+Builds the TBox and the ABox in docker-import/ as a pipeline of stages.
+
+    python create_kg.py <users> [--seed 0] [--workers N] [--jobs 4] [--full]
+
+Every trusted zone table has its own stage writing abox-<table>.nt.gz with
+the add_* function of scripts/abox.py, and the users stage writes the
+abox-users-*.nt.gz shards. docker-import/kg_manifest.json records, for each
+stage, what it was built from (the Delta version of its table, a hash of the
+code, the number of users...) and the files it wrote. On a rerun a stage is
+
+    skipped      when none of that changed and its files are still there,
+    patched      when only its table moved on and the table records change data
+                 (delta.enableChangeDataFeed): the triples of the deleted and
+                 updated rows are taken out of the previous file and those of
+                 the new rows added, without reading the rest of the table,
+    rebuilt      otherwise, or when a change renames an entity (e.g. a country
+                 of the leagues table): its name is shared with other rows, so
+                 only a rebuild knows whether the old one is still in use.
+                 News tables are always rebuilt, since their keywords come
+                 from the whole table.
+
+Rows are turned into triples on the Spark executors (abox.partition_triples
+and abox.partition_changes), and the TBox and the table stages run
+concurrently: --jobs driver threads submit their Spark jobs to one session
+and only move the finished files into place. The users stage runs after
+them, as it links users to the ids and keywords they collect. --full ignores
+the manifest.
+"""
+import argparse
+import gzip
+import glob
+import hashlib
+import json
+import operator
+import os
+import shutil
 import subprocess
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = os.path.join(HERE, "scripts")
+sys.path.insert(0, SCRIPTS)
+
+import abox
+from abox import DBO, DEDUPE_PREDICATES, GZIP_CODEC
+from user_generator import UserGenerator, build_candidates, write_users
+
+OUTPUT_DIR = "./docker-import"
+MANIFEST = "kg_manifest.json"
+
+# (table, add_* function of scripts/abox.py, its extra arguments)
+TABLE_STAGES = (
+    ("matches", abox.add_matches, ()),
+    ("leagues", abox.add_competitions, ()),
+    ("teams", abox.add_teams, ()),
+    ("venues", abox.add_venues, ()),
+    ("movie", abox.add_movies, ()),
+    ("movie_genre", abox.add_movie_genres, ()),
+    ("trending", abox.add_movie_flags, (DBO.trending_movie,)),
+    ("upcoming", abox.add_movie_flags, (DBO.upcoming_movie,)),
+    ("now_playing", abox.add_movie_flags, (DBO.now_playing_movie,)),
+    ("genre", abox.add_genres, ()),
+)
+NEWS_STAGES = (
+    ("entertainment", DBO.Entertainment_News),
+    ("sports", DBO.Sports_News),
+    ("technology", DBO.Tech_News),
+)
+
+# Ids the users link to, collected by the stage of their table (value -> column)
+STAGE_VALUES = {
+    "leagues": {"league_ids": "league_id", "country_ids": "country.code"},
+    "teams": {"team_ids": "team_id"},
+    "movie": {"film_ids": "film_id"},
+    "genre": {"genre_ids": "genre_id"},
+}
+
+ABOX_CODE = ("abox.py", "ntriples_sink.py", "keyword_matcher.py", "user_generator.py")
+TBOX_CODE = ("tbox.py",)
+
+# Name triples are shared by every row mentioning the entity, so a changed row never takes them out
+SHARED_PREDICATES = {f"<{p}>" for p in DEDUPE_PREDICATES}
+
+
+def code_hash(names) -> str:
+    digest = hashlib.sha1()
+    for name in names:
+        with open(os.path.join(SCRIPTS, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+class Manifest:
+    """Inputs and outputs of every stage, saved after each stage that runs."""
+
+    def __init__(self, output_dir: str, full: bool = False):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST)
+        self._lock = threading.Lock()
+        self.stages = {}
+        if not full and os.path.exists(self.path):
+            with open(self.path) as f:
+                self.stages = json.load(f)["stages"]
+
+    def up_to_date(self, stage: str, inputs: dict) -> bool:
+        previous = self.stages.get(stage)
+        return (previous is not None and previous["inputs"] == inputs
+                and all(os.path.exists(os.path.join(self.output_dir, name)) for name in previous["outputs"]))
+
+    def record(self, stage: str, inputs: dict, outputs: list, **info):
+        with self._lock:
+            previous = self.stages.get(stage)
+            # e.g. user shards left over from a run with more users
+            for name in set(previous["outputs"] if previous else ()) - set(outputs):
+                path = os.path.join(self.output_dir, name)
+                if os.path.exists(path):
+                    os.remove(path)
+            self.stages[stage] = {"inputs": inputs, "outputs": outputs, **info}
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"stages": self.stages}, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+def write_table(path: str, parts_dir: str):
+    """
+    Join the gzip parts Spark saved in `parts_dir` into `path`, moved over it
+    once complete. A gzip file can hold several members, so the parts are
+    copied as they are, without decompressing them.
+    """
+    directory, name = os.path.split(path)
+    tmp = os.path.join(directory, "." + name + ".tmp")
+    with open(tmp, "wb") as dst:
+        for part in sorted(glob.glob(os.path.join(parts_dir, "part-*"))):
+            with open(part, "rb") as src:
+                shutil.copyfileobj(src, dst)
+        if dst.tell() == 0:
+            dst.write(gzip.compress(b""))  # Still a valid (empty) file
+    os.replace(tmp, path)
+    shutil.rmtree(parts_dir)
+
+
+def save_triples(spark, df, parts_dir: str, add_rows, *args) -> int:
+    """Triples of all rows of `df`, made and saved in `parts_dir` by the executors."""
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    n_triples = spark.sparkContext.accumulator(0)
+    triplify = abox.partition_triples(add_rows, *args)
+
+    def counted(rows):
+        lines = triplify(rows)
+        n_triples.add(len(lines))
+        return lines
+
+    df.rdd.mapPartitions(counted).saveAsTextFile(parts_dir, compressionCodecClass=GZIP_CODEC)
+    return n_triples.value
+
+
+class NameChanged(Exception):
+    pass
+
+
+def apply_changes(path: str, deltas: dict):
+    """
+    Patch the triples file of a table with the net change of each line, as
+    abox.partition_changes sums them over change data feed rows. The file has
+    a copy of a line for every row making it (two leagues rows of the same
+    competition both type it), so a line only disappears with the last of
+    them. Names are written once and never taken out: those of entities no
+    longer mentioned stay behind, which is harmless. A different name for an
+    entity raises NameChanged before anything is written, as the old one
+    must go but may still come from other rows. Returns the number of lines
+    taken out and added.
+    """
+    names = {}
+    for line, n in deltas.items():
+        subject, predicate, _ = line.split(" ", 2)
+        if predicate in SHARED_PREDICATES and n != 0:
+            names.setdefault((subject, predicate), set()).add(n > 0)
+    renamed = [key for key, signs in names.items() if len(signs) == 2]
+    if renamed:
+        raise NameChanged(f"{len(renamed)} entities renamed, e.g. {renamed[0][0]}")
+
+    to_remove, to_add = {}, {}
+    for line, n in deltas.items():
+        if line.split(" ", 2)[1] in SHARED_PREDICATES:
+            if n > 0:
+                to_add[line] = 1
+        elif n < 0:
+            to_remove[line] = -n
+        elif n > 0:
+            to_add[line] = n
+
+    removed = added = 0
+    directory, name = os.path.split(path)
+    tmp = os.path.join(directory, "." + name + ".tmp")
+    with gzip.open(path, "rt", encoding="utf-8") as src, \
+            gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6) as dst:
+        for line in src:
+            triple = line.rstrip("\n")
+            if to_remove.get(triple):
+                to_remove[triple] -= 1
+                removed += 1
+                continue
+            if triple.split(" ", 2)[1] in SHARED_PREDICATES:
+                to_add.pop(triple, None)  # Already in the file
+            dst.write(line)
+        for triple in sorted(to_add):
+            dst.write((triple + "\n") * to_add[triple])
+            added += to_add[triple]
+    os.replace(tmp, path)
+    return removed, added
+
+
+def run_table_stage(spark, manifest: Manifest, table: str, add_rows, args, code: str, news_class=None):
+    version = abox.table_version(spark, table)
+    inputs = {"code": code, "table_version": version}
+    if manifest.up_to_date(table, inputs):
+        print(f"{table}: up to date (version {version})")
+        return
+    output = f"abox-{table}.nt.gz"
+    path = os.path.join(manifest.output_dir, output)
+    df = abox.read_table(spark, table, version)
+
+    values = {}
+    if news_class is not None:
+        values["keywords"] = abox.extract_column_keywords(df, top_n=15)
+        args = (news_class, values["keywords"])
+    for value, column in STAGE_VALUES.get(table, {}).items():
+        values[value] = abox.distinct_values(df, column)
+
+    previous = manifest.stages.get(table)
+    mode = "rebuilt"
+    if (news_class is None and previous is not None and previous["inputs"]["code"] == code
+            and os.path.exists(path)):
+        from py4j.protocol import Py4JJavaError
+        from pyspark.errors import AnalysisException
+
+        start = previous["inputs"]["table_version"] + 1
+        try:
+            changes = abox.read_changes(spark, table, start, version)
+            deltas = changes.rdd.mapPartitions(abox.partition_changes(add_rows, *args)) \
+                .reduceByKey(operator.add).filter(lambda item: item[1] != 0).collectAsMap()
+            removed, added = apply_changes(path, deltas)
+            mode = "patched"
+            print(f"{table}: versions {start}-{version} applied, {removed} triples removed, {added} added")
+        except NameChanged as e:
+            print(f"{table}: {e}, rebuilding")
+        except (AnalysisException, Py4JJavaError) as e:
+            # Change data not recorded for these versions (or already vacuumed): rebuild
+            print(f"{table}: no change data for versions {start}-{version} ({type(e).__name__}), rebuilding")
+    if mode == "rebuilt":
+        parts_dir = os.path.join(manifest.output_dir, f".abox-{table}.parts")
+        n_triples = save_triples(spark, df, parts_dir, add_rows, *args)
+        write_table(path, parts_dir)
+        print(f"{table}: {n_triples} triples from version {version}")
+    manifest.record(table, inputs, [output], values=values, mode=mode)
+
+
+def run_tbox(manifest: Manifest):
+    inputs = {"code": code_hash(TBOX_CODE)}
+    if manifest.up_to_date("tbox", inputs):
+        print("tbox: up to date")
+        return
+    subprocess.run([sys.executable, os.path.join(SCRIPTS, "tbox.py")], check=True)
+    print("tbox: written")
+    manifest.record("tbox", inputs, ["tbox.ttl"], mode="rebuilt")
+
+
+def run_users(manifest: Manifest, users: int, seed: int, workers: int, code: str):
+    def values(stage, value):
+        return manifest.stages[stage]["values"][value]
+
+    keywords = [kw for table, _ in NEWS_STAGES for kw in values(table, "keywords")]
+    candidates = (values("leagues", "country_ids"), values("movie", "film_ids"), values("genre", "genre_ids"),
+                  values("teams", "team_ids"), values("leagues", "league_ids"), keywords)
+    inputs = {
+        "code": code,
+        "users": users,
+        "seed": seed,
+        "candidates": hashlib.sha1(json.dumps(candidates, sort_keys=True).encode()).hexdigest()[:12],
+    }
+    if manifest.up_to_date("users", inputs):
+        print("users: up to date")
+        return
+    generator = UserGenerator(build_candidates(*candidates, abox.consistent_hash), seed)
+    paths = write_users(generator, users, os.path.join(manifest.output_dir, "abox-users"), workers)
+    print(f"users: {users} users in {len(paths)} shards")
+    manifest.record("users", inputs, [os.path.basename(path) for path in paths], mode="rebuilt")
+
+
+def main(users: int, seed: int = 0, workers: int = None, jobs: int = 4, full: bool = False):
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    manifest = Manifest(OUTPUT_DIR, full)
+    code = code_hash(ABOX_CODE)
+    spark = abox.create_spark_session()
+    # The add_* functions run on the executors
+    for name in ABOX_CODE:
+        spark.sparkContext.addPyFile(os.path.join(SCRIPTS, name))
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(run_tbox, manifest)]
+        futures += [pool.submit(run_table_stage, spark, manifest, table, add_rows, args, code)
+                    for table, add_rows, args in TABLE_STAGES]
+        futures += [pool.submit(run_table_stage, spark, manifest, table, abox.add_news, (), code, news_class)
+                    for table, news_class in NEWS_STAGES]
+        for future in futures:
+            future.result()
 
+    run_users(manifest, users, seed, workers, code)
+    if os.path.exists(os.path.join(OUTPUT_DIR, "abox.nt.gz")):
+        print("Note: load_kg.py also imports docker-import/abox.nt.gz, written by a direct run of scripts/abox.py")
 
-print("Starting TBox Creation...")
-subprocess.run(["python", "scripts/tbox.py"])
 
-print("------------------------------------\n")
-print("Starting ABox Creation")
-subprocess.run(["python", "scripts/abox.py",sys.argv[1] ])
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the TBox and ABox, only redoing what changed")
+    parser.add_argument("users", type=int, help="Number of synthetic users")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic users")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes writing the user shards (all cores by default)")
+    parser.add_argument("--jobs", type=int, default=4, help="Stages run at the same time")
+    parser.add_argument("--full", action="store_true", help="Rebuild every stage, ignoring the manifest")
+    args = parser.parse_args()
+    main(args.users, args.seed, args.workers, args.jobs, args.full)
@@ -1,5 +1,6 @@
-import requests
+import argparse
 import csv
+import os
 
 # Configuration
 graphdb_url = "http://localhost:7200"
@@ -15,37 +16,54 @@ WHERE {
 }
 """
 
-# Headers for the SPARQL request
-headers = {
-    "Accept": "application/sparql-results+json"
-}
-
-# Parameters for the request
-params = {
-    "query": sparql_query
-}
-
-# Make the request
-response = requests.get(sparql_endpoint, headers=headers, params=params)
-response.raise_for_status()
+def fetch_triples():
+    import requests
 
-# Parse JSON results
-results = response.json()["results"]["bindings"]
+    # Headers for the SPARQL request
+    headers = {
+        "Accept": "application/sparql-results+json"
+    }
 
-print("Response from the database obtained! Saving to TSV")
+    # Parameters for the request
+    params = {
+        "query": sparql_query
+    }
 
-# Write to TSV
-with open(output_file, "w", newline="", encoding="utf-8") as tsvfile:
-    writer = csv.writer(tsvfile, delimiter="\t")
-    writer.writerow(["subject", "predicate", "object"])  # Header
+    # Make the request
+    response = requests.get(sparql_endpoint, headers=headers, params=params)
+    response.raise_for_status()
 
-    for result in results:
-        s = result["s"]["value"]
-        p = result["p"]["value"]
-        o = result["o"]["value"]
-        writer.writerow([s, p, o])
+    # Parse JSON results
+    return response.json()["results"]["bindings"]
 
-print(f"Triples saved to {output_file}")
+def write_triples(results, output_file, encoder=None):
+    # Write to TSV, and number the terms on the way if an encoder is given
+    with open(output_file, "w", newline="", encoding="utf-8") as tsvfile:
+        writer = csv.writer(tsvfile, delimiter="\t")
+        writer.writerow(["subject", "predicate", "object"])  # Header
 
+        for result in results:
+            s = result["s"]["value"]
+            p = result["p"]["value"]
+            o = result["o"]["value"]
+            writer.writerow([s, p, o])
+            if encoder is not None:
+                encoder.add(s, p, o)
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export every triple of the GraphDB repository to a TSV")
+    parser.add_argument("--int-triples", action="store_true",
+                        help="Also write triples.npy and the term dictionary (see term_dictionary.py)")
+    args = parser.parse_args()
 
+    results = fetch_triples()
+    print("Response from the database obtained! Saving to TSV")
+    encoder = None
+    if args.int_triples:
+        from term_dictionary import TermEncoder
+        encoder = TermEncoder()
+    write_triples(results, output_file, encoder)
+    print(f"Triples saved to {output_file}")
+    if encoder is not None:
+        meta = encoder.write(os.path.dirname(output_file), output_file)
+        print(f"Integer triples saved: {meta['entities']} entities, {meta['relations']} relations")
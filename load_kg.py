@@ -1,16 +1,19 @@
 import requests
 from pathlib import Path
+import gzip
 import os
 import traceback
 import requests
 
-def import_to_graphdb(name):
+# Content type of each supported file, by suffix
+FILE_FORMATS = {".ttl": "text/turtle", ".nt": "application/n-triples"}
+
+def import_to_graphdb(name, file_format=None):
     try:
         # Configuration
         GRAPHDB_SERVER = "http://localhost:7200"
         REPOSITORY_ID = "letstalk"
         CREDENTIALS = ("admin", "root")
-        FILE_FORMAT = "text/turtle"
 
         # File path resolution (works in both notebooks and scripts)
         current_dir = Path(os.getcwd())  
@@ -24,12 +27,17 @@ def import_to_graphdb(name):
         if file_path.stat().st_size == 0:
             raise ValueError("File is empty")
 
+        # .nt.gz shards are decompressed while they are streamed to GraphDB
+        compressed = file_path.suffix == ".gz"
+        FILE_FORMAT = file_format or FILE_FORMATS[Path(file_path.stem).suffix if compressed else file_path.suffix]
+
         # Read and send
-        with open(file_path, 'rb') as file:
+        with (gzip.open(file_path, 'rb') if compressed else open(file_path, 'rb')) as file:
             response = requests.post(
                 f"{GRAPHDB_SERVER}/repositories/{REPOSITORY_ID}/statements",
                 headers={"Content-Type": FILE_FORMAT},
-                data=file,
+                # Sent in chunks: the size on disk is not the decompressed size
+                data=iter(lambda: file.read(1 << 20), b"") if compressed else file,
                 auth=CREDENTIALS,
                 timeout=60
             )
@@ -70,4 +78,12 @@ print("Importing TBox to GraphDB...")
 import_to_graphdb("tbox.ttl")
 print("------------------------------------\n")
 print("Importing ABox to GraphDB...")
-import_to_graphdb("abox.ttl")
+# N-Triples written by scripts/abox.py (one file or shards), else a Turtle abox.ttl
+import_dir = Path(os.getcwd()) / "docker-import"
+abox_files = sorted(p.name for p in import_dir.glob("abox*.nt*")) or ["abox.ttl"]
+for name in abox_files:
+    print(name, import_to_graphdb(name))
+# Parts written by `abox.py --spark-output docker-import/abox`, one folder per table
+for part in sorted(import_dir.glob("abox/*/part-*")):
+    name = str(part.relative_to(import_dir))
+    print(name, import_to_graphdb(name, "application/n-triples"))
@@ -18,6 +18,23 @@ type ClusterResponse = {
   user_clusters: ClusterData[];
 };
 
+// Level-of-detail view from /cluster-users/lod: density cells plus a few sample users per cluster
+type LodCluster = {
+  cluster: number;
+  count: number;
+  grid: { x: number[]; y: number[]; count: number[] };
+  sample: { user_uris: string[]; embeddings_2d: number[][] };
+};
+
+type LodResponse = {
+  bbox: number[];
+  cell_size: number[];
+  clusters: LodCluster[];
+};
+
+const GRID_WIDTH = 160;
+const GRID_HEIGHT = 120;
+
 interface ClusterPlotProps {
   // Option 1: Pass cluster data as props
   clusterData?: {
@@ -42,17 +59,22 @@ const ClusterPlot: React.FC<ClusterPlotProps> = ({
   const [loaded, setLoaded] = useState(false);
   const [loading, setLoading] = useState(false);
 
-  const fetchClusterData = async () => {
-    setLoading(true);
+  const fetchClusterData = async (bbox?: number[]) => {
+    setLoading(!bbox);
     try {
-      const response = await axios.post('http://localhost:8000/cluster-users', {
+      // The level-of-detail endpoint keeps the payload the size of the plot, whatever the user count
+      const response = await axios.post('http://localhost:8000/cluster-users/lod', {
         eps: eps,
-        min_samples: minSamples
+        min_samples: minSamples,
+        max_users: 0, // Every user, not a sample
+        grid_width: GRID_WIDTH,
+        grid_height: GRID_HEIGHT,
+        bbox: bbox
       });
       
       if (response.data.status === 'success') {
-        const data: ClusterResponse = response.data.data;
-        processClusterData(data);
+        const data: LodResponse = response.data.data;
+        processLodData(data);
       }
     } catch (error) {
       console.error('Error fetching cluster data:', error);
@@ -61,6 +83,54 @@ const ClusterPlot: React.FC<ClusterPlotProps> = ({
     }
   };
 
+  const processLodData = (data: LodResponse) => {
+    const [xMin, yMin] = data.bbox;
+    const [cellWidth, cellHeight] = data.cell_size;
+    const maxCount = Math.max(1, ...data.clusters.flatMap(c => c.grid.count));
+
+    const traces = data.clusters.flatMap(c => [
+      {
+        // One marker per non-empty cell, sized by the number of users in it
+        x: c.grid.x.map(gx => xMin + (gx + 0.5) * cellWidth),
+        y: c.grid.y.map(gy => yMin + (gy + 0.5) * cellHeight),
+        text: c.grid.count.map(n => `${n} users`),
+        type: 'scattergl',
+        mode: 'markers',
+        marker: { size: c.grid.count.map(n => 4 + 12 * Math.sqrt(n / maxCount)), opacity: 0.35 },
+        name: `Cluster ${c.cluster} (${c.count})`,
+        legendgroup: `${c.cluster}`
+      },
+      {
+        x: c.sample.embeddings_2d.map(([x]) => x),
+        y: c.sample.embeddings_2d.map(([, y]) => y),
+        text: c.sample.user_uris,
+        type: 'scattergl',
+        mode: 'markers',
+        marker: { size: 6 },
+        name: `Cluster ${c.cluster} sample`,
+        legendgroup: `${c.cluster}`,
+        showlegend: false
+      }
+    ]);
+
+    setPlotData(traces);
+    setLoaded(true);
+  };
+
+  const handleRelayout = (relayout: object) => {
+    const event = relayout as Record<string, unknown>;
+    // Zooming asks the server for a finer grid of the visible area; only for data fetched here
+    if (clusterData) return;
+    if (event['xaxis.autorange'] || event['yaxis.autorange']) {
+      fetchClusterData();
+      return;
+    }
+    const range = ['xaxis.range[0]', 'yaxis.range[0]', 'xaxis.range[1]', 'yaxis.range[1]'].map(k => event[k]);
+    if (range.every(v => typeof v === 'number')) {
+      fetchClusterData(range as number[]);
+    }
+  };
+
   const processClusterData = (data: ClusterResponse) => {
     const { embeddings_2d, cluster_labels, user_clusters } = data;
     const pointsByCluster: Record<number, { x: number[], y: number[], text: string[] }> = {};
@@ -115,7 +185,9 @@ const ClusterPlot: React.FC<ClusterPlotProps> = ({
             xaxis: { title: { text: 'PCA 1' } },
             yaxis: { title: { text: 'PCA 2' } },
             height: 600,
+            uirevision: 'keep-zoom',
           }}
+          onRelayout={handleRelayout}
         />
       ) : (
         <p>Loading...</p>
@@ -41,6 +41,7 @@ interface ClusterResponse {
   status: string;
   data?: {
     cluster_distribution: Record<number, number>;
+    cluster_profiles?: Record<string, ClusterPreference[]>;
     user_clusters: ClusterResult[];
     embeddings_2d: [number, number][];
     cluster_labels: number[];
@@ -125,137 +126,17 @@ const QueryGraphDBPage: React.FC = () => {
     },
   ];
 
-  // Function to get cluster preferences query for a specific cluster
-  const getClusterPreferencesQuery = (clusterId: number, userUris: string[]) => {
-    const userUriValues = userUris.map((uri) => `<${uri}>`).join(" ");
-
-    return `
-      PREFIX sdm: <http://sdm_upc.org/ontology/>
-      PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-      SELECT DISTINCT ?category ?name WHERE {
-        {
-          SELECT ?category ?name WHERE {
-            VALUES ?a { ${userUriValues} }
-            ?a sdm:likes_genre ?g .
-            ?g sdm:genre_name ?name .
-            BIND("Genre" AS ?category)
-          }
-          GROUP BY ?category ?name
-          ORDER BY DESC(COUNT(?name))
-          LIMIT 1
-        }
-        UNION
-        {
-          SELECT ?category ?name WHERE {
-            VALUES ?a { ${userUriValues} }
-            ?a sdm:likes_competition ?l .
-            ?l sdm:competition_name ?name .
-            BIND("Competition" AS ?category)
-          }
-          GROUP BY ?category ?name
-          ORDER BY DESC(COUNT(?name))
-          LIMIT 1
-        }
-        UNION
-        {
-          SELECT ?category ?name WHERE {
-            VALUES ?a { ${userUriValues} }
-            ?a sdm:likes_movie ?m .
-            ?m sdm:movie_title ?name .
-            BIND("Movie" AS ?category)
-          }
-          GROUP BY ?category ?name
-          ORDER BY DESC(COUNT(?name))
-          LIMIT 1
-        }
-        UNION
-        {
-          SELECT ?category ?name WHERE {
-            VALUES ?a { ${userUriValues} }
-            ?a sdm:likes_team ?t .
-            ?t sdm:team_name ?name .
-            BIND("Team" AS ?category)
-          }
-          GROUP BY ?category ?name
-          ORDER BY DESC(COUNT(?name))
-          LIMIT 1
-        }
-        UNION
-        {
-          SELECT ?category ?name WHERE {
-            VALUES ?a { ${userUriValues} }
-            ?a sdm:interested_in ?k .
-            ?k sdm:keyword_text ?name .
-            BIND("Keyword" AS ?category)
-          }
-          GROUP BY ?category ?name
-          ORDER BY DESC(COUNT(?name))
-          LIMIT 1
-        }
+  // Cluster preferences come with the clustering from /cluster-profiles
+  const setPreferencesFromProfiles = (profiles: Record<string, ClusterPreference[]>) => {
+    const newPreferences: ClusterPreferences = {};
+    Object.entries(profiles).forEach(([clusterId, preferences]) => {
+      const clusterIdNum = parseInt(clusterId, 10);
+      if (clusterIdNum !== -1) {
+        // Exclude noise points
+        newPreferences[clusterIdNum] = preferences;
       }
-    `;
-  };
-
-  const runClusterPreferencesQueries = async () => {
-    if (!clusterData?.data?.user_clusters || !clusterData?.data?.cluster_labels) {
-      return;
-    }
-
-    setPreferencesLoading(true);
-
-    try {
-      // Group users by cluster
-      const usersByCluster: Record<number, string[]> = {};
-
-      clusterData.data.user_clusters.forEach((user, index) => {
-        const clusterId = clusterData.data!.cluster_labels[index];
-        if (clusterId !== -1) {
-          // Exclude noise points
-          if (!usersByCluster[clusterId]) {
-            usersByCluster[clusterId] = [];
-          }
-          usersByCluster[clusterId].push(user.user_uri);
-        }
-      });
-
-      // Run preference queries for each cluster
-      const preferencesPromises = Object.entries(usersByCluster).map(
-        async ([clusterId, userUris]) => {
-          const clusterIdNum = parseInt(clusterId, 10);
-          const query = getClusterPreferencesQuery(clusterIdNum, userUris);
-
-          try {
-            const response = await axios.post<SparqlResponse>("/api/graphdb", {
-              query: query,
-            });
-
-            const preferences: ClusterPreference[] =
-              response.data.results.bindings.map((binding) => ({
-                category: binding.category?.value || "Unknown",
-                name: binding.name?.value || "Unknown",
-              }));
-
-            return { clusterId: clusterIdNum, preferences };
-          } catch (err) {
-            console.error(`Error executing preferences query for cluster ${clusterId}:`, err);
-            return { clusterId: clusterIdNum, preferences: [] };
-          }
-        }
-      );
-
-      const results = await Promise.all(preferencesPromises);
-
-      const newPreferences: ClusterPreferences = {};
-      results.forEach(({ clusterId, preferences }) => {
-        newPreferences[clusterId] = preferences;
-      });
-
-      setClusterPreferences(newPreferences);
-    } catch (err) {
-      console.error("Error running cluster preferences queries:", err);
-    } finally {
-      setPreferencesLoading(false);
-    }
+    });
+    setClusterPreferences(newPreferences);
   };
 
   const runAllQueries = async () => {
@@ -311,12 +192,13 @@ const QueryGraphDBPage: React.FC = () => {
 
   const runClustering = async () => {
     setClusterLoading(true);
+    setPreferencesLoading(true);
     try {
       const epsValue = parseFloat(eps) || 4.0;
       const minSamplesValue = parseInt(minSamples) || 5;
       const maxUsersValue = parseInt(maxUsers) || 1000;
 
-      const response = await fetch("http://localhost:8000/cluster-users", {
+      const response = await fetch("http://localhost:8000/cluster-profiles", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -326,6 +208,7 @@ const QueryGraphDBPage: React.FC = () => {
           min_samples: minSamplesValue,
           max_users: maxUsersValue,
           sampling_method: samplingMethod,
+          top_k: 1,
         }),
       });
 
@@ -335,6 +218,7 @@ const QueryGraphDBPage: React.FC = () => {
 
       const data: ClusterResponse = await response.json();
       setClusterData(data);
+      setPreferencesFromProfiles(data.data?.cluster_profiles ?? {});
     } catch (err: unknown) {
       const errorMessage = err instanceof Error ? err.message : "Unknown error occurred";
       setClusterData({
@@ -343,6 +227,7 @@ const QueryGraphDBPage: React.FC = () => {
       });
     } finally {
       setClusterLoading(false);
+      setPreferencesLoading(false);
     }
   };
 
@@ -355,13 +240,6 @@ const QueryGraphDBPage: React.FC = () => {
     runClustering();
   }, []);
 
-  // Run preferences queries when cluster data is available
-  useEffect(() => {
-    if (clusterData?.data?.user_clusters) {
-      runClusterPreferencesQueries();
-    }
-  }, [clusterData]);
-
   return (
     <div className="p-6">
       <div className="relative flex flex-row">
@@ -0,0 +1,200 @@
+# ann_index.py
+"""
+Approximate nearest-neighbour search over the user embeddings (IVF).
+
+    python ann_index.py
+
+runs the k-means below for the active model, which the first /similar-users
+request would otherwise wait for. Users are split into about
+sqrt(n) lists by k-means on their embeddings, and a query only scans the
+users of the `nprobe` lists whose centroids are closest to it. The centroids
+and list boundaries are stored in the artifact's cache/ folder, and the user
+embeddings are copied there in list order so each list is one contiguous,
+memory-mapped block.
+
+Distances are Euclidean in the embedding space.
+"""
+import os
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+import serving_artifact
+from artifact_cache import ProcessCache
+from clustering import DEFAULT_SEED
+from model_registry import LoadedModel
+from user_index import UserIndex
+
+MAX_LISTS = 4096
+TRAIN_SAMPLE = 100000
+CHUNK_SIZE = 65536
+
+
+def _squared_distances(queries: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    queries = np.asarray(queries, dtype=np.float32)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    distances = (queries ** 2).sum(axis=1)[:, None] - 2 * queries @ vectors.T + (vectors ** 2).sum(axis=1)[None, :]
+    return np.maximum(distances, 0)
+
+
+def _top_k(distances: np.ndarray, k: int):
+    """Indices and distances of the k smallest entries of a 1D array, closest first."""
+    if len(distances) > k:
+        keep = np.argpartition(distances, k - 1)[:k]
+    else:
+        keep = np.arange(len(distances))
+    keep = keep[np.argsort(distances[keep], kind="stable")]
+    return keep, distances[keep]
+
+
+@dataclass(frozen=True)
+class IVFIndex:
+    centroids: np.ndarray     # (n_lists, dim)
+    list_offsets: np.ndarray  # (n_lists + 1,) list l is vectors[list_offsets[l]:list_offsets[l + 1]]
+    order: np.ndarray         # position in UserIndex.rows of each vector
+    vectors: np.ndarray       # user embeddings in list order
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    def search(self, queries: np.ndarray, k: int, nprobe: int, exclude=None):
+        """
+        Positions (in UserIndex.rows) and distances of the k nearest users of
+        each query. `exclude[i]`, if given, is a position left out of query i's
+        results, e.g. the query user itself.
+        """
+        nprobe = min(nprobe, self.n_lists)
+        coarse = _squared_distances(queries, self.centroids)
+        probes = np.argpartition(coarse, nprobe - 1, axis=1)[:, :nprobe]
+
+        positions, distances = [], []
+        for i, query in enumerate(queries):
+            candidates = np.concatenate([
+                np.arange(self.list_offsets[l], self.list_offsets[l + 1]) for l in probes[i]
+            ])
+            found = _squared_distances(query[None, :], self.vectors[candidates])[0]
+            if exclude is not None:
+                found[self.order[candidates] == exclude[i]] = np.inf
+            keep, found = _top_k(found, k)
+            keep, found = keep[np.isfinite(found)], found[np.isfinite(found)]
+            positions.append(self.order[candidates[keep]])
+            distances.append(np.sqrt(found))
+        return positions, distances
+
+
+def exact_search(user_embeddings: np.ndarray, queries: np.ndarray, k: int, exclude=None):
+    """Brute force equivalent of IVFIndex.search, scanning every user in chunks."""
+    best = [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in queries]
+    for start in range(0, len(user_embeddings), CHUNK_SIZE):
+        chunk = _squared_distances(queries, user_embeddings[start:start + CHUNK_SIZE])
+        if exclude is not None:
+            for i, position in enumerate(exclude):
+                if start <= position < start + chunk.shape[1]:
+                    chunk[i, position - start] = np.inf
+        for i in range(len(queries)):
+            positions = np.concatenate([best[i][0], start + np.arange(chunk.shape[1])])
+            found = np.concatenate([best[i][1], chunk[i]])
+            keep, found = _top_k(found, k)
+            best[i] = (positions[keep], found)
+    return [p[np.isfinite(d)] for p, d in best], [np.sqrt(d[np.isfinite(d)]) for _, d in best]
+
+
+def build_ivf_index(model: LoadedModel, users: UserIndex, seed: int = DEFAULT_SEED) -> IVFIndex:
+    path = os.path.join(model.artifact_dir, "cache", f"ivf-{users.fingerprint}.npz")
+    embeddings = model.shared_rows("users", users.rows, key=users.fingerprint)
+
+    def write(tmp_path):
+        n = len(embeddings)
+        n_lists = int(min(MAX_LISTS, max(1, np.sqrt(n))))
+        print(f"Building IVF index over {n} users with {n_lists} lists...")
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n, size=min(n, TRAIN_SAMPLE), replace=False))
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, batch_size=4096, n_init=3, random_state=seed)
+        kmeans.fit(embeddings[sample])
+        assignment = np.concatenate([
+            kmeans.predict(np.asarray(embeddings[start:start + CHUNK_SIZE], dtype=np.float32))
+            for start in range(0, n, CHUNK_SIZE)
+        ])
+        order = np.argsort(assignment, kind="stable")
+        list_offsets = np.searchsorted(assignment[order], np.arange(n_lists + 1))
+        with open(tmp_path, "wb") as f:
+            np.savez(f, centroids=kmeans.cluster_centers_.astype(np.float32),
+                     list_offsets=list_offsets, order=order)
+
+    serving_artifact.shared_file(path, write)
+    with np.load(path) as arrays:
+        centroids, list_offsets, order = arrays["centroids"], arrays["list_offsets"], arrays["order"]
+    vectors = model.shared_rows("ivf-users", users.rows[order], key=users.fingerprint)
+    return IVFIndex(centroids, list_offsets, order, vectors)
+
+
+_indexes = ProcessCache()
+
+
+def load_ivf_index(model: LoadedModel, users: UserIndex) -> IVFIndex:
+    """IVF index of `users`, built once per host and cached per process."""
+    return _indexes.get((model.version, users.fingerprint), lambda: build_ivf_index(model, users))
+
+
+def similar_users(model: LoadedModel, users: UserIndex, user_uris: list, k: int = 10, nprobe: int = 8,
+                  report_recall: bool = True) -> dict:
+    """
+    The k nearest users of each of `user_uris`. With `report_recall`, the
+    same queries are also answered by exact search, to report the recall of
+    the approximate results and the time each search took.
+    """
+    if k < 1 or nprobe < 1:
+        raise ValueError("k and nprobe must be at least 1")
+    index = load_ivf_index(model, users)
+    rows = np.array([model.entities.get(uri, -1) for uri in user_uris], dtype=np.int64)
+    # Position of each query user in the user index, to leave it out of its own results
+    order = np.argsort(users.rows, kind="stable")
+    found = np.minimum(np.searchsorted(users.rows[order], rows), max(0, len(order) - 1))
+    is_user = users.rows[order[found]] == rows if len(order) else np.zeros(len(rows), dtype=bool)
+    missing = [uri for uri, ok in zip(user_uris, is_user) if not ok]
+    if missing:
+        # Entities that are not users (films, venues...) included
+        raise ValueError(f"Unknown users: {missing[:5]}")
+    exclude = order[found]
+    queries = np.asarray(model.entity_embeddings[rows], dtype=np.float32)
+
+    start = time.perf_counter()
+    positions, distances = index.search(queries, k, nprobe, exclude)
+    approximate_ms = (time.perf_counter() - start) * 1000
+
+    results = {
+        "results": [
+            {
+                "user_uri": uri,
+                "neighbours": [
+                    {"user_uri": label, "distance": float(distance)}
+                    for label, distance in zip(users.labels(model, users.rows[found]), found_distances)
+                ],
+            }
+            for uri, found, found_distances in zip(user_uris, positions, distances)
+        ],
+        "k": k,
+        "nprobe": min(nprobe, index.n_lists),
+        "n_lists": index.n_lists,
+        "approximate_ms": approximate_ms,
+    }
+
+    if report_recall:
+        start = time.perf_counter()
+        exact_positions, _ = exact_search(model.shared_rows("users", users.rows, key=users.fingerprint),
+                                          queries, k, exclude)
+        results["exact_ms"] = (time.perf_counter() - start) * 1000
+        hits = [len(np.intersect1d(a, e)) / max(1, len(e)) for a, e in zip(positions, exact_positions)]
+        results["recall"] = float(np.mean(hits)) if hits else None
+    return results
+
+
+if __name__ == "__main__":
+    from artifact_cache import load_from_environment
+
+    model, users, _ = load_from_environment()
+    index = build_ivf_index(model, users)
+    print(f"IVF index: {len(index.order)} users in {index.n_lists} lists")
@@ -0,0 +1,51 @@
+# artifact_cache.py
+"""
+What the indexes derived from a serving artifact have in common.
+
+The profile index, the IVF lists, the projection and the recommendation
+candidates are each built once per host under the artifact's cache/ folder
+and then kept in memory by every process, but only for the model version and
+triples fingerprint in use: a ProcessCache drops its entries as soon as a
+request comes for another pair. Their command line entry points load the
+active model and user index with load_from_environment().
+"""
+import os
+import threading
+
+from model_registry import load_model
+from user_index import build_user_index
+
+DEFAULT_MODEL_PATH = "./data/kg"
+DEFAULT_TRIPLES_PATH = "../data/triples.tsv"
+
+
+class ProcessCache:
+    """
+    Values keyed by (model version, triples fingerprint, ...). Entries whose
+    first `scope` key items differ from the requested key are dropped before
+    a new value is built; by default the whole key, so one value is kept.
+    """
+
+    def __init__(self, scope: int = None):
+        self.scope = scope
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, build):
+        with self._lock:
+            if key not in self._values:
+                if any(k[:self.scope] != key[:self.scope] for k in self._values):
+                    self._values.clear()
+                self._values[key] = build()
+            return self._values[key]
+
+
+def load_from_environment(triples_path: str = None):
+    """
+    Model of KG_MODEL_PATH and the users of `triples_path` (KG_TRIPLES_PATH by
+    default), as the scripts building the indexes ahead of time need them.
+    Returns the model, the user index and the triples path.
+    """
+    model = load_model(os.environ.get("KG_MODEL_PATH", DEFAULT_MODEL_PATH))
+    triples_path = triples_path or os.environ.get("KG_TRIPLES_PATH", DEFAULT_TRIPLES_PATH)
+    return model, build_user_index(model, triples_path), triples_path
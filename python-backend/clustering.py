@@ -0,0 +1,210 @@
+# clustering.py
+import numpy as np
+from sklearn.preprocessing import StandardScaler
+from sklearn.cluster import DBSCAN
+from sklearn.decomposition import PCA
+from sklearn.neighbors import NearestNeighbors
+from engines import build_engine, resolve_params
+from projection import load_projection
+from quantization import check_storage, load_user_embeddings
+from model_registry import LoadedModel
+from user_index import UserIndex
+
+# Seed used for random sampling when the request does not pick one
+DEFAULT_SEED = 0
+
+# Stages reported through the `progress` callback, in order
+STAGES = ("loading", "user_selection", "scaling", "pca", "clustering", "projection")
+SWEEP_STAGES = ("loading", "user_selection", "scaling", "pca", "neighbour_graph", "dbscan")
+
+# Points kept from each k-distance curve returned by a sweep
+K_DISTANCE_POINTS = 100
+
+# "global": the cached projection fitted over all users (stable coordinates)
+# "local": scaler and PCA refitted on the selected users only
+PROJECTIONS = ("global", "local")
+
+def no_progress(stage: str, rows: int = None):
+    pass
+
+def select_users(model: LoadedModel, users: UserIndex, max_users: int, sampling_method: str, seed: int,
+                 embedding_storage: str = None):
+    """Embedding rows and embeddings of the users to cluster."""
+    print(f"Found {users.total_users} total users")
+    user_ids = users.rows
+
+    # All user rows live in one matrix shared by every worker, float32 or quantised
+    all_user_embeddings = load_user_embeddings(model, users, embedding_storage)
+
+    # Apply user limit
+    if max_users > 0 and len(user_ids) > max_users:
+        print(f"Limiting to {max_users} users (from {len(user_ids)} total)")
+
+        if sampling_method == "random":
+            # Random sampling, reproducible for a given seed
+            rng = np.random.default_rng(seed)
+            indices = rng.choice(len(user_ids), size=max_users, replace=False)
+        else:
+            # Take first N users
+            indices = np.arange(max_users)
+        return user_ids[indices], all_user_embeddings[indices]
+    return user_ids, all_user_embeddings[:]
+
+def reduce_embeddings(user_embeddings: np.ndarray, progress=no_progress, projection=None) -> np.ndarray:
+    """Standardise and project onto at most 50 principal components."""
+    if projection is not None:
+        progress("scaling", rows=len(user_embeddings))
+        progress("pca", rows=len(user_embeddings))
+        return projection.transform(user_embeddings)
+
+    progress("scaling", rows=len(user_embeddings))
+    scaler = StandardScaler()
+    user_embeddings_scaled = scaler.fit_transform(user_embeddings)
+
+    # Adjust PCA components based on user count
+    progress("pca", rows=len(user_embeddings))
+    n_components = min(50, len(user_embeddings) - 1)  # Ensure we don't exceed user count
+    pca = PCA(n_components=n_components)
+    return pca.fit_transform(user_embeddings_scaled)
+
+def perform_clustering(model: LoadedModel, users: UserIndex, eps: float = 4.0, min_samples: int = 5,
+                      max_users: int = 100, sampling_method: str = "random", seed: int = DEFAULT_SEED,
+                      algorithm: str = "dbscan", min_cluster_size: int = None, n_clusters: int = None,
+                      batch_size: int = None, threshold: float = None, branching_factor: int = None,
+                      projection: str = "global", embedding_storage: str = None, progress=no_progress):
+    if projection not in PROJECTIONS:
+        raise ValueError(f"Unknown projection {projection!r}, expected one of {list(PROJECTIONS)}")
+    # Validate the engine parameters before doing any work
+    engine_params = resolve_params(
+        algorithm, eps=eps, min_samples=min_samples, min_cluster_size=min_cluster_size,
+        n_clusters=n_clusters, batch_size=batch_size, threshold=threshold, branching_factor=branching_factor,
+    )
+
+    # `progress(stage, rows)` is called as each of STAGES starts and may raise to abort
+    progress("loading")
+    # Embeddings, entity index and user index are loaded once and shared
+    progress("user_selection", rows=len(users.rows))
+    embedding_storage = check_storage(embedding_storage)
+    user_ids, user_embeddings = select_users(model, users, max_users, sampling_method, seed, embedding_storage)
+    user_labels = users.labels(model, user_ids)
+
+    print(f"Processing {len(user_ids)} users for clustering")
+
+    # Process embeddings
+    fitted = load_projection(model, users) if projection == "global" else None
+    user_embeddings_reduced = reduce_embeddings(user_embeddings, progress, fitted)
+
+    # Cluster with the selected engine
+    progress("clustering", rows=len(user_ids))
+    print(f"Running {algorithm} with {engine_params}")
+    engine = build_engine(algorithm, engine_params, user_embeddings_reduced.shape[1],
+                          seed=DEFAULT_SEED if seed is None else seed)
+    labels = engine.fit_predict(user_embeddings_reduced)
+
+    # Prepare results
+    unique, counts = np.unique(labels, return_counts=True)
+    cluster_distribution = dict(zip(unique, counts))
+
+    progress("projection", rows=len(user_ids))
+    if fitted is not None:
+        user_embeddings_2d = fitted.to_2d(user_embeddings_reduced)
+    else:
+        pca_2d = PCA(n_components=2)
+        user_embeddings_2d = pca_2d.fit_transform(user_embeddings_reduced)
+
+    results = {
+        "cluster_distribution": {int(k): int(v) for k, v in cluster_distribution.items()},
+        "user_clusters": [
+            {"user_uri": uri, "cluster": int(cluster)}
+            for uri, cluster in zip(user_labels, labels)
+        ],
+        "embeddings_2d": user_embeddings_2d.tolist(),
+        "cluster_labels": [int(c) for c in labels.tolist()],
+        "parameters": {
+            "eps": eps,
+            "min_samples": min_samples,
+            "algorithm": algorithm,
+            "algorithm_parameters": engine_params,
+            "max_users": max_users,
+            "total_users_available": users.total_users,
+            "users_processed": len(user_ids),
+            "sampling_method": sampling_method,
+            "seed": seed,
+            "projection": projection,
+            "embedding_storage": embedding_storage,
+            "model_version": model.version
+        }
+    }
+    return results
+
+def k_distance_curve(neighbour_distances: np.ndarray, k: int) -> list:
+    """Sorted distance of every point to its k-th neighbour (itself included), downsampled."""
+    distances = np.sort(neighbour_distances[:, min(k, neighbour_distances.shape[1]) - 1])
+    positions = np.unique(np.linspace(0, len(distances) - 1, K_DISTANCE_POINTS).astype(int))
+    return [[int(i), float(distances[i])] for i in positions]
+
+def perform_sweep(model: LoadedModel, users: UserIndex, eps_values: list, min_samples_values: list,
+                  max_users: int = 100, sampling_method: str = "random", seed: int = DEFAULT_SEED,
+                  projection: str = "global", embedding_storage: str = None, progress=no_progress):
+    """
+    DBSCAN statistics for every (eps, min_samples) pair from a single pass.
+
+    The users are reduced once and their radius-neighbour graph is computed
+    once at the largest eps. DBSCAN then runs on that precomputed sparse
+    graph, which only keeps the edges within each eps, so no combination
+    repeats the neighbour search.
+    """
+    if not eps_values or not min_samples_values:
+        raise ValueError("eps_values and min_samples_values must not be empty")
+    if min(eps_values) <= 0 or min(min_samples_values) < 1:
+        raise ValueError("eps values must be positive and min_samples values at least 1")
+    if projection not in PROJECTIONS:
+        raise ValueError(f"Unknown projection {projection!r}, expected one of {list(PROJECTIONS)}")
+
+    progress("loading")
+    progress("user_selection", rows=len(users.rows))
+    embedding_storage = check_storage(embedding_storage)
+    user_ids, user_embeddings = select_users(model, users, max_users, sampling_method, seed, embedding_storage)
+    print(f"Sweeping {len(eps_values)} eps x {len(min_samples_values)} min_samples values over {len(user_ids)} users")
+
+    fitted = load_projection(model, users) if projection == "global" else None
+    user_embeddings_reduced = reduce_embeddings(user_embeddings, progress, fitted)
+
+    progress("neighbour_graph", rows=len(user_ids))
+    max_eps = max(eps_values)
+    max_k = min(max(min_samples_values), len(user_ids))
+    neighbours = NearestNeighbors(radius=max_eps).fit(user_embeddings_reduced)
+    graph = neighbours.radius_neighbors_graph(user_embeddings_reduced, mode="distance")
+    neighbour_distances, _ = neighbours.kneighbors(user_embeddings_reduced, n_neighbors=max_k)
+    curves = {k: k_distance_curve(neighbour_distances, k) for k in sorted(set(min_samples_values))}
+
+    progress("dbscan", rows=len(user_ids))
+    combinations = []
+    for eps in sorted(set(eps_values)):
+        for min_samples in sorted(set(min_samples_values)):
+            labels = DBSCAN(eps=eps, min_samples=min_samples, metric="precomputed").fit_predict(graph)
+            n_noise = int(np.sum(labels == -1))
+            combinations.append({
+                "eps": eps,
+                "min_samples": min_samples,
+                "n_clusters": len(set(labels.tolist()) - {-1}),
+                "noise_ratio": n_noise / len(labels) if len(labels) else 0.0,
+                "k_distance": curves[min_samples],
+            })
+
+    return {
+        "combinations": combinations,
+        "parameters": {
+            "eps_values": sorted(set(eps_values)),
+            "min_samples_values": sorted(set(min_samples_values)),
+            "max_users": max_users,
+            "total_users_available": users.total_users,
+            "users_processed": len(user_ids),
+            "sampling_method": sampling_method,
+            "seed": seed,
+            "projection": projection,
+            "embedding_storage": embedding_storage,
+            "graph_edges": int(graph.nnz),
+            "model_version": model.version
+        }
+    }
@@ -0,0 +1,166 @@
+# columnar.py
+"""
+Compact columnar binary encoding of clustering results.
+
+Clients opt in with `Accept: application/vnd.kg-clusters.columnar`, adding
+`; compression=zlib` to compress the body. The payload is:
+
+    b"KGC1"                   magic
+    uint32 little endian      length of the header
+    header                    UTF-8 JSON: row count, columns, compression,
+                              cluster_distribution and parameters
+    body                      the column buffers, zlib compressed as a whole
+                              when compression is "zlib"
+
+Every column is a little-endian array starting at an 8-byte aligned offset
+of the (decompressed) body, so clients can view it without copying, e.g.
+with `new Int32Array(body, offset, length)`. Columns:
+
+    cluster_labels        int32   (n,)
+    embeddings_2d         float32 (n, 2)
+    uri_prefix_ids        int32   (n,)    index into the prefix string table
+    uri_prefix_offsets    int64   (p + 1,)
+    uri_prefix_data       uint8           UTF-8 prefixes, prefix k is
+                                          data[offsets[k]:offsets[k + 1]]
+    uri_suffix_offsets    int64   (n + 1,)
+    uri_suffix_data       uint8           UTF-8 local name of each user URI
+
+A user URI is its prefix (everything up to the last "/" or "#") followed
+by its suffix, so the namespace shared by all users is sent once.
+"""
+import json
+import struct
+import zlib
+
+import numpy as np
+
+MEDIA_TYPE = "application/vnd.kg-clusters.columnar"
+MAGIC = b"KGC1"
+COMPRESSIONS = ("none", "zlib")
+ALIGNMENT = 8
+
+
+# Accept entries the JSON response satisfies
+JSON_MEDIA_TYPES = ("application/json", "application/*", "*/*")
+
+
+def negotiate(accept: str):
+    """
+    Compression requested for the columnar format in `accept`, or None for
+    JSON. Raises ValueError when `accept` allows neither format or asks for
+    an unsupported compression.
+    """
+    json_ok = not (accept or "").strip()
+    for entry in (accept or "").split(","):
+        media_type, *params = [part.strip() for part in entry.split(";")]
+        if media_type.lower() != MEDIA_TYPE:
+            json_ok = json_ok or media_type.lower() in JSON_MEDIA_TYPES
+            continue
+        compression = "none"
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "compression":
+                compression = value.strip().strip('"').lower()
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unsupported compression {compression!r}, expected one of {list(COMPRESSIONS)}")
+        return compression
+    if not json_ok:
+        raise ValueError(f"Cannot answer with {accept!r}, only application/json or {MEDIA_TYPE}")
+    return None
+
+
+def _split_uri(uri: str):
+    cut = max(uri.rfind("/"), uri.rfind("#")) + 1
+    return uri[:cut], uri[cut:]
+
+
+def _string_table(strings: list):
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def encode(results: dict, compression: str = "none") -> bytes:
+    """Encode a clustering result (the `data` of /cluster-users) as columnar bytes."""
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unsupported compression {compression!r}, expected one of {list(COMPRESSIONS)}")
+
+    uris = [user["user_uri"] for user in results["user_clusters"]]
+    prefix_ids = {}
+    uri_prefix_ids = np.empty(len(uris), dtype=np.int32)
+    suffixes = []
+    for i, uri in enumerate(uris):
+        prefix, suffix = _split_uri(uri)
+        uri_prefix_ids[i] = prefix_ids.setdefault(prefix, len(prefix_ids))
+        suffixes.append(suffix)
+    prefix_offsets, prefix_data = _string_table(list(prefix_ids))
+    suffix_offsets, suffix_data = _string_table(suffixes)
+
+    coords = np.asarray(results["embeddings_2d"], dtype=np.float32).reshape(len(uris), 2)
+    columns = [
+        ("cluster_labels", np.asarray(results["cluster_labels"], dtype=np.int32)),
+        ("embeddings_2d", coords),
+        ("uri_prefix_ids", uri_prefix_ids),
+        ("uri_prefix_offsets", prefix_offsets),
+        ("uri_prefix_data", prefix_data),
+        ("uri_suffix_offsets", suffix_offsets),
+        ("uri_suffix_data", suffix_data),
+    ]
+
+    body = bytearray()
+    described = []
+    for name, array in columns:
+        body.extend(b"\0" * (-len(body) % ALIGNMENT))
+        data = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<")).tobytes()
+        described.append({
+            "name": name,
+            "dtype": array.dtype.newbyteorder("<").str,
+            "shape": list(array.shape),
+            "offset": len(body),
+            "length": len(data),
+        })
+        body.extend(data)
+
+    header = json.dumps({
+        "rows": len(uris),
+        "compression": compression,
+        "body_length": len(body),
+        "columns": described,
+        "cluster_distribution": results["cluster_distribution"],
+        "parameters": results["parameters"],
+    }).encode("utf-8")
+    payload = zlib.compress(bytes(body), 6) if compression == "zlib" else bytes(body)
+    return MAGIC + struct.pack("<I", len(header)) + header + payload
+
+
+def decode(payload: bytes) -> dict:
+    """Inverse of `encode`, returning the usual JSON-shaped result."""
+    if payload[:4] != MAGIC:
+        raise ValueError("Not a columnar cluster payload")
+    (header_length,) = struct.unpack("<I", payload[4:8])
+    header = json.loads(payload[8:8 + header_length].decode("utf-8"))
+    body = payload[8 + header_length:]
+    if header["compression"] == "zlib":
+        body = zlib.decompress(body)
+
+    columns = {}
+    for column in header["columns"]:
+        data = body[column["offset"]:column["offset"] + column["length"]]
+        columns[column["name"]] = np.frombuffer(data, dtype=column["dtype"]).reshape(column["shape"])
+
+    def strings(name):
+        offsets = columns[f"{name}_offsets"]
+        data = columns[f"{name}_data"].tobytes()
+        return [data[offsets[k]:offsets[k + 1]].decode("utf-8") for k in range(len(offsets) - 1)]
+
+    prefixes = strings("uri_prefix")
+    uris = [prefixes[p] + s for p, s in zip(columns["uri_prefix_ids"], strings("uri_suffix"))]
+    labels = columns["cluster_labels"].tolist()
+    return {
+        "cluster_distribution": header["cluster_distribution"],
+        "user_clusters": [{"user_uri": uri, "cluster": label} for uri, label in zip(uris, labels)],
+        "embeddings_2d": columns["embeddings_2d"].astype(np.float64).tolist(),
+        "cluster_labels": labels,
+        "parameters": header["parameters"],
+    }
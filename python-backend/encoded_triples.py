@@ -0,0 +1,81 @@
+# encoded_triples.py
+"""
+Integer triples written next to the triples file by term_dictionary.py
+(download_kg.py --int-triples).
+
+triples.npy and the labels are memory-mapped, so the indexes built from the
+triples filter whole columns of ids and decode only the labels they keep
+instead of parsing every row of triples.tsv. They are used only while
+triples.json records the fingerprint of the triples file (the one the user
+index is keyed by); otherwise, or when they were never written, the callers
+fall back to reading the TSV. A model trained
+on these triples with their dictionary has the same entity ids, which then
+are its embedding rows without any label lookup.
+"""
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+from serving_artifact import LabelIndex, read_labels
+
+# Bytes hashed from each end of the triples file for its fingerprint
+FINGERPRINT_BYTES = 1 << 20
+
+
+@dataclass(frozen=True)
+class EncodedTriples:
+    triples: np.ndarray  # int64 (N, 3): head, relation, tail ids
+    entities: LabelIndex  # Ids are in label order, so id k is sorted label k
+    relations: LabelIndex
+
+    def pairs(self, relation: str):
+        """Head and tail ids of every triple of `relation`."""
+        r = self.relations.get(relation)
+        if r is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        rows = np.flatnonzero(self.triples[:, 1] == r)
+        return self.triples[rows, 0], self.triples[rows, 2]
+
+    def same_entity_ids(self, labels: LabelIndex) -> bool:
+        """Whether a model's entity labels have exactly the ids of this dictionary."""
+        return (len(labels) == len(self.entities)
+                and np.array_equal(labels.offsets, self.entities.offsets)
+                and np.array_equal(labels.ids, self.entities.ids)
+                and np.array_equal(labels.blob, self.entities.blob))
+
+    def subjects(self, relation: str, obj: str) -> np.ndarray:
+        """Sorted distinct head ids of the triples (?, relation, obj)."""
+        t = self.entities.get(obj)
+        heads, tails = self.pairs(relation)
+        if t is None:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(heads[tails == t])
+
+
+def triples_fingerprint(triples_path: str) -> str:
+    stat = os.stat(triples_path)
+    digest = hashlib.sha1(f"{stat.st_size}:{stat.st_mtime_ns};".encode())
+    with open(triples_path, "rb") as f:
+        digest.update(f.read(FINGERPRINT_BYTES))
+        if stat.st_size > FINGERPRINT_BYTES:
+            f.seek(max(FINGERPRINT_BYTES, stat.st_size - FINGERPRINT_BYTES))
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def load_encoded_triples(triples_path: str):
+    """The encoded triples of `triples_path`, or None if there are none up to date."""
+    data_dir = os.path.dirname(triples_path) or "."
+    meta_path = os.path.join(data_dir, "triples.json")
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("source_fingerprint") != triples_fingerprint(triples_path):
+            return None
+        triples = np.load(os.path.join(data_dir, "triples.npy"), mmap_mode="r")
+        return EncodedTriples(triples, read_labels(data_dir, "entity"), read_labels(data_dir, "relation"))
+    except (OSError, ValueError):
+        return None
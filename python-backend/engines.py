@@ -0,0 +1,77 @@
+# engines.py
+"""
+Clustering algorithms selectable through `ClusteringRequest.algorithm`.
+
+Each engine lists the request parameters it uses; `resolve_params` fills in
+defaults and validates them, and `build_engine` returns an unfitted
+scikit-learn estimator with a `fit_predict` method.
+"""
+from sklearn.cluster import DBSCAN, Birch, MiniBatchKMeans
+
+DEFAULTS = {
+    "eps": 4.0,
+    "min_samples": 5,
+    "min_cluster_size": 5,
+    "n_clusters": 8,
+    "batch_size": 1024,
+    "threshold": 0.5,
+    "branching_factor": 50,
+}
+
+# Smallest accepted value of each parameter, and whether it must be an integer
+LIMITS = {
+    "eps": (0.0, False),
+    "min_samples": (1, True),
+    "min_cluster_size": (2, True),
+    "n_clusters": (1, True),
+    "batch_size": (1, True),
+    "threshold": (0.0, False),
+    "branching_factor": (2, True),
+}
+
+ENGINE_PARAMS = {
+    "dbscan": ("eps", "min_samples"),
+    "hdbscan": ("min_cluster_size", "min_samples"),
+    "minibatch_kmeans": ("n_clusters", "batch_size"),
+    "birch": ("threshold", "branching_factor", "n_clusters"),
+}
+
+
+def resolve_params(algorithm: str, **given) -> dict:
+    """Parameters of `algorithm` taken from `given`, with defaults for the missing ones."""
+    if algorithm not in ENGINE_PARAMS:
+        raise ValueError(f"Unknown algorithm {algorithm!r}, expected one of {sorted(ENGINE_PARAMS)}")
+
+    params = {}
+    for name in ENGINE_PARAMS[algorithm]:
+        value = given.get(name)
+        value = DEFAULTS[name] if value is None else value
+        minimum, integer = LIMITS[name]
+        if integer and int(value) != value:
+            raise ValueError(f"{name} must be an integer for {algorithm}, got {value}")
+        if value < minimum or (not integer and value == minimum):
+            bound = f">= {minimum}" if integer else f"> {minimum}"
+            raise ValueError(f"{name} must be {bound} for {algorithm}, got {value}")
+        params[name] = int(value) if integer else float(value)
+    return params
+
+
+def build_engine(algorithm: str, params: dict, n_features: int, seed: int = None):
+    if algorithm == "dbscan":
+        # Tree index instead of brute force; ball trees cope better past ~20 dims
+        tree = "kd_tree" if n_features <= 20 else "ball_tree"
+        return DBSCAN(eps=params["eps"], min_samples=params["min_samples"], algorithm=tree)
+    if algorithm == "hdbscan":
+        try:
+            from sklearn.cluster import HDBSCAN
+        except ImportError:
+            raise ValueError("hdbscan needs scikit-learn >= 1.3")
+        # The reduced embeddings are private to this request, no need to copy them
+        return HDBSCAN(min_cluster_size=params["min_cluster_size"], min_samples=params["min_samples"], copy=False)
+    if algorithm == "minibatch_kmeans":
+        return MiniBatchKMeans(n_clusters=params["n_clusters"], batch_size=params["batch_size"],
+                               n_init=3, random_state=seed)
+    if algorithm == "birch":
+        return Birch(threshold=params["threshold"], branching_factor=params["branching_factor"],
+                     n_clusters=params["n_clusters"])
+    raise ValueError(f"Unknown algorithm {algorithm!r}")
@@ -0,0 +1,60 @@
+# export_artifact.py
+"""
+Convert a PyKEEN `save_to_directory` output into a serving artifact.
+
+    python export_artifact.py [model_dir] [serving_dir]
+
+Defaults to ./data/kg and ./data/kg/serving. The new version is activated
+immediately, so a running backend picks it up on its next poll.
+"""
+import os
+import sys
+
+import pandas as pd
+import torch
+
+from serving_artifact import write_artifact
+
+
+def read_mapping(path: str) -> dict:
+    # Labels can look like numbers or "NA", keep them as plain strings
+    df = pd.read_csv(path, sep='\t', compression='gzip', header=0, dtype=str, keep_default_na=False)
+    return dict(zip(df.iloc[:, 1], df.iloc[:, 0].astype(int)))
+
+
+def scoring_norm(pykeen_model):
+    p = getattr(getattr(pykeen_model, "interaction", None), "p", None)
+    return int(p) if p is not None else None
+
+
+def export(model_dir: str, serving_dir: str) -> str:
+    print("Loading model...")
+    pykeen_model = torch.load(f"{model_dir}/trained_model.pkl", weights_only=False, map_location=torch.device('cpu'))
+    with torch.no_grad():
+        entity_embeddings = pykeen_model.entity_representations[0]().detach().cpu().numpy()
+        relation_embeddings = pykeen_model.relation_representations[0]().detach().cpu().numpy()
+
+    print("Loading mappings...")
+    ent_to_id = read_mapping(f"{model_dir}/training_triples/entity_to_id.tsv.gz")
+    rel_to_id = read_mapping(f"{model_dir}/training_triples/relation_to_id.tsv.gz")
+
+    print(f"Writing artifact for {len(ent_to_id)} entities and {len(rel_to_id)} relations...")
+    return write_artifact(
+        serving_dir,
+        ent_to_id,
+        entity_embeddings,
+        rel_to_id,
+        relation_embeddings,
+        metadata={
+            "model": type(pykeen_model).__name__,
+            "scoring_fct_norm": scoring_norm(pykeen_model),
+            "source": os.path.abspath(model_dir),
+        },
+    )
+
+
+if __name__ == "__main__":
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "./data/kg"
+    serving_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.join(model_dir, "serving")
+    version = export(model_dir, serving_dir)
+    print(f"Serving artifact {version} written to {serving_dir}")
@@ -0,0 +1,245 @@
+# jobs.py
+"""
+Clustering, sweep and streaming jobs executed in a bounded process pool.
+
+The server process only keeps job bookkeeping; the CPU-bound work runs in
+worker processes that memory map the same serving artifact. Workers report
+the stage they are in through a shared dict, and check a shared set of
+cancelled job ids whenever they start a new stage. Each stage is also timed
+(see metrics.py) and the timings come back with the result.
+
+If a worker dies (OOM kill, crash in native code) the pool fails every job
+it holds with BrokenProcessPool and refuses new ones, so the manager replaces
+it with a fresh pool.
+"""
+import multiprocessing
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from clustering import STAGES, SWEEP_STAGES, perform_clustering, perform_sweep
+from metrics import REGISTRY, StageRecorder
+from streaming import STREAM_STAGES, perform_streaming_clustering
+from model_registry import load_model
+from user_index import UserIndexCache
+
+TERMINAL_STATUSES = ("succeeded", "failed", "cancelled")
+
+# Function run for each kind of job and the stages it reports
+JOB_KINDS = {
+    "clustering": (perform_clustering, STAGES),
+    "sweep": (perform_sweep, SWEEP_STAGES),
+    "stream": (perform_streaming_clustering, STREAM_STAGES),
+}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobLimitExceeded(Exception):
+    pass
+
+
+# Worker process state, one model and user index per worker
+_worker_model = None
+_worker_users = None
+
+
+def _worker_progress(job_id: str, progress_state, cancelled, recorder: StageRecorder):
+    def progress(stage: str, rows: int = None):
+        if job_id in cancelled:
+            raise JobCancelled(f"Job {job_id} was cancelled")
+        recorder.start(stage, rows)
+        progress_state[job_id] = stage
+    return progress
+
+
+def run_job(kind: str, job_id: str, model_path: str, model_version: str, triples_path: str,
+            params: dict, progress_state, cancelled, trace_memory: bool = False):
+    global _worker_model, _worker_users
+
+    recorder = StageRecorder(trace_memory)
+    try:
+        progress = _worker_progress(job_id, progress_state, cancelled, recorder)
+        progress("loading")
+        if _worker_model is None or _worker_model.version != model_version:
+            _worker_model = load_model(model_path, model_version)
+        if _worker_users is None or _worker_users.triples_path != triples_path:
+            _worker_users = UserIndexCache(triples_path)
+
+        run, _ = JOB_KINDS[kind]
+        result = run(_worker_model, _worker_users.get(_worker_model), progress=progress, **params)
+    finally:
+        recorder.close()
+    return result, recorder.stages
+
+
+class Job:
+    def __init__(self, job_id: str, kind: str, params: dict, future):
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        self.future = future
+        self.submitted_at = time.time()
+        self.finished_at = None
+
+
+class JobManager:
+    """
+    Submits jobs to a process pool of `max_workers` processes and refuses new
+    ones once `max_jobs` are queued or running. Finished jobs are kept for
+    polling until `max_finished` newer ones have completed. With `trace_memory`
+    every job traces the memory its stages allocate, not only debug ones.
+    """
+
+    def __init__(self, model_path: str, triples_path: str, max_workers: int = 2,
+                 max_jobs: int = 8, max_finished: int = 100, trace_memory: bool = False):
+        self.model_path = model_path
+        self.triples_path = triples_path
+        self.trace_memory = trace_memory
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self.max_finished = max_finished
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._manager = None
+        self._context = None
+        self._executor = None
+        self._progress = None
+        self._cancelled = None
+
+    def start(self):
+        # Spawned workers do not inherit the server's threads or open sockets
+        self._context = multiprocessing.get_context("spawn")
+        self._manager = self._context.Manager()
+        self._progress = self._manager.dict()
+        self._cancelled = self._manager.dict()
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self._context)
+
+    def _replace_broken(self, executor):
+        # Called with the lock held; the pool may already have been replaced or stopped
+        if self._executor is not executor:
+            return
+        print("A job worker died, starting a new process pool")
+        executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self._context)
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+
+    def submit(self, kind: str, params: dict, model_version: str, trace_memory: bool = False) -> Job:
+        with self._lock:
+            active = sum(1 for job in self._jobs.values() if not job.future.done())
+            if active >= self.max_jobs:
+                raise JobLimitExceeded(f"Too many jobs in progress ({active}), try again later")
+
+            job_id = uuid.uuid4().hex
+            args = (run_job, kind, job_id, self.model_path, model_version, self.triples_path,
+                    params, self._progress, self._cancelled, self.trace_memory or trace_memory)
+            executor = self._executor
+            try:
+                future = executor.submit(*args)
+            except BrokenProcessPool:
+                self._replace_broken(executor)
+                executor = self._executor
+                future = executor.submit(*args)
+            job = Job(job_id, kind, params, future)
+            self._jobs[job_id] = job
+
+        future.add_done_callback(lambda _: self._finished(job, executor))
+        return job
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None or job.future.done():
+            return False
+        if not job.future.cancel():
+            # Already running, the worker stops when it reaches its next stage
+            self._cancelled[job_id] = True
+        return True
+
+    def _outcome(self, job: Job):
+        """Terminal status of a finished job, None while it is queued or running."""
+        if job.future.cancelled():
+            return "cancelled"
+        if not job.future.done():
+            return None
+        error = job.future.exception()
+        if isinstance(error, JobCancelled):
+            return "cancelled"
+        return "failed" if error is not None else "succeeded"
+
+    def status(self, job: Job) -> dict:
+        _, stages = JOB_KINDS[job.kind]
+        stage = self._progress.get(job.id)
+        status = self._outcome(job)
+        if status is None:
+            status = "running" if stage is not None else "queued"
+
+        if status == "succeeded":
+            completed = len(stages)
+        elif stage in stages:
+            completed = stages.index(stage)
+        else:
+            completed = 0
+
+        snapshot = {
+            "job_id": job.id,
+            "kind": job.kind,
+            "status": status,
+            "stage": stage,
+            "progress": completed / len(stages),
+            "stages": list(stages),
+            "parameters": job.params,
+            "submitted_at": job.submitted_at,
+            "finished_at": job.finished_at,
+        }
+        if status == "failed":
+            error = job.future.exception()
+            snapshot["message"] = (f"The worker running the job died: {error}"
+                                   if isinstance(error, BrokenProcessPool) else str(error))
+        return snapshot
+
+    def result(self, job: Job):
+        try:
+            return job.future.result()[0]
+        except CancelledError:
+            raise JobCancelled(f"Job {job.id} was cancelled")
+
+    def stage_metrics(self, job: Job) -> list:
+        """Time, peak memory and rows of each stage of a job that succeeded."""
+        return job.future.result()[1]
+
+    def _finished(self, job: Job, executor):
+        job.finished_at = time.time()
+        status = self._outcome(job)
+        REGISTRY.record_job(job.kind, status)
+        if status == "succeeded":
+            REGISTRY.record_stages(job.kind, self.stage_metrics(job))
+        with self._lock:
+            if status == "failed" and isinstance(job.future.exception(), BrokenProcessPool):
+                self._replace_broken(executor)
+            finished = [j for j in self._jobs.values() if j.future.done()]
+            finished.sort(key=lambda j: j.finished_at or 0)
+            for old in finished[:max(0, len(finished) - self.max_finished)]:
+                del self._jobs[old.id]
+                self._forget(old.id)
+
+    def _forget(self, job_id: str):
+        if self._manager is None:
+            return
+        self._progress.pop(job_id, None)
+        self._cancelled.pop(job_id, None)
+
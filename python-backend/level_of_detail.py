@@ -0,0 +1,100 @@
+# level_of_detail.py
+"""
+Screen-sized summaries of a 2D clustering for plotting.
+
+Instead of every point, `level_of_detail` returns, for each cluster, the
+non-empty cells of a `grid_width` x `grid_height` density grid over a
+bounding box, plus a capped random sample of its users to draw as markers.
+Zooming is a new call with a smaller bounding box, which re-bins only the
+points inside it. The response size depends on the grid and sample sizes,
+not on the number of users.
+"""
+import numpy as np
+
+MAX_GRID_SIZE = 2048
+MAX_SAMPLES_PER_CLUSTER = 10000
+
+
+def _bounding_box(coords: np.ndarray, bbox):
+    if bbox is not None:
+        if len(bbox) != 4 or bbox[0] >= bbox[2] or bbox[1] >= bbox[3]:
+            raise ValueError("bbox must be [x_min, y_min, x_max, y_max] with min < max")
+        return [float(v) for v in bbox]
+    if len(coords) == 0:
+        return [0.0, 0.0, 1.0, 1.0]
+    x_min, y_min = coords.min(axis=0)
+    x_max, y_max = coords.max(axis=0)
+    # Degenerate extents would give zero-width cells
+    pad_x = 0.5 if x_max == x_min else 0.0
+    pad_y = 0.5 if y_max == y_min else 0.0
+    return [float(x_min - pad_x), float(y_min - pad_y), float(x_max + pad_x), float(y_max + pad_y)]
+
+
+def level_of_detail(labels, coords, user_uris, grid_width: int = 256, grid_height: int = 256,
+                    bbox=None, samples_per_cluster: int = 100, seed: int = 0) -> dict:
+    """
+    `labels` and `coords` are the cluster and 2D position of every user;
+    `user_uris(indices)` returns the URIs of the given user positions, so
+    only the sampled users are ever looked up.
+    """
+    if not 1 <= grid_width <= MAX_GRID_SIZE or not 1 <= grid_height <= MAX_GRID_SIZE:
+        raise ValueError(f"grid_width and grid_height must be between 1 and {MAX_GRID_SIZE}")
+    if not 0 <= samples_per_cluster <= MAX_SAMPLES_PER_CLUSTER:
+        raise ValueError(f"samples_per_cluster must be between 0 and {MAX_SAMPLES_PER_CLUSTER}")
+
+    labels = np.asarray(labels)
+    coords = np.asarray(coords, dtype=np.float64).reshape(len(labels), 2)
+    x_min, y_min, x_max, y_max = box = _bounding_box(coords, bbox)
+
+    inside = np.flatnonzero(
+        (coords[:, 0] >= x_min) & (coords[:, 0] <= x_max) &
+        (coords[:, 1] >= y_min) & (coords[:, 1] <= y_max)
+    )
+    clusters, cluster_of = np.unique(labels[inside], return_inverse=True)
+
+    # Cell of every point inside the box; points on the upper edge go in the last cell
+    x_bins = np.minimum(((coords[inside, 0] - x_min) / (x_max - x_min) * grid_width).astype(np.int64), grid_width - 1)
+    y_bins = np.minimum(((coords[inside, 1] - y_min) / (y_max - y_min) * grid_height).astype(np.int64), grid_height - 1)
+    cells = grid_width * grid_height
+    keys, counts = np.unique(cluster_of * cells + x_bins * grid_height + y_bins, return_counts=True)
+    key_cluster, key_cell = np.divmod(keys, cells)
+    bounds = np.searchsorted(key_cluster, np.arange(len(clusters) + 1))
+
+    # Capped random sample per cluster: the points with the smallest random keys
+    rng = np.random.default_rng(seed)
+    order = np.lexsort((rng.random(len(inside)), cluster_of))
+    starts = np.searchsorted(cluster_of[order], np.arange(len(clusters) + 1))
+    sizes = np.maximum(np.diff(starts), 1)
+    centroids = np.stack([
+        np.bincount(cluster_of, weights=coords[inside, 0], minlength=len(clusters)) / sizes,
+        np.bincount(cluster_of, weights=coords[inside, 1], minlength=len(clusters)) / sizes,
+    ], axis=1)
+
+    result_clusters = []
+    for c, cluster in enumerate(clusters):
+        cell = key_cell[bounds[c]:bounds[c + 1]]
+        sample = inside[order[starts[c]:min(starts[c + 1], starts[c] + samples_per_cluster)]]
+        result_clusters.append({
+            "cluster": int(cluster),
+            "count": int(starts[c + 1] - starts[c]),
+            "centroid": centroids[c].tolist(),
+            "grid": {
+                "x": (cell // grid_height).tolist(),
+                "y": (cell % grid_height).tolist(),
+                "count": counts[bounds[c]:bounds[c + 1]].tolist(),
+            },
+            "sample": {
+                "user_uris": list(user_uris(sample)),
+                "embeddings_2d": coords[sample].tolist(),
+            },
+        })
+
+    return {
+        "bbox": box,
+        "grid_width": grid_width,
+        "grid_height": grid_height,
+        "cell_size": [(x_max - x_min) / grid_width, (y_max - y_min) / grid_height],
+        "users_in_bbox": int(len(inside)),
+        "total_users": int(len(labels)),
+        "clusters": result_clusters,
+    }
@@ -1,21 +1,59 @@
 # main.py
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+import asyncio
+import json
+import time
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
-import pandas as pd
-import torch
-import numpy as np
-from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import DBSCAN
-from sklearn.decomposition import PCA
-import io
-import base64
-from pykeen.datasets import Nations
-from pykeen.pipeline import pipeline
-from pykeen.triples import TriplesFactory
-
-app = FastAPI()
+from typing import List, Optional
+import os
+from model_registry import ModelRegistry
+from user_index import UserIndexCache
+from clustering import DEFAULT_SEED
+from quantization import check_storage
+from engines import resolve_params
+from streaming import read_streaming_lod, read_streaming_result
+from level_of_detail import level_of_detail
+from profiles import cluster_profiles, load_profile_index
+from ann_index import similar_users
+from recommend import recommend
+import columnar
+from result_cache import ResultCache
+from jobs import TERMINAL_STATUSES, JobLimitExceeded, JobManager
+from metrics import REGISTRY
+
+# Update these paths to your actual file locations
+MODEL_PATH = os.environ.get("KG_MODEL_PATH", "./data/kg")
+TRIPLES_PATH = os.environ.get("KG_TRIPLES_PATH", "../data/triples.tsv")
+RESULTS_PATH = os.environ.get("KG_RESULTS_PATH", "./data/results")
+
+registry = ModelRegistry(MODEL_PATH, poll_interval=float(os.environ.get("KG_MODEL_POLL_SECONDS", "10")))
+user_indexes = UserIndexCache(TRIPLES_PATH)
+results_cache = ResultCache(max_entries=int(os.environ.get("KG_RESULT_CACHE_SIZE", "64")))
+job_manager = JobManager(
+    MODEL_PATH,
+    TRIPLES_PATH,
+    max_workers=int(os.environ.get("KG_JOB_WORKERS", "2")),
+    max_jobs=int(os.environ.get("KG_MAX_JOBS", "8")),
+    trace_memory=os.environ.get("KG_TRACE_MEMORY", "0") == "1",
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    registry.start()
+    try:
+        user_indexes.get(registry.current())
+    except OSError as e:
+        print(f"User index not loaded yet: {e}")
+    job_manager.start()
+    yield
+    job_manager.stop()
+    registry.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -25,127 +63,314 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # The route template, not the raw path, so job ids do not each get a series
+    route = request.scope.get("route")
+    path = getattr(route, "path", "unmatched")
+    REGISTRY.record_request(request.method, path, response.status_code, time.perf_counter() - started)
+    return response
+
+class SweepRequest(BaseModel):
+    eps_values: List[float] = [2.0, 3.0, 4.0, 5.0, 6.0]
+    min_samples_values: List[int] = [3, 5, 10]
+    max_users: Optional[int] = 100
+    sampling_method: Optional[str] = "random"  # "random" or "first"
+    seed: Optional[int] = None
+    projection: Optional[str] = "global"  # "global" or "local"
+    embedding_storage: Optional[str] = None  # "float32", "float16" or "int8", defaults to KG_EMBEDDING_STORAGE
+    debug: Optional[bool] = False  # Add the time, peak memory and rows of each stage to `parameters`
+
+class StreamingClusteringRequest(BaseModel):
+    n_clusters: Optional[int] = 8
+    chunk_size: Optional[int] = 65536  # Users held in memory at a time
+    epochs: Optional[int] = 3
+    seed: Optional[int] = None
+    embedding_storage: Optional[str] = None
+
 class ClusteringRequest(BaseModel):
     eps: Optional[float] = 4.0
     min_samples: Optional[int] = 5
     max_users: Optional[int] = 100  # New parameter to limit users
     sampling_method: Optional[str] = "random"  # "random" or "first"
+    seed: Optional[int] = None  # Seed for "random" sampling, defaults to DEFAULT_SEED
+    # "dbscan", "hdbscan", "minibatch_kmeans" or "birch"; see engines.py for defaults
+    algorithm: Optional[str] = "dbscan"
+    min_cluster_size: Optional[int] = None  # hdbscan
+    n_clusters: Optional[int] = None  # minibatch_kmeans, birch
+    batch_size: Optional[int] = None  # minibatch_kmeans
+    threshold: Optional[float] = None  # birch
+    branching_factor: Optional[int] = None  # birch
+    # "global" reuses the projection fitted over all users, "local" refits on the sample
+    projection: Optional[str] = "global"
+    # "float32", "float16" or "int8" user embeddings, defaults to KG_EMBEDDING_STORAGE
+    embedding_storage: Optional[str] = None
+    debug: Optional[bool] = False  # Add the time, peak memory and rows of each stage to `parameters`
+
+class LevelOfDetailRequest(ClusteringRequest):
+    max_users: Optional[int] = 0  # All users: the response is the size of the grid, not of the clustering
+    # Density grid size, roughly the plot size in pixels divided by the marker size
+    grid_width: Optional[int] = 256
+    grid_height: Optional[int] = 256
+    bbox: Optional[List[float]] = None  # [x_min, y_min, x_max, y_max] to zoom into, defaults to all points
+    samples_per_cluster: Optional[int] = 100  # Users sent as individual points per cluster
+
+class ProfileRequest(ClusteringRequest):
+    top_k: Optional[int] = 5  # Most liked items per category and cluster
 
-def perform_clustering(model_path: str, triples_path: str, eps: float = 4.0, min_samples: int = 5, 
-                      max_users: int = 100, sampling_method: str = "random"):
-    # Load model and data
-    print("Loading model...")
-    pykeen_model = torch.load(f"{model_path}/trained_model.pkl",weights_only=False, map_location=torch.device('cpu'))
-    
-    print("Loading mappings...")
-    rel_df = pd.read_csv(f"{model_path}/training_triples/relation_to_id.tsv.gz", 
-                        sep='\t', compression='gzip', header=0)
-    rel_to_id = dict(zip(rel_df.iloc[:, 1], rel_df.iloc[:, 0]))
-    
-    ent_df = pd.read_csv(f"{model_path}/training_triples/entity_to_id.tsv.gz",
-                        sep='\t', compression='gzip', header=0)
-    ent_to_id = dict(zip(ent_df.iloc[:, 1], ent_df.iloc[:, 0]))
-
-    # Get embeddings
-    entity_embeddings = pykeen_model.entity_representations[0]().detach().cpu().numpy()
-    print("Reading triples...")
-    # Load and filter triples
-    triples = pd.read_csv(
-        triples_path,
-        sep='\t',
-        header=None,
-        names=["head", "relation", "tail"],
-        dtype=str
-    )
-    
-    user_entities = set(triples[
-        (triples["relation"] == "http://www.w3.org/1999/02/22-rdf-syntax-ns#type") &
-        (triples["tail"] == "http://sdm_upc.org/ontology/User")
-    ]["head"])
-
-    print(f"Found {len(user_entities)} total users")
-
-    # Prepare user data with sampling
-    user_ids = []
-    user_labels = []
-    for label, idx in ent_to_id.items():
-        if label in user_entities:
-            user_ids.append(idx)
-            user_labels.append(label)
-
-    # Apply user limit
-    if max_users > 0 and len(user_ids) > max_users:
-        print(f"Limiting to {max_users} users (from {len(user_ids)} total)")
-        
-        if sampling_method == "random":
-            # Random sampling
-            indices = np.random.choice(len(user_ids), size=max_users, replace=False)
-            user_ids = [user_ids[i] for i in indices]
-            user_labels = [user_labels[i] for i in indices]
-        else:
-            # Take first N users
-            user_ids = user_ids[:max_users]
-            user_labels = user_labels[:max_users]
-
-    print(f"Processing {len(user_ids)} users for clustering")
-
-    user_embeddings = entity_embeddings[user_ids]
-    
-    # Process embeddings
-    scaler = StandardScaler()
-    user_embeddings_scaled = scaler.fit_transform(user_embeddings)
-    
-    # Adjust PCA components based on user count
-    n_components = min(50, len(user_ids) - 1)  # Ensure we don't exceed user count
-    pca = PCA(n_components=n_components)
-    user_embeddings_reduced = pca.fit_transform(user_embeddings_scaled)
-    
-    # Cluster with configurable parameters
-    print(f"Running DBSCAN with eps={eps}, min_samples={min_samples}")
-    dbscan = DBSCAN(eps=eps, min_samples=min_samples)
-    labels = dbscan.fit_predict(user_embeddings_reduced)
-    
-    # Prepare results
-    unique, counts = np.unique(labels, return_counts=True)
-    cluster_distribution = dict(zip(unique, counts))
-    
-    pca_2d = PCA(n_components=2)
-    user_embeddings_2d = pca_2d.fit_transform(user_embeddings_reduced)
-    
-    results = {
-        "cluster_distribution": {int(k): int(v) for k, v in cluster_distribution.items()},
-        "user_clusters": [
-            {"user_uri": uri, "cluster": int(cluster)}
-            for uri, cluster in zip(user_labels, labels)
-        ],
-        "embeddings_2d": user_embeddings_2d.tolist(),
-        "cluster_labels": [int(c) for c in labels.tolist()],
-        "parameters": {
-            "eps": eps,
-            "min_samples": min_samples,
-            "max_users": max_users,
-            "total_users_available": len(user_entities),
-            "users_processed": len(user_ids),
-            "sampling_method": sampling_method
-        }
+class SimilarUsersRequest(BaseModel):
+    user_uris: List[str]
+    k: Optional[int] = 10
+    nprobe: Optional[int] = 8  # Index lists scanned per query, more is slower but more accurate
+    report_recall: Optional[bool] = True  # Also run exact search and report the recall
+
+class RecommendationRequest(BaseModel):
+    user_uris: List[str]
+    relation: str = "likes_movie"  # likes_movie, likes_team, likes_genre, likes_competition or interested_in
+    k: Optional[int] = 10
+    filter_known: Optional[bool] = True  # Leave out what the users already like
+
+def sampling_params(request) -> dict:
+    # The seed only matters, and only splits the cache, for random sampling
+    seed = DEFAULT_SEED if request.seed is None else request.seed
+    return {
+        "max_users": request.max_users,
+        "sampling_method": request.sampling_method,
+        "seed": seed if request.sampling_method == "random" else None,
+        "projection": request.projection,
+        "embedding_storage": check_storage(request.embedding_storage),
     }
-    return results
 
+def clustering_params(request: ClusteringRequest) -> dict:
+    params = {
+        "eps": request.eps,
+        "min_samples": request.min_samples,
+        "algorithm": request.algorithm,
+        "min_cluster_size": request.min_cluster_size,
+        "n_clusters": request.n_clusters,
+        "batch_size": request.batch_size,
+        "threshold": request.threshold,
+        "branching_factor": request.branching_factor,
+        **sampling_params(request),
+    }
+    # Fail fast on invalid engine parameters instead of inside a job
+    resolve_params(**{k: v for k, v in params.items() if k not in sampling_params(request)})
+    return params
+
+def sweep_params(request: SweepRequest) -> dict:
+    return {
+        "eps_values": request.eps_values,
+        "min_samples_values": request.min_samples_values,
+        **sampling_params(request),
+    }
+
+def error_response(status_code: int, message: str):
+    return JSONResponse(status_code=status_code, content={"status": "error", "message": message})
+
+def cluster_response(results: dict, compression: str = None):
+    # Plain JSON unless the client asked for the columnar binary format
+    started = time.perf_counter()
+    if compression is None:
+        response = JSONResponse(content={"status": "success", "data": results})
+    else:
+        response = Response(content=columnar.encode(results, compression), media_type=columnar.MEDIA_TYPE)
+    REGISTRY.record_stages("clustering", [{
+        "stage": "encoding",
+        "seconds": time.perf_counter() - started,
+        "peak_memory_bytes": None,
+        "peak_rss_bytes": None,
+        "rows": len(results["cluster_labels"]),
+    }])
+    return response
+
+def run_job_with_metrics(kind: str, params: dict, model_version: str, trace_memory: bool = False):
+    job = job_manager.submit(kind, params, model_version, trace_memory)
+    return job_manager.result(job), job_manager.stage_metrics(job)
+
+def run_cached(kind: str, params: dict, debug: bool = False):
+    model = registry.current()
+    users = user_indexes.get(model)
+    key = (kind, json.dumps(params, sort_keys=True), model.version, users.fingerprint)
+    # The work itself runs in the job pool, off the server process. Debug runs trace their memory;
+    # a debug request answered from the cache gets the stages of the run that filled it
+    results, stages = results_cache.get_or_compute(
+        key, lambda: run_job_with_metrics(kind, params, model.version, trace_memory=debug))
+    if not debug:
+        return results
+    # Cached results are shared, so the stages go on a copy
+    return {**results, "parameters": {**results["parameters"], "stages": stages}}
+
+# Declared sync so FastAPI runs it in its threadpool instead of on the event loop
 @app.post("/cluster-users")
-async def cluster_users(request: ClusteringRequest = ClusteringRequest()):
+def cluster_users(http_request: Request, request: ClusteringRequest = ClusteringRequest()):
+    # Before any work, so an unsupported Accept does not cost a clustering
     try:
-        # Update these paths to your actual file locations
-        model_path = "./data/kg"
-        triples_path = "../data/triples.tsv"
-        
-        results = perform_clustering(
-            model_path, 
-            triples_path, 
-            eps=request.eps, 
-            min_samples=request.min_samples,
-            max_users=request.max_users,
-            sampling_method=request.sampling_method
+        compression = columnar.negotiate(http_request.headers.get("accept"))
+    except ValueError as e:
+        return error_response(406, str(e))
+    try:
+        results = run_cached("clustering", clustering_params(request), request.debug)
+        return cluster_response(results, compression)
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@app.post("/cluster-users/lod")
+def cluster_users_lod(request: LevelOfDetailRequest = LevelOfDetailRequest()):
+    try:
+        # Zooming re-bins the cached clustering, it does not recompute it
+        results = run_cached("clustering", clustering_params(request), request.debug)
+        uris = [user["user_uri"] for user in results["user_clusters"]]
+        lod = level_of_detail(
+            results["cluster_labels"], results["embeddings_2d"], lambda sample: [uris[i] for i in sample],
+            grid_width=request.grid_width, grid_height=request.grid_height, bbox=request.bbox,
+            samples_per_cluster=request.samples_per_cluster, seed=DEFAULT_SEED,
         )
+        lod["cluster_distribution"] = results["cluster_distribution"]
+        lod["parameters"] = results["parameters"]
+        return {"status": "success", "data": lod}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@app.post("/cluster-profiles")
+def cluster_users_with_profiles(request: ProfileRequest = ProfileRequest()):
+    try:
+        results = run_cached("clustering", clustering_params(request), request.debug)
+        model = registry.current()
+        index = load_profile_index(model, user_indexes.get(model), TRIPLES_PATH)
+        rows = [model.entities.get(user["user_uri"]) for user in results["user_clusters"]]
+        profiles = cluster_profiles(index, rows, results["cluster_labels"], request.top_k)
+        return {"status": "success", "data": {**results, "cluster_profiles": profiles}}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@app.post("/similar-users")
+def get_similar_users(request: SimilarUsersRequest):
+    try:
+        model = registry.current()
+        results = similar_users(model, user_indexes.get(model), request.user_uris, request.k,
+                                request.nprobe, request.report_recall)
+        return {"status": "success", "data": results}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@app.post("/recommendations")
+def get_recommendations(request: RecommendationRequest):
+    try:
+        model = registry.current()
+        index = load_profile_index(model, user_indexes.get(model), TRIPLES_PATH)
+        results = recommend(model, index, request.user_uris, request.relation, request.k, request.filter_known)
         return {"status": "success", "data": results}
     except Exception as e:
-        return {"status": "error", "message": str(e)}
\ No newline at end of file
+        return {"status": "error", "message": str(e)}
+
+@app.post("/cluster-sweep")
+def cluster_sweep(request: SweepRequest = SweepRequest()):
+    try:
+        results = run_cached("sweep", sweep_params(request), request.debug)
+        return {"status": "success", "data": results}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@app.post("/cluster-jobs")
+def submit_cluster_job(request: ClusteringRequest = ClusteringRequest()):
+    try:
+        job = job_manager.submit("clustering", clustering_params(request), registry.current().version,
+                                 trace_memory=request.debug)
+    except ValueError as e:
+        return error_response(400, str(e))
+    except JobLimitExceeded as e:
+        return error_response(429, str(e))
+    return {"status": "success", "data": job_manager.status(job)}
+
+@app.post("/cluster-stream-jobs")
+def submit_streaming_job(request: StreamingClusteringRequest = StreamingClusteringRequest()):
+    params = {
+        "results_path": RESULTS_PATH,
+        "n_clusters": request.n_clusters,
+        "chunk_size": request.chunk_size,
+        "epochs": request.epochs,
+        "seed": DEFAULT_SEED if request.seed is None else request.seed,
+    }
+    try:
+        params["embedding_storage"] = check_storage(request.embedding_storage)
+        job = job_manager.submit("stream", params, registry.current().version)
+    except ValueError as e:
+        return error_response(400, str(e))
+    except JobLimitExceeded as e:
+        return error_response(429, str(e))
+    return {"status": "success", "data": job_manager.status(job)}
+
+@app.get("/cluster-stream-results/{name}")
+def get_streaming_result(http_request: Request, name: str, offset: int = 0, limit: int = 1000):
+    try:
+        compression = columnar.negotiate(http_request.headers.get("accept"))
+    except ValueError as e:
+        return error_response(406, str(e))
+    try:
+        results = read_streaming_result(RESULTS_PATH, name, registry.current(), offset, limit)
+        return cluster_response(results, compression)
+    except FileNotFoundError:
+        return error_response(404, f"Unknown result {name}")
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@app.get("/cluster-stream-results/{name}/lod")
+def get_streaming_lod(name: str, grid_width: int = 256, grid_height: int = 256, bbox: Optional[str] = None,
+                      samples_per_cluster: int = 100):
+    try:
+        box = [float(v) for v in bbox.split(",")] if bbox else None  # "x_min,y_min,x_max,y_max"
+        lod = read_streaming_lod(RESULTS_PATH, name, registry.current(), grid_width=grid_width,
+                                 grid_height=grid_height, bbox=box, samples_per_cluster=samples_per_cluster)
+        return {"status": "success", "data": lod}
+    except FileNotFoundError:
+        return error_response(404, f"Unknown result {name}")
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@app.get("/cluster-jobs/{job_id}")
+def get_cluster_job(job_id: str, debug: bool = False):
+    job = job_manager.get(job_id)
+    if job is None:
+        return error_response(404, f"Unknown job {job_id}")
+    data = job_manager.status(job)
+    if data["status"] == "succeeded":
+        data["result"] = job_manager.result(job)
+        if debug:
+            data["stage_metrics"] = job_manager.stage_metrics(job)
+    return {"status": "success", "data": data}
+
+@app.get("/metrics")
+def get_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(REGISTRY.render(results_cache), media_type="text/plain; version=0.0.4")
+
+@app.get("/cluster-jobs/{job_id}/events")
+async def stream_cluster_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        return error_response(404, f"Unknown job {job_id}")
+
+    async def events():
+        # Server-sent events, one per status change until the job finishes
+        last = None
+        while True:
+            data = await run_in_threadpool(job_manager.status, job)
+            if (data["status"], data["stage"]) != last:
+                last = (data["status"], data["stage"])
+                yield f"data: {json.dumps(data)}\n\n"
+            if data["status"] in TERMINAL_STATUSES:
+                break
+            await asyncio.sleep(0.25)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.delete("/cluster-jobs/{job_id}")
+def cancel_cluster_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        return error_response(404, f"Unknown job {job_id}")
+    if not job_manager.cancel(job_id):
+        return error_response(409, f"Job {job_id} has already finished")
+    return {"status": "success", "data": job_manager.status(job)}
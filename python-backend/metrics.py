@@ -0,0 +1,185 @@
+# metrics.py
+"""
+Per-stage instrumentation of jobs, exposed in the Prometheus text format.
+
+Workers time every stage a job reports through its `progress` callback:
+wall time, the peak resident set size of the worker so far and the number of
+rows the stage worked on. The memory allocated during each stage (tracemalloc,
+so NumPy arrays included) is only traced for debug requests or with
+KG_TRACE_MEMORY=1, as tracing slows the pure-Python parts of a job several
+times. The stages are returned with the job result, recorded here in the
+server process, and served by GET /metrics as histograms together with
+request durations.
+"""
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+MEMORY_BUCKETS = tuple(float(1 << shift) for shift in range(16, 36, 2))  # 64KiB to 16GiB
+ROW_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process, None where getrusage is missing."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageRecorder:
+    """
+    Timings of consecutive stages; a stage ends when the next one starts, and
+    the last one with close().
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        # Without tracing the peak memory allocated is None
+        self.trace_memory = trace_memory
+        self._started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        self.stages = []
+        self._current = None
+
+    def start(self, stage: str, rows: int = None):
+        if self._current is not None and self._current[0] == stage:
+            return  # Reported again, e.g. "loading" by both the worker and the job function
+        self.finish()
+        baseline = None
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        self._current = (stage, rows, time.perf_counter(), baseline)
+
+    def finish(self):
+        if self._current is None:
+            return
+        stage, rows, started, baseline = self._current
+        seconds = time.perf_counter() - started
+        self.stages.append({
+            "stage": stage,
+            "seconds": seconds,
+            "peak_memory_bytes": None if baseline is None else max(0, tracemalloc.get_traced_memory()[1] - baseline),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "rows": rows,
+        })
+        self._current = None
+
+    def close(self):
+        self.finish()
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        counts, total = self._series.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        counts[-1] += 1  # +Inf
+        self._series[key] = (counts, total + value)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(self._series.items()):
+            labels = dict(key)
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': bound})} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {counts[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels):
+        # For totals kept elsewhere, such as the result cache hits
+        self._values[tuple(sorted(labels.items()))] = value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(dict(key))} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stage_seconds = Histogram("kg_stage_duration_seconds", "Wall time of each job stage.",
+                                       DURATION_BUCKETS)
+        self.stage_memory = Histogram("kg_stage_peak_memory_bytes",
+                                      "Peak memory allocated during each job stage.", MEMORY_BUCKETS)
+        self.stage_rss = Histogram("kg_stage_peak_rss_bytes",
+                                   "Peak resident set size of the worker at the end of each job stage.",
+                                   MEMORY_BUCKETS)
+        self.stage_rows = Histogram("kg_stage_rows", "Rows processed by each job stage.", ROW_BUCKETS)
+        self.jobs = Counter("kg_jobs_total", "Finished jobs by kind and status.")
+        self.requests = Histogram("kg_http_request_duration_seconds",
+                                  "Time to handle and encode each HTTP request.", DURATION_BUCKETS)
+        self.cache = Counter("kg_result_cache_lookups_total", "Result cache lookups by outcome.")
+
+    def record_stages(self, kind: str, stages: list):
+        with self._lock:
+            for stage in stages:
+                labels = {"kind": kind, "stage": stage["stage"]}
+                self.stage_seconds.observe(stage["seconds"], **labels)
+                if stage["peak_memory_bytes"] is not None:
+                    self.stage_memory.observe(stage["peak_memory_bytes"], **labels)
+                if stage.get("peak_rss_bytes") is not None:
+                    self.stage_rss.observe(stage["peak_rss_bytes"], **labels)
+                if stage["rows"] is not None:
+                    self.stage_rows.observe(stage["rows"], **labels)
+
+    def record_job(self, kind: str, status: str):
+        with self._lock:
+            self.jobs.inc(kind=kind, status=status)
+
+    def record_request(self, method: str, path: str, status: int, seconds: float):
+        with self._lock:
+            self.requests.observe(seconds, method=method, path=path, status=status)
+
+    def render(self, cache=None) -> str:
+        with self._lock:
+            if cache is not None:
+                self.cache.set(cache.hits, outcome="hit")
+                self.cache.set(cache.misses, outcome="miss")
+            metrics = (self.stage_seconds, self.stage_memory, self.stage_rss, self.stage_rows, self.jobs,
+                       self.requests, self.cache)
+            return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
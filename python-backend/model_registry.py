@@ -0,0 +1,122 @@
+# model_registry.py
+import hashlib
+import os
+import threading
+from dataclasses import dataclass, field
+
+import numpy as np
+
+import serving_artifact
+from serving_artifact import LabelIndex
+
+
+@dataclass(frozen=True)
+class LoadedModel:
+    """Everything a request needs from one serving artifact, memory mapped once."""
+    version: str
+    artifact_dir: str
+    manifest: dict = field(repr=False)
+    entity_embeddings: np.ndarray = field(repr=False)
+    entities: LabelIndex = field(repr=False)
+    relation_embeddings: np.ndarray = field(repr=False)
+    relations: LabelIndex = field(repr=False)
+
+    def shared_rows(self, name: str, ids: np.ndarray, key: str = None) -> np.ndarray:
+        """
+        Rows `ids` of the entity matrix as a read-only array shared by every
+        worker. The subset is written once under the artifact's cache/ folder,
+        keyed by `name` and `key` (a hash of the ids by default), and memory
+        mapped from there.
+        """
+        ids = np.ascontiguousarray(ids, dtype=np.int64)
+        key = key or hashlib.sha1(ids.tobytes()).hexdigest()[:12]
+        path = os.path.join(self.artifact_dir, "cache", f"{name}-{key}.npy")
+        return serving_artifact.shared_rows(path, self.entity_embeddings, ids)
+
+
+def serving_path(model_path: str) -> str:
+    return os.path.join(model_path, "serving")
+
+
+def model_version(model_path: str) -> str:
+    """Version currently activated in the serving artifact of `model_path`."""
+    return serving_artifact.current_version(serving_path(model_path))
+
+
+def load_model(model_path: str, version: str = None) -> LoadedModel:
+    version = version or model_version(model_path)
+    artifact_dir = os.path.join(serving_path(model_path), version)
+
+    print(f"Loading serving artifact {version}...")
+    manifest = serving_artifact.read_manifest(artifact_dir)
+    # Memory mapped read-only: workers share the pages instead of copying them
+    entity_embeddings = serving_artifact.read_entity_embeddings(artifact_dir)
+    relation_embeddings = serving_artifact.read_relation_embeddings(artifact_dir)
+
+    return LoadedModel(
+        version,
+        artifact_dir,
+        manifest,
+        entity_embeddings,
+        serving_artifact.read_entity_index(artifact_dir),
+        relation_embeddings,
+        serving_artifact.read_relation_index(artifact_dir),
+    )
+
+
+class ModelRegistry:
+    """
+    Keeps the active model resident and hot-swaps it when a new version is
+    activated under `<model_path>/serving` (see export_artifact.py).
+
+    Requests take a reference with `current()` and keep using it until they
+    finish, so swapping in a new version never affects in-flight work.
+    Versions are immutable directories and CURRENT is replaced atomically, so
+    the watcher never sees a half-written model.
+    """
+
+    def __init__(self, model_path: str, poll_interval: float = 10.0):
+        self.model_path = model_path
+        self.poll_interval = poll_interval
+        self._model = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def start(self):
+        self._model = load_model(self.model_path)
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, name="model-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+    def current(self) -> LoadedModel:
+        with self._lock:
+            if self._model is None:
+                raise RuntimeError("Model registry has not been started")
+            return self._model
+
+    def reload(self, version: str = None) -> LoadedModel:
+        model = load_model(self.model_path, version)
+        with self._lock:
+            self._model = model
+        print(f"Active model version: {model.version}")
+        return model
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                version = model_version(self.model_path)
+            except OSError:
+                continue
+
+            if version != self.current().version:
+                try:
+                    self.reload(version)
+                except Exception as e:
+                    print(f"Failed to load model version {version}: {e}")
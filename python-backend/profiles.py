@@ -0,0 +1,242 @@
+# profiles.py
+"""
+What the users of each cluster like, computed from the triples file.
+
+    python profiles.py [triples_path]
+
+For every category below the index keeps a sparse users x items adjacency
+(CSR, rows in the order of the user index) and the URIs and names of the
+items, every subject of the category's name property whether liked or not, in
+the artifact's cache/ folder next to the user index. The script saves the
+first /cluster-profiles request after a new export from scanning the
+triples itself. Like the user index, it is read from the integer triples
+when they are up to date.
+
+Cluster profiles are then one sparse product per category, clusters x users
+times users x items, instead of one SPARQL query per cluster.
+"""
+import csv
+import os
+import sys
+from dataclasses import dataclass
+
+import numpy as np
+from scipy import sparse
+
+import serving_artifact
+from artifact_cache import ProcessCache
+from encoded_triples import EncodedTriples, load_encoded_triples
+from model_registry import LoadedModel
+from user_index import RDF_TYPE, USER_CLASS, UserIndex
+
+ONTOLOGY = "http://sdm_upc.org/ontology/"
+
+# (category, user -> item property, item -> name property)
+CATEGORIES = (
+    ("Genre", "likes_genre", "genre_name"),
+    ("Competition", "likes_competition", "competition_name"),
+    ("Movie", "likes_movie", "movie_title"),
+    ("Team", "likes_team", "team_name"),
+    ("Keyword", "interested_in", "keyword_text"),
+)
+
+
+def _pack_strings(strings: list):
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+@dataclass(frozen=True)
+class CategoryIndex:
+    adjacency: sparse.csr_matrix  # users x items, 1 where the user likes the item
+    item_offsets: np.ndarray
+    item_blob: np.ndarray
+    name_offsets: np.ndarray
+    name_blob: np.ndarray
+
+    def _string(self, offsets, blob, k: int) -> str:
+        return blob[offsets[k]:offsets[k + 1]].tobytes().decode("utf-8")
+
+    def item(self, k: int) -> str:
+        return self._string(self.item_offsets, self.item_blob, k)
+
+    def name(self, k: int) -> str:
+        # Items without a name in the triples fall back to their URI
+        return self._string(self.name_offsets, self.name_blob, k) or self.item(k)
+
+
+@dataclass(frozen=True)
+class ProfileIndex:
+    fingerprint: str
+    user_rows: np.ndarray  # embedding row of each adjacency row, as in UserIndex.rows
+    categories: dict
+
+    def positions(self, rows) -> np.ndarray:
+        """Adjacency rows of the given embedding rows."""
+        rows = np.asarray(rows, dtype=np.int64)
+        order = np.argsort(self.user_rows, kind="stable")
+        found = np.minimum(np.searchsorted(self.user_rows[order], rows), max(0, len(order) - 1))
+        if len(rows) and (len(order) == 0 or np.any(self.user_rows[order[found]] != rows)):
+            raise ValueError("Some of the given entities are not users")
+        return order[found]
+
+
+def _scan_tsv(user_position: dict, triples_path: str):
+    links = {ONTOLOGY + link: category for category, link, _ in CATEGORIES}
+    names = {ONTOLOGY + name: category for category, _, name in CATEGORIES}
+    items = {category: {} for category, _, _ in CATEGORIES}
+    pairs = {category: ([], []) for category, _, _ in CATEGORIES}
+    item_names = {category: {} for category, _, _ in CATEGORIES}
+
+    csv.field_size_limit(sys.maxsize)
+    with open(triples_path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f, delimiter="\t"):
+            if len(row) != 3:
+                continue
+            subject, predicate, obj = row
+            if predicate in links:
+                user = user_position.get(subject)
+                if user is not None:
+                    category = links[predicate]
+                    category_items = items[category]
+                    pairs[category][0].append(user)
+                    pairs[category][1].append(category_items.setdefault(obj, len(category_items)))
+            elif predicate in names:
+                category = names[predicate]
+                item_names[category][subject] = obj
+                items[category].setdefault(subject, len(items[category]))
+
+    return {
+        category: (np.array(pairs[category][0], dtype=np.int64), np.array(pairs[category][1], dtype=np.int64),
+                   [(uri, item_names[category].get(uri, "")) for uri in items[category]])
+        for category, _, _ in CATEGORIES
+    }
+
+
+def _scan_encoded(model: LoadedModel, users: UserIndex, encoded: EncodedTriples):
+    entities = encoded.entities
+    # Entity ids of the indexed users; ids follow label order, so they are sorted like the user index
+    if encoded.same_entity_ids(model.entities):
+        user_ids = np.asarray(users.rows, dtype=np.int64)
+    else:
+        typed = {entities[k]: k for k in encoded.subjects(RDF_TYPE, USER_CLASS)}
+        user_ids = np.array([typed.get(uri, -1) for uri in users.labels(model, users.rows)], dtype=np.int64)
+
+    scanned = {}
+    for category, link, name in CATEGORIES:
+        heads, tails = encoded.pairs(ONTOLOGY + link)
+        found = np.minimum(np.searchsorted(user_ids, heads), max(0, len(user_ids) - 1))
+        keep = user_ids[found] == heads if len(user_ids) else np.zeros(len(heads), dtype=bool)
+        named, item_names = encoded.pairs(ONTOLOGY + name)
+        item_ids = np.unique(np.concatenate([tails[keep], named]))
+        item_of = np.searchsorted(item_ids, tails[keep])
+        name_of = np.full(len(item_ids), -1, dtype=np.int64)
+        name_of[np.searchsorted(item_ids, named)] = item_names
+        scanned[category] = (found[keep], item_of.astype(np.int64), [
+            (entities[int(item)], entities[int(k)] if k >= 0 else "") for item, k in zip(item_ids, name_of)
+        ])
+    return scanned
+
+
+def scan_profiles(model: LoadedModel, users: UserIndex, triples_path: str) -> dict:
+    """Arrays of every category, from the integer triples or one pass over the triples file."""
+    encoded = load_encoded_triples(triples_path)
+    if encoded is not None:
+        scanned = _scan_encoded(model, users, encoded)
+    else:
+        user_position = {uri: i for i, uri in enumerate(users.labels(model, users.rows))}
+        scanned = _scan_tsv(user_position, triples_path)
+
+    arrays = {}
+    for category, _, _ in CATEGORIES:
+        user_ids, item_ids, item_names = scanned[category]
+        adjacency = sparse.csr_matrix(
+            (np.ones(len(user_ids), dtype=np.int32), (user_ids, item_ids)),
+            shape=(len(users.rows), len(item_names)),
+        )
+        adjacency.sum_duplicates()
+        adjacency.data[:] = 1  # a user liking an item twice still counts once
+        key = category.lower()
+        arrays[f"{key}_indptr"] = adjacency.indptr.astype(np.int64)
+        arrays[f"{key}_indices"] = adjacency.indices.astype(np.int32)
+        arrays[f"{key}_item_offsets"], arrays[f"{key}_item_blob"] = _pack_strings([uri for uri, _ in item_names])
+        arrays[f"{key}_name_offsets"], arrays[f"{key}_name_blob"] = _pack_strings([n for _, n in item_names])
+        print(f"{category}: {len(item_names)} items, {adjacency.nnz} links")
+    return arrays
+
+
+def build_profile_index(model: LoadedModel, users: UserIndex, triples_path: str) -> ProfileIndex:
+    # v2: items nobody likes are included
+    path = os.path.join(model.artifact_dir, "cache", f"profiles-v2-{users.fingerprint}.npz")
+
+    def write(tmp_path):
+        print("Building profile index...")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **scan_profiles(model, users, triples_path))
+
+    serving_artifact.shared_file(path, write)
+    with np.load(path) as arrays:
+        categories = {}
+        for category, _, _ in CATEGORIES:
+            key = category.lower()
+            indptr, indices = arrays[f"{key}_indptr"], arrays[f"{key}_indices"]
+            n_items = len(arrays[f"{key}_item_offsets"]) - 1
+            categories[category] = CategoryIndex(
+                sparse.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr),
+                                  shape=(len(indptr) - 1, n_items)),
+                arrays[f"{key}_item_offsets"], arrays[f"{key}_item_blob"],
+                arrays[f"{key}_name_offsets"], arrays[f"{key}_name_blob"],
+            )
+    return ProfileIndex(users.fingerprint, users.rows, categories)
+
+
+_indexes = ProcessCache()
+
+
+def load_profile_index(model: LoadedModel, users: UserIndex, triples_path: str) -> ProfileIndex:
+    """Profile index of `users`, built once per host and kept in memory per process."""
+    return _indexes.get((model.version, users.fingerprint), lambda: build_profile_index(model, users, triples_path))
+
+
+def cluster_profiles(index: ProfileIndex, rows, labels, top_k: int = 5) -> dict:
+    """
+    The `top_k` most liked items of every category for each cluster, given
+    the embedding row and cluster label of each clustered user.
+    """
+    if top_k < 1:
+        raise ValueError("top_k must be at least 1")
+    clusters, cluster_of = np.unique(np.asarray(labels), return_inverse=True)
+    positions = index.positions(rows)
+    # clusters x users membership matrix, so one product covers every cluster
+    membership = sparse.csr_matrix(
+        (np.ones(len(positions), dtype=np.int32), (cluster_of, positions)),
+        shape=(len(clusters), len(index.user_rows)),
+    )
+
+    profiles = {str(int(cluster)): [] for cluster in clusters}
+    for category, _, _ in CATEGORIES:
+        category_index = index.categories[category]
+        counts = (membership @ category_index.adjacency).tocsr()
+        for c, cluster in enumerate(clusters):
+            items = counts.indices[counts.indptr[c]:counts.indptr[c + 1]]
+            item_counts = counts.data[counts.indptr[c]:counts.indptr[c + 1]]
+            # Most liked first, ties by item so results are stable, also at the cut-off
+            for k in np.lexsort((items, -item_counts))[:top_k]:
+                profiles[str(int(cluster))].append({
+                    "category": category,
+                    "name": category_index.name(items[k]),
+                    "uri": category_index.item(items[k]),
+                    "count": int(item_counts[k]),
+                })
+    return profiles
+
+
+if __name__ == "__main__":
+    from artifact_cache import load_from_environment
+
+    model, users, triples_path = load_from_environment(sys.argv[1] if len(sys.argv) > 1 else None)
+    index = build_profile_index(model, users, triples_path)
+    for category, category_index in index.categories.items():
+        print(f"{category}: {category_index.adjacency.shape[1]} items, {category_index.adjacency.nnz} links")
@@ -0,0 +1,94 @@
+# projection.py
+"""
+Scaling + PCA projection fitted once over all users of a model version.
+
+Requests only apply the cached transform to the users they selected, so the
+projection costs a matrix product and a user keeps the same coordinates
+from one request to the next. The fit streams the user matrix in chunks
+(StandardScaler.partial_fit, then IncrementalPCA), so it scales to user
+counts that would not fit a dense PCA in memory.
+"""
+import os
+from dataclasses import dataclass
+
+import numpy as np
+from sklearn.decomposition import IncrementalPCA
+from sklearn.preprocessing import StandardScaler
+
+import serving_artifact
+from artifact_cache import ProcessCache
+from model_registry import LoadedModel
+from user_index import UserIndex
+
+MAX_COMPONENTS = 50
+FIT_CHUNK_SIZE = 65536
+
+
+@dataclass(frozen=True)
+class Projection:
+    mean: np.ndarray
+    scale: np.ndarray
+    pca_mean: np.ndarray
+    components: np.ndarray
+
+    @property
+    def n_components(self) -> int:
+        return self.components.shape[0]
+
+    def transform(self, embeddings: np.ndarray) -> np.ndarray:
+        scaled = (np.asarray(embeddings, dtype=np.float64) - self.mean) / self.scale
+        return (scaled - self.pca_mean) @ self.components.T
+
+    def to_2d(self, reduced: np.ndarray) -> np.ndarray:
+        # PCA of the PCA output is its first two components
+        return np.asarray(reduced[:, :2])
+
+    def pack(self) -> np.ndarray:
+        """One (3 + n_components, dim) array, the layout stored on disk."""
+        return np.vstack([self.mean, self.scale, self.pca_mean, self.components])
+
+    @classmethod
+    def unpack(cls, packed: np.ndarray) -> "Projection":
+        packed = np.asarray(packed)
+        return cls(packed[0], packed[1], packed[2], packed[3:])
+
+
+def _chunks(n: int, chunk_size: int):
+    # Near-equal chunks, so none is smaller than the number of components
+    for chunk in np.array_split(np.arange(n), max(1, -(-n // chunk_size))):
+        if len(chunk):
+            yield chunk[0], chunk[-1] + 1
+
+
+def fit_projection(user_embeddings: np.ndarray, chunk_size: int = FIT_CHUNK_SIZE) -> Projection:
+    n, dim = user_embeddings.shape
+    n_components = min(MAX_COMPONENTS, dim, n - 1)
+    if n_components < 2:
+        raise ValueError(f"Need at least 3 users to fit a projection, got {n}")
+    chunk_size = max(chunk_size, n_components)
+
+    scaler = StandardScaler()
+    for start, end in _chunks(n, chunk_size):
+        scaler.partial_fit(user_embeddings[start:end])
+
+    pca = IncrementalPCA(n_components=n_components)
+    for start, end in _chunks(n, chunk_size):
+        pca.partial_fit(scaler.transform(user_embeddings[start:end]))
+
+    return Projection(scaler.mean_, scaler.scale_, pca.mean_, pca.components_)
+
+
+_projections = ProcessCache()
+
+
+def load_projection(model: LoadedModel, users: UserIndex) -> Projection:
+    """Projection of all users in `users`, fitted once per host and cached per process."""
+    path = os.path.join(model.artifact_dir, "cache", f"projection-{users.fingerprint}.npy")
+
+    def build():
+        print(f"Fitting projection over {len(users.rows)} users...")
+        embeddings = model.shared_rows("users", users.rows, key=users.fingerprint)
+        return fit_projection(embeddings).pack()
+
+    return _projections.get((model.version, users.fingerprint),
+                            lambda: Projection.unpack(serving_artifact.shared_array(path, build)))
@@ -0,0 +1,170 @@
+# quantization.py
+"""
+Compact storage of the user embedding matrix.
+
+    python quantization.py [--algorithm dbscan] [--max-users 10000] [--output report.json]
+
+The user rows consumed by clustering can be kept as:
+
+    float32   the exported embeddings, 4 bytes per value
+    float16   2 bytes per value
+    int8      1 byte per value, with one float32 scale per dimension
+              (value ~= code * scale[dim], scale = max |value| / 127)
+
+Each mode is written once per host under the artifact's cache/ folder and
+memory mapped, and rows are turned back into float32 only when read, so only
+the selected users are ever expanded. The mode is picked per request, with
+KG_EMBEDDING_STORAGE as the default.
+
+Running this module compares the modes on the active model: storage size,
+time to select and cluster the users, reconstruction error, and how well
+each clustering agrees with the float32 one (adjusted Rand index).
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+import serving_artifact
+from model_registry import LoadedModel
+from user_index import UserIndex
+
+STORAGE_MODES = ("float32", "float16", "int8")
+DEFAULT_STORAGE = os.environ.get("KG_EMBEDDING_STORAGE", "float32")
+CHUNK_SIZE = 65536
+
+
+class QuantizedRows:
+    """Read-only rows stored as `codes`, read back as float32 (times `scale` for int8)."""
+
+    def __init__(self, codes: np.ndarray, scale: np.ndarray = None):
+        self.codes = codes
+        self.scale = scale
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (0 if self.scale is None else self.scale.nbytes)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, key) -> np.ndarray:
+        rows = np.asarray(self.codes[key], dtype=np.float32)
+        return rows if self.scale is None else rows * self.scale
+
+
+def check_storage(storage: str) -> str:
+    storage = storage or DEFAULT_STORAGE
+    if storage not in STORAGE_MODES:
+        raise ValueError(f"Unknown embedding storage {storage!r}, expected one of {list(STORAGE_MODES)}")
+    return storage
+
+
+def int8_scale(source: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Per-dimension scale mapping the largest |value| of each dimension to 127."""
+    largest = np.zeros(source.shape[1], dtype=np.float32)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        np.maximum(largest, np.abs(source[ids[start:start + CHUNK_SIZE]]).max(axis=0), out=largest)
+    largest[largest == 0] = 1.0
+    return largest / 127
+
+
+def _write_codes(path: str, source: np.ndarray, ids: np.ndarray, dtype, scale: np.ndarray = None):
+    def write(tmp_path):
+        out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=(len(ids), source.shape[1]))
+        for start in range(0, len(ids), CHUNK_SIZE):
+            rows = np.asarray(source[ids[start:start + CHUNK_SIZE]], dtype=np.float32)
+            if scale is not None:
+                rows = np.clip(np.rint(rows / scale), -127, 127)
+            out[start:start + CHUNK_SIZE] = rows.astype(dtype)
+        out.flush()
+        del out
+
+    serving_artifact.shared_file(path, write)
+    return np.load(path, mmap_mode="r")
+
+
+def load_user_embeddings(model: LoadedModel, users: UserIndex, storage: str = None):
+    """Embeddings of every user in `users`, stored as `storage`."""
+    storage = check_storage(storage)
+    if storage == "float32":
+        return model.shared_rows("users", users.rows, key=users.fingerprint)
+
+    ids = np.ascontiguousarray(users.rows, dtype=np.int64)
+    base = os.path.join(model.artifact_dir, "cache", f"users-{storage}-{users.fingerprint}")
+    if storage == "float16":
+        return QuantizedRows(_write_codes(base + ".npy", model.entity_embeddings, ids, np.float16))
+    scale = serving_artifact.shared_array(base + "-scale.npy", lambda: int8_scale(model.entity_embeddings, ids))
+    return QuantizedRows(_write_codes(base + ".npy", model.entity_embeddings, ids, np.int8, scale), scale)
+
+
+def compare_storage(model: LoadedModel, users: UserIndex, **clustering_params) -> dict:
+    """Cluster the same users from every storage mode and compare with float32."""
+    from sklearn.metrics import adjusted_rand_score, normalized_mutual_info_score
+
+    from clustering import perform_clustering, select_users
+
+    params = {"max_users": 10000, "sampling_method": "random", **clustering_params}
+    # Fit the shared projection first so it is not counted in the first timing
+    perform_clustering(model, users, **{**params, "max_users": 10})
+    _, reference = select_users(model, users, params["max_users"], params["sampling_method"],
+                                params.get("seed", 0))
+
+    report = {"model_version": model.version, "users": len(users.rows),
+              "parameters": dict(params), "modes": {}}
+    reference_labels = None
+    for storage in STORAGE_MODES:
+        start = time.perf_counter()
+        stored = load_user_embeddings(model, users, storage)
+        load_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = perform_clustering(model, users, embedding_storage=storage, **params)
+        cluster_seconds = time.perf_counter() - start
+
+        labels = np.asarray(results["cluster_labels"])
+        _, selected = select_users(model, users, params["max_users"], params["sampling_method"],
+                                   params.get("seed", 0), storage)
+        error = np.abs(np.asarray(selected, dtype=np.float32) - reference)
+        if reference_labels is None:
+            reference_labels, reference_seconds, reference_bytes = labels, cluster_seconds, stored.nbytes
+        report["modes"][storage] = {
+            "bytes": int(stored.nbytes),
+            "memory_saved": 1 - stored.nbytes / reference_bytes,
+            "load_seconds": load_seconds,
+            "cluster_seconds": cluster_seconds,
+            "speedup": reference_seconds / cluster_seconds,
+            "mean_abs_error": float(error.mean()),
+            "max_abs_error": float(error.max()),
+            "n_clusters": len(set(labels.tolist()) - {-1}),
+            "adjusted_rand_index": float(adjusted_rand_score(reference_labels, labels)),
+            "normalized_mutual_info": float(normalized_mutual_info_score(reference_labels, labels)),
+        }
+    return report
+
+
+if __name__ == "__main__":
+    from artifact_cache import load_from_environment
+
+    parser = argparse.ArgumentParser(description="Compare embedding storage modes for clustering")
+    parser.add_argument("--algorithm", default="dbscan")
+    parser.add_argument("--eps", type=float, default=4.0)
+    parser.add_argument("--min-samples", type=int, default=5)
+    parser.add_argument("--n-clusters", type=int, default=None)
+    parser.add_argument("--max-users", type=int, default=10000)
+    parser.add_argument("--output", default=None, help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    model, users, _ = load_from_environment()
+    report = compare_storage(model, users, algorithm=args.algorithm, eps=args.eps, min_samples=args.min_samples,
+                             n_clusters=args.n_clusters, max_users=args.max_users)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
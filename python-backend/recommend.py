@@ -0,0 +1,129 @@
+# recommend.py
+"""
+Link-prediction recommendations from the TransE embeddings.
+
+For a relation such as likes_movie, every user is scored against every
+candidate tail as ||h + r - t||_p (the smaller, the more plausible the
+triple), one block of users at a time. Candidates are all the entities of
+the relation's category, the subjects of its name property (movie_title,
+team_name...) that have an embedding, liked by someone or not. They are the
+items of the profile index (profiles.py), whose users x items adjacency is
+used to leave out what each user is already known to like.
+"""
+import numpy as np
+
+from artifact_cache import ProcessCache
+from model_registry import LoadedModel
+from profiles import CATEGORIES, ONTOLOGY, ProfileIndex
+
+# pykeen's TransE default, for artifacts exported without the norm
+DEFAULT_NORM = 1
+# Scores held in memory at once, users x candidates (x dim for norms other than 2)
+BLOCK_ELEMENTS = 1 << 24
+
+RELATIONS = {link: category for category, link, _ in CATEGORIES}
+
+
+class Candidates:
+    """Entities of one category that have an embedding, and their profile item ids."""
+
+    def __init__(self, model: LoadedModel, index: ProfileIndex, category: str):
+        category_index = index.categories[category]
+        n_items = category_index.adjacency.shape[1]
+        rows = [model.entities.get(category_index.item(k)) for k in range(n_items)]
+        self.items = np.array([k for k, row in enumerate(rows) if row is not None], dtype=np.int64)
+        self.rows = np.array([row for row in rows if row is not None], dtype=np.int64)
+        # Column of each profile item in the score matrix, -1 without an embedding
+        self.column = np.full(n_items, -1, dtype=np.int64)
+        self.column[self.items] = np.arange(len(self.items))
+        self.embeddings = np.asarray(model.entity_embeddings[self.rows], dtype=np.float32)
+        self.squared_norms = (self.embeddings ** 2).sum(axis=1)
+
+
+# One entry per category of the current model version and triples
+_candidates = ProcessCache(scope=2)
+
+
+def load_candidates(model: LoadedModel, index: ProfileIndex, category: str) -> Candidates:
+    return _candidates.get((model.version, index.fingerprint, category), lambda: Candidates(model, index, category))
+
+
+def tail_distances(queries: np.ndarray, candidates: Candidates, norm: int) -> np.ndarray:
+    """||q - t||_p for every query q = h + r and candidate t, users x candidates."""
+    if norm == 2:
+        # Expanded as |q|^2 - 2 q.t + |t|^2, a single matrix product
+        squared = (queries ** 2).sum(axis=1)[:, None] - 2 * queries @ candidates.embeddings.T
+        return np.sqrt(np.maximum(squared + candidates.squared_norms[None, :], 0))
+    diff = np.abs(queries[:, None, :] - candidates.embeddings[None, :, :])
+    return (diff ** norm).sum(axis=2) ** (1 / norm)
+
+
+def recommend(model: LoadedModel, index: ProfileIndex, user_uris: list, relation: str,
+              k: int = 10, filter_known: bool = True) -> dict:
+    if k < 1:
+        raise ValueError("k must be at least 1")
+    link = relation[len(ONTOLOGY):] if relation.startswith(ONTOLOGY) else relation
+    if link not in RELATIONS:
+        raise ValueError(f"Unknown relation {relation!r}, expected one of {sorted(RELATIONS)}")
+    relation_row = model.relations.get(ONTOLOGY + link)
+    if relation_row is None:
+        raise ValueError(f"Relation {link} is not in model {model.version}")
+
+    rows = [model.entities.get(uri) for uri in user_uris]
+    missing = [uri for uri, row in zip(user_uris, rows) if row is None]
+    if missing:
+        raise ValueError(f"Unknown users: {missing[:5]}")
+    rows = np.asarray(rows, dtype=np.int64)
+
+    candidates = load_candidates(model, index, RELATIONS[link])
+    category_index = index.categories[RELATIONS[link]]
+    if len(candidates.rows) == 0:
+        raise ValueError(f"No {link} tails with an embedding in model {model.version}")
+    norm = model.manifest.get("scoring_fct_norm") or DEFAULT_NORM
+    k = min(k, len(candidates.rows))
+    relation_vector = np.asarray(model.relation_embeddings[relation_row], dtype=np.float32)
+
+    per_user = len(candidates.rows) * (1 if norm == 2 else candidates.embeddings.shape[1])
+    block = max(1, BLOCK_ELEMENTS // max(1, per_user))
+    top_items = np.empty((len(rows), k), dtype=np.int64)
+    top_distances = np.empty((len(rows), k), dtype=np.float32)
+    for start in range(0, len(rows), block):
+        block_rows = rows[start:start + block]
+        queries = np.asarray(model.entity_embeddings[block_rows], dtype=np.float32) + relation_vector
+        distances = tail_distances(queries, candidates, norm)
+
+        if filter_known:
+            known = category_index.adjacency[index.positions(block_rows)]
+            users_of = np.repeat(np.arange(len(block_rows)), np.diff(known.indptr))
+            columns = candidates.column[known.indices]
+            distances[users_of[columns >= 0], columns[columns >= 0]] = np.inf
+
+        # Top k without sorting every candidate, then order the k
+        if k < distances.shape[1]:
+            best = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            best = np.tile(np.arange(distances.shape[1]), (len(block_rows), 1))
+        best_distances = np.take_along_axis(distances, best, axis=1)
+        order = np.argsort(best_distances, axis=1, kind="stable")
+        top_items[start:start + block] = candidates.items[np.take_along_axis(best, order, axis=1)]
+        top_distances[start:start + block] = np.take_along_axis(best_distances, order, axis=1)
+
+    names = {}
+    for item in np.unique(top_items):
+        names[item] = (category_index.item(item), category_index.name(item))
+    return {
+        "relation": ONTOLOGY + link,
+        "k": k,
+        "norm": norm,
+        "candidates": len(candidates.rows),
+        "recommendations": [
+            {
+                "user_uri": uri,
+                "items": [
+                    {"uri": names[item][0], "name": names[item][1], "distance": float(distance)}
+                    for item, distance in zip(items, distances) if np.isfinite(distance)
+                ],
+            }
+            for uri, items, distances in zip(user_uris, top_items, top_distances)
+        ],
+    }
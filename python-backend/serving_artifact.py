@@ -0,0 +1,283 @@
+# serving_artifact.py
+"""
+Compact, torch-free serving artifact for a trained PyKEEN model.
+
+Layout of one artifact version (see export_artifact.py):
+
+    serving/
+    ├── CURRENT                      # name of the active version directory
+    └── <version>/
+        ├── manifest.json
+        ├── entity_embeddings.npy    # float32, row i = PyKEEN entity id i
+        ├── entity_labels.bin        # UTF-8 labels sorted for binary search
+        ├── entity_offsets.npy       # int64, label k is bin[offsets[k]:offsets[k + 1]]
+        ├── entity_ids.npy           # int64, entity id of sorted label k
+        ├── entity_positions.npy     # int64, sorted position of entity id i
+        ├── relation_*               # same files for relations
+        └── cache/                   # arrays derived at serving time
+
+Everything is opened with memory mapping, so all uvicorn workers on a host
+share a single copy of each file through the page cache.
+"""
+import bisect
+import hashlib
+import json
+import os
+import time
+import uuid
+
+import numpy as np
+
+FORMAT_VERSION = 1
+CURRENT_FILE = "CURRENT"
+
+
+class LabelIndex:
+    """Sorted labels and the model id of each, looked up by binary search."""
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray, ids: np.ndarray, positions: np.ndarray = None):
+        self.blob = blob
+        self.offsets = offsets
+        self.ids = ids
+        self._positions = positions
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, k: int) -> str:
+        return self.blob[self.offsets[k]:self.offsets[k + 1]].tobytes().decode("utf-8")
+
+    def get(self, label: str, default=None):
+        k = bisect.bisect_left(self, label)
+        if k < len(self) and self[k] == label:
+            return int(self.ids[k])
+        return default
+
+    def __contains__(self, label: str) -> bool:
+        return self.get(label) is not None
+
+    def label_of(self, id_: int) -> str:
+        if self._positions is None:
+            positions = np.empty(len(self.ids), dtype=np.int64)
+            positions[self.ids] = np.arange(len(self.ids))
+            self._positions = positions
+        return self[self._positions[id_]]
+
+
+def write_labels(out_dir: str, prefix: str, label_to_id: dict):
+    labels = sorted(label_to_id)
+    encoded = [label.encode("utf-8") for label in labels]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    with open(os.path.join(out_dir, f"{prefix}_labels.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+    np.save(os.path.join(out_dir, f"{prefix}_offsets.npy"), offsets)
+    ids = np.array([label_to_id[label] for label in labels], dtype=np.int64)
+    positions = np.empty(len(ids), dtype=np.int64)
+    positions[ids] = np.arange(len(ids))
+    np.save(os.path.join(out_dir, f"{prefix}_ids.npy"), ids)
+    np.save(os.path.join(out_dir, f"{prefix}_positions.npy"), positions)
+
+
+def read_labels(artifact_dir: str, prefix: str) -> LabelIndex:
+    blob_path = os.path.join(artifact_dir, f"{prefix}_labels.bin")
+    if os.path.getsize(blob_path) > 0:
+        blob = np.memmap(blob_path, dtype=np.uint8, mode="r")
+    else:
+        # np.memmap refuses empty files
+        blob = np.zeros(0, dtype=np.uint8)
+    offsets = np.load(os.path.join(artifact_dir, f"{prefix}_offsets.npy"), mmap_mode="r")
+    ids = np.load(os.path.join(artifact_dir, f"{prefix}_ids.npy"), mmap_mode="r")
+    positions_path = os.path.join(artifact_dir, f"{prefix}_positions.npy")
+    positions = np.load(positions_path, mmap_mode="r") if os.path.exists(positions_path) else None
+    return LabelIndex(blob, offsets, ids, positions)
+
+
+def write_artifact(serving_dir: str, entity_to_id: dict, entity_embeddings: np.ndarray,
+                   relation_to_id: dict, relation_embeddings: np.ndarray, metadata: dict = None,
+                   activate: bool = True) -> str:
+    """Write a new artifact version under `serving_dir` and return its version."""
+    entity_embeddings = np.ascontiguousarray(entity_embeddings, dtype=np.float32)
+    relation_embeddings = np.ascontiguousarray(relation_embeddings, dtype=np.float32)
+
+    digest = hashlib.sha1(entity_embeddings.tobytes())
+    digest.update(relation_embeddings.tobytes())
+    digest.update("\n".join(sorted(entity_to_id)).encode("utf-8"))
+    version = digest.hexdigest()[:12]
+
+    out_dir = os.path.join(serving_dir, version)
+    tmp_dir = out_dir + ".tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    np.save(os.path.join(tmp_dir, "entity_embeddings.npy"), entity_embeddings)
+    np.save(os.path.join(tmp_dir, "relation_embeddings.npy"), relation_embeddings)
+    write_labels(tmp_dir, "entity", entity_to_id)
+    write_labels(tmp_dir, "relation", relation_to_id)
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "version": version,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "num_entities": int(entity_embeddings.shape[0]),
+        "num_relations": int(relation_embeddings.shape[0]),
+        "embedding_dim": int(entity_embeddings.shape[1]),
+        "dtype": "float32",
+        **(metadata or {}),
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    if os.path.exists(out_dir):
+        # Same embeddings exported again, keep the existing copy
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+    else:
+        os.replace(tmp_dir, out_dir)
+
+    if activate:
+        activate_version(serving_dir, version)
+    return version
+
+
+def activate_version(serving_dir: str, version: str):
+    """Atomically point CURRENT at `version`."""
+    if not os.path.isfile(os.path.join(serving_dir, version, "manifest.json")):
+        raise FileNotFoundError(f"No artifact version {version} in {serving_dir}")
+    tmp_path = os.path.join(serving_dir, CURRENT_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        f.write(version + "\n")
+    os.replace(tmp_path, os.path.join(serving_dir, CURRENT_FILE))
+
+
+def current_version(serving_dir: str) -> str:
+    with open(os.path.join(serving_dir, CURRENT_FILE)) as f:
+        return f.read().strip()
+
+
+def read_manifest(artifact_dir: str) -> dict:
+    with open(os.path.join(artifact_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact format in {artifact_dir}: {manifest.get('format_version')}")
+    return manifest
+
+
+def read_entity_embeddings(artifact_dir: str) -> np.ndarray:
+    return np.load(os.path.join(artifact_dir, "entity_embeddings.npy"), mmap_mode="r")
+
+
+def read_relation_embeddings(artifact_dir: str) -> np.ndarray:
+    return np.load(os.path.join(artifact_dir, "relation_embeddings.npy"), mmap_mode="r")
+
+
+def _take_lock(lock_path: str):
+    """File descriptor of the lock, with our pid in it, or None if another process holds it."""
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return None
+    os.write(fd, str(os.getpid()).encode())
+    return fd
+
+
+def _lock_owner_alive(lock_path: str) -> bool:
+    try:
+        with open(lock_path) as f:
+            pid = int(f.read())
+        os.kill(pid, 0)
+    except (FileNotFoundError, ProcessLookupError):
+        return False
+    except (OSError, ValueError):
+        # Pid not written yet, or a process we may not signal
+        return True
+    return True
+
+
+def _release_lock(fd: int, lock_path: str):
+    os.close(fd)
+    try:
+        with open(lock_path) as f:
+            mine = f.read() == str(os.getpid())
+        if mine:
+            os.remove(lock_path)
+    except FileNotFoundError:
+        pass
+
+
+def shared_file(path: str, write, timeout: float = 300.0):
+    """
+    Create `path` once per host by calling `write(tmp_path)`, unless it exists.
+    Concurrent workers wait for whichever one took the lock, and the file only
+    appears under `path`, atomically, once it is complete. A lock whose owner
+    died, or held longer than `timeout`, is taken over.
+    """
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock_path = path + ".lock"
+    fd = _take_lock(lock_path)
+    deadline = time.monotonic() + timeout
+    while fd is None and not os.path.exists(path):
+        if not _lock_owner_alive(lock_path) or time.monotonic() > deadline:
+            # Otherwise every later process would wait for it again. At worst two
+            # processes build the file at once, which the atomic replace tolerates
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+            fd = _take_lock(lock_path)
+        else:
+            time.sleep(0.05)
+
+    try:
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                write(tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+    finally:
+        if fd is not None:
+            _release_lock(fd, lock_path)
+
+
+def shared_array(path: str, build, timeout: float = 300.0) -> np.ndarray:
+    """
+    Map the array at `path` read-only, calling `build()` to create it first if
+    no process has done so yet, so it is computed and stored once per host.
+    """
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            np.save(f, build())
+
+    shared_file(path, write, timeout)
+    return np.load(path, mmap_mode="r")
+
+
+def shared_rows(path: str, source: np.ndarray, ids: np.ndarray, chunk_size: int = 65536,
+                timeout: float = 300.0) -> np.ndarray:
+    """
+    Like `shared_array` for `source[ids]`, but gathered `chunk_size` rows at a
+    time straight into the file, so building it never holds the whole subset.
+    """
+    def write(tmp_path):
+        out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=source.dtype,
+                                        shape=(len(ids),) + source.shape[1:])
+        for start in range(0, len(ids), chunk_size):
+            out[start:start + chunk_size] = source[ids[start:start + chunk_size]]
+        out.flush()
+        del out
+
+    shared_file(path, write, timeout)
+    return np.load(path, mmap_mode="r")
+
+
+def read_entity_index(artifact_dir: str) -> LabelIndex:
+    return read_labels(artifact_dir, "entity")
+
+
+def read_relation_index(artifact_dir: str) -> LabelIndex:
+    return read_labels(artifact_dir, "relation")
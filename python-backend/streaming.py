@@ -0,0 +1,191 @@
+# streaming.py
+"""
+Out-of-core clustering of the whole user population.
+
+    python streaming.py [--n-clusters K] [--chunk-size N] [--epochs E] [--seed S] [--embedding-storage int8]
+
+Users are read from the memory-mapped user matrix `chunk_size` rows at a
+time: the projection is fitted incrementally (see projection.py), then
+MiniBatchKMeans is trained with partial_fit over shuffled chunks, and a last
+pass writes every user's label and 2D coordinates to .npy files. Peak memory
+depends on the chunk size (chunks hold up to twice `chunk_size` rows), not on
+the number of users.
+
+Results are written to `<results_path>/<name>/`:
+
+    manifest.json    # parameters, model version, cluster distribution
+    rows.npy         # int64 embedding row of each user (URI via the entity index)
+    labels.npy       # int32 cluster of each user
+    coords.npy       # float32 (n, 2) plot coordinates
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+from clustering import DEFAULT_SEED, no_progress
+from level_of_detail import level_of_detail
+from model_registry import LoadedModel
+from projection import load_projection
+from quantization import check_storage, load_user_embeddings
+from user_index import UserIndex
+
+STREAM_STAGES = ("loading", "projection_fit", "training", "labelling")
+
+
+def result_name(model: LoadedModel, users: UserIndex, n_clusters: int, epochs: int, seed: int,
+                embedding_storage: str = "float32") -> str:
+    name = f"{model.version}-{users.fingerprint}-k{n_clusters}-e{epochs}-s{seed}"
+    return name if embedding_storage == "float32" else f"{name}-{embedding_storage}"
+
+
+def _chunk_bounds(n: int, chunk_size: int):
+    # n // chunk_size near-equal chunks: each has between chunk_size and
+    # 2 * chunk_size rows, so even the first partial_fit sees n_clusters rows
+    edges = np.linspace(0, n, max(1, n // chunk_size) + 1).astype(int)
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def perform_streaming_clustering(model: LoadedModel, users: UserIndex, results_path: str,
+                                 n_clusters: int = 8, chunk_size: int = 65536, epochs: int = 3,
+                                 seed: int = DEFAULT_SEED, embedding_storage: str = None, progress=no_progress):
+    if n_clusters < 1 or chunk_size < 1 or epochs < 1:
+        raise ValueError("n_clusters, chunk_size and epochs must be at least 1")
+    seed = DEFAULT_SEED if seed is None else seed
+    # MiniBatchKMeans needs at least n_clusters rows in its first batch
+    chunk_size = max(chunk_size, n_clusters)
+
+    embedding_storage = check_storage(embedding_storage)
+    progress("loading")
+    embeddings = load_user_embeddings(model, users, embedding_storage)
+    n_users = len(users.rows)
+    if n_users < n_clusters:
+        raise ValueError(f"Cannot make {n_clusters} clusters from {n_users} users")
+
+    progress("projection_fit", rows=n_users)
+    projection = load_projection(model, users)
+
+    progress("training", rows=n_users)
+    print(f"Training MiniBatchKMeans on {n_users} users in chunks of {chunk_size}")
+    rng = np.random.default_rng(seed)
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=chunk_size, random_state=seed, n_init=3)
+    bounds = _chunk_bounds(n_users, chunk_size)
+    for epoch in range(epochs):
+        for i in rng.permutation(len(bounds)):
+            start, end = bounds[i]
+            kmeans.partial_fit(projection.transform(embeddings[start:end]))
+
+    progress("labelling", rows=n_users)
+    name = result_name(model, users, n_clusters, epochs, seed, embedding_storage)
+    out_dir = os.path.join(results_path, name)
+    tmp_dir = f"{out_dir}.{os.getpid()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    np.save(os.path.join(tmp_dir, "rows.npy"), users.rows)
+    labels = np.lib.format.open_memmap(os.path.join(tmp_dir, "labels.npy"), mode="w+",
+                                       dtype=np.int32, shape=(n_users,))
+    coords = np.lib.format.open_memmap(os.path.join(tmp_dir, "coords.npy"), mode="w+",
+                                       dtype=np.float32, shape=(n_users, 2))
+    counts = np.zeros(n_clusters, dtype=np.int64)
+    for start, end in bounds:
+        reduced = projection.transform(embeddings[start:end])
+        chunk_labels = kmeans.predict(reduced)
+        labels[start:end] = chunk_labels
+        coords[start:end] = projection.to_2d(reduced)
+        counts += np.bincount(chunk_labels, minlength=n_clusters)
+    labels.flush()
+    coords.flush()
+    del labels, coords
+
+    manifest = {
+        "name": name,
+        "cluster_distribution": {i: int(c) for i, c in enumerate(counts)},
+        "parameters": {
+            "algorithm": "minibatch_kmeans",
+            "n_clusters": n_clusters,
+            "chunk_size": chunk_size,
+            "epochs": epochs,
+            "seed": seed,
+            "total_users_available": users.total_users,
+            "users_processed": n_users,
+            "projection": "global",
+            "embedding_storage": embedding_storage,
+            "model_version": model.version,
+        },
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    if os.path.exists(out_dir):
+        # Same parameters already computed, results are deterministic
+        for file_name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, file_name))
+        os.rmdir(tmp_dir)
+    else:
+        os.replace(tmp_dir, out_dir)
+    return manifest
+
+
+def _open_result(results_path: str, name: str, model: LoadedModel):
+    out_dir = os.path.join(results_path, os.path.basename(name))
+    with open(os.path.join(out_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest["parameters"]["model_version"] != model.version:
+        raise ValueError(f"Result {name} was computed with model {manifest['parameters']['model_version']}")
+    return out_dir, manifest
+
+
+def read_streaming_result(results_path: str, name: str, model: LoadedModel, offset: int = 0,
+                          limit: int = 1000) -> dict:
+    """One page of a streaming result, in the shape of a /cluster-users response."""
+    out_dir, manifest = _open_result(results_path, name, model)
+    rows = np.load(os.path.join(out_dir, "rows.npy"), mmap_mode="r")[offset:offset + limit]
+    labels = np.load(os.path.join(out_dir, "labels.npy"), mmap_mode="r")[offset:offset + limit]
+    coords = np.load(os.path.join(out_dir, "coords.npy"), mmap_mode="r")[offset:offset + limit]
+    return {
+        "cluster_distribution": manifest["cluster_distribution"],
+        "user_clusters": [
+            {"user_uri": model.entities.label_of(int(row)), "cluster": int(label)}
+            for row, label in zip(rows, labels)
+        ],
+        "embeddings_2d": np.asarray(coords, dtype=np.float64).tolist(),
+        "cluster_labels": [int(label) for label in labels],
+        "parameters": {**manifest["parameters"], "offset": offset, "limit": limit},
+    }
+
+
+def read_streaming_lod(results_path: str, name: str, model: LoadedModel, **lod_params) -> dict:
+    """Level-of-detail view (see level_of_detail.py) of a whole streaming result."""
+    out_dir, manifest = _open_result(results_path, name, model)
+    rows = np.load(os.path.join(out_dir, "rows.npy"), mmap_mode="r")
+    labels = np.load(os.path.join(out_dir, "labels.npy"), mmap_mode="r")
+    coords = np.load(os.path.join(out_dir, "coords.npy"), mmap_mode="r")
+    lod = level_of_detail(
+        labels, coords, lambda sample: [model.entities.label_of(int(row)) for row in rows[sample]], **lod_params
+    )
+    lod["parameters"] = manifest["parameters"]
+    return lod
+
+
+if __name__ == "__main__":
+    from artifact_cache import load_from_environment
+
+    parser = argparse.ArgumentParser(description="Cluster every user out of core")
+    parser.add_argument("--n-clusters", type=int, default=8)
+    parser.add_argument("--chunk-size", type=int, default=65536)
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--embedding-storage", default=None, help="float32, float16 or int8")
+    args = parser.parse_args()
+
+    model, users, _ = load_from_environment()
+    manifest = perform_streaming_clustering(
+        model, users, os.environ.get("KG_RESULTS_PATH", "./data/results"),
+        n_clusters=args.n_clusters, chunk_size=args.chunk_size, epochs=args.epochs, seed=args.seed,
+        embedding_storage=args.embedding_storage,
+    )
+    print(json.dumps(manifest, indent=2))
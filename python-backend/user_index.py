@@ -0,0 +1,126 @@
+# user_index.py
+"""
+Persisted index of the users in the triples file.
+
+    python user_index.py [triples_path]
+
+Every clustering, profile or recommendation request starts from the
+embedding rows of the users, so the backend indexes them as soon as it sees
+a new model version or triples file, and the script lets you do it right
+after an export instead. The index lives in the artifact's cache/ folder,
+keyed by a fingerprint of the triples file, so it is tied to both the model
+version and the triples it was built from. Users are read from the integer
+triples next to the triples file when they are up to date (see
+encoded_triples.py), and from the TSV otherwise.
+"""
+import csv
+import json
+import os
+import sys
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+
+import serving_artifact
+from encoded_triples import load_encoded_triples, triples_fingerprint
+from model_registry import LoadedModel
+
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+USER_CLASS = "http://sdm_upc.org/ontology/User"
+
+
+@dataclass(frozen=True)
+class UserIndex:
+    """Embedding rows of every user known to the model, in URI order."""
+    fingerprint: str
+    rows: np.ndarray
+    total_users: int
+
+    def labels(self, model: LoadedModel, rows) -> list:
+        return [model.entities.label_of(int(row)) for row in rows]
+
+
+def scan_users(triples_path: str) -> set:
+    """URIs typed as ontology/User, streamed so only the users stay in memory."""
+    encoded = load_encoded_triples(triples_path)
+    if encoded is not None:
+        return {encoded.entities[k] for k in encoded.subjects(RDF_TYPE, USER_CLASS)}
+    users = set()
+    csv.field_size_limit(sys.maxsize)
+    with open(triples_path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f, delimiter="\t"):
+            if len(row) == 3 and row[1] == RDF_TYPE and row[2] == USER_CLASS:
+                users.add(row[0])
+    return users
+
+
+def _index_paths(model: LoadedModel, fingerprint: str):
+    base = os.path.join(model.artifact_dir, "cache", f"user_index-{fingerprint}")
+    return base + ".npy", base + ".json"
+
+
+def build_user_index(model: LoadedModel, triples_path: str, fingerprint: str = None) -> UserIndex:
+    fingerprint = fingerprint or triples_fingerprint(triples_path)
+    rows_path, meta_path = _index_paths(model, fingerprint)
+
+    def build():
+        print("Building user index...")
+        encoded = load_encoded_triples(triples_path)
+        if encoded is not None and encoded.same_entity_ids(model.entities):
+            # Ids follow URI order, so these are already sorted like the URIs
+            rows = encoded.subjects(RDF_TYPE, USER_CLASS)
+            total_users = len(rows)
+        else:
+            users = scan_users(triples_path)
+            rows = [model.entities.get(uri) for uri in sorted(users)]
+            rows = np.array([row for row in rows if row is not None], dtype=np.int64)
+            total_users = len(users)
+        print(f"Found {total_users} total users, {len(rows)} in model {model.version}")
+        # Written before the rows so it exists once the index is visible
+        with open(meta_path, "w") as f:
+            json.dump({"triples_path": os.path.abspath(triples_path), "total_users": total_users}, f)
+        return rows
+
+    rows = serving_artifact.shared_array(rows_path, build)
+    with open(meta_path) as f:
+        total_users = json.load(f)["total_users"]
+    return UserIndex(fingerprint, rows, total_users)
+
+
+class UserIndexCache:
+    """
+    Keeps the user index of the active model and triples file loaded, and
+    rebuilds it only when either of them changes. The triples file is only
+    hashed again when its size or modification time changes.
+    """
+
+    def __init__(self, triples_path: str):
+        self.triples_path = triples_path
+        self._lock = threading.Lock()
+        self._stat = None
+        self._fingerprint = None
+        self._index = {}
+
+    def fingerprint(self) -> str:
+        stat = os.stat(self.triples_path)
+        key = (stat.st_size, stat.st_mtime_ns)
+        if key != self._stat:
+            self._fingerprint = triples_fingerprint(self.triples_path)
+            self._stat = key
+        return self._fingerprint
+
+    def get(self, model: LoadedModel) -> UserIndex:
+        with self._lock:
+            fingerprint = self.fingerprint()
+            key = (model.version, fingerprint)
+            if key not in self._index:
+                self._index = {key: build_user_index(model, self.triples_path, fingerprint)}
+            return self._index[key]
+
+
+if __name__ == "__main__":
+    from artifact_cache import load_from_environment
+
+    _, index, _ = load_from_environment(sys.argv[1] if len(sys.argv) > 1 else None)
+    print(f"User index {index.fingerprint}: {len(index.rows)} users")
@@ -1,413 +1,440 @@
 
-import names
-import random
 from sklearn.feature_extraction.text import TfidfVectorizer
 import hashlib
 from rdflib import Graph, Namespace, URIRef, Literal
 from rdflib.namespace import RDF, XSD
-import pyspark, os, sys
-from delta import configure_spark_with_delta_pip
-from delta import *
-from pyspark.sql.functions import col, concat_ws, when
+import argparse
+import os, sys, shutil
 from collections import Counter
 import math
+from ntriples_sink import NTriplesLines, NTriplesSink
+from keyword_matcher import KeywordMatcher
+from user_generator import UserGenerator, build_candidates, write_users
+import numpy as np
 
-def extract_column_keywords(df, text_columns=['content', 'title', 'description'], top_n=10):
+DBO = Namespace("http://sdm_upc.org/ontology/")
+DBR = Namespace("http://sdm_upc.org/resource/")
+
+trusted_path ='..\data\letstalk_trusted_zone_bdma'
+
+# Name triples repeated for every news item, match or competition that mentions the entity
+DEDUPE_PREDICATES = (DBO.referee_name, DBO.country_name, DBO.author_name, DBO.source_name, DBO.keyword_text)
+
+GZIP_CODEC = "org.apache.hadoop.io.compress.GzipCodec"
+
+# Every add_* function takes the rows of one trusted zone table (anything with
+# the table's columns as attributes, e.g. Spark Rows) and a sink `g` with an
+# rdflib-style `g.add((s, p, o))`, so they run the same on synthetic data.
+
+def extract_column_keywords(df, text_columns=['content', 'title', 'description'], top_n=10, max_features=5000):
     """
     Returns: List of top keywords (without frequencies)
+
+    The same TF-IDF top-3 terms per document as extract_keywords, computed on
+    the executors: only the top_n keywords come back to the driver.
     """
-    combined_df = df.withColumn(
-        "combined_text",
-        concat_ws(" ", *[
+    from pyspark.sql import Window
+    from pyspark.sql.functions import broadcast, col, concat_ws, count, desc, expr, first, log, lower, \
+        monotonically_increasing_id, row_number, sum, when, xxhash64
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+    docs = df.select(
+        monotonically_increasing_id().alias("doc"),
+        lower(concat_ws(" ", *[
             when(col(c).isNotNull(), col(c)).otherwise("")
             for c in text_columns
-        ]))
-    
-    texts = [row.combined_text for row in combined_df.select("combined_text").collect()]
-    
+        ])).alias("text"))
+    n_docs = docs.count()
+
+    # TfidfVectorizer's tokens: runs of 2+ word characters, English stop words removed
+    terms = (docs.select("doc", expr(r"explode(regexp_extract_all(text, '(?U)\\b\\w\\w+\\b', 0))").alias("term"))
+             .where(~col("term").isin(*ENGLISH_STOP_WORDS))
+             .withColumn("term_hash", xxhash64("term")))
+
+    # Term counts per document, keyed by the 64-bit hash of the term
+    tf = terms.groupBy("doc", "term_hash").agg(count("*").alias("tf"), first("term").alias("term"))
+
+    # Document frequencies over all partitions, limited to the max_features most frequent terms
+    vocabulary = (tf.groupBy("term_hash")
+                  .agg(sum("tf").alias("total"), count("*").alias("df"))
+                  .orderBy(desc("total"), "term_hash")
+                  .limit(max_features))
+
+    # Smoothed idf as in TfidfVectorizer; the l2 normalisation does not change a document's ranking
+    scores = (tf.join(broadcast(vocabulary), "term_hash")
+              .withColumn("score", col("tf") * (log((1.0 + n_docs) / (1.0 + col("df"))) + 1.0)))
+    ranked = scores.withColumn("rank", row_number().over(
+        Window.partitionBy("doc").orderBy(desc("score"), "term")))
+
+    top = (ranked.where(col("rank") <= 3)
+           .groupBy("term").count()
+           .orderBy(desc("count"), "term")
+           .limit(top_n))
+    return [row.term for row in top.collect()]
+
+def top_terms(X, k=3):
+    """Columns of the k highest scores of every row of a CSR matrix, row by row, best first."""
+    rows = np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))
+    # Sorted by row, then score descending (ties by column), without densifying any row
+    order = np.lexsort((X.indices, -X.data, rows))
+    rank = np.arange(len(order)) - X.indptr[rows[order]]
+    return X.indices[order[rank < k]]
+
+def extract_keywords(texts, top_n=10):
     vectorizer = TfidfVectorizer(stop_words='english', max_features=5000)
     X = vectorizer.fit_transform(texts)
-    
+
     feature_names = vectorizer.get_feature_names_out()
-    keywords = []
-    
-    for i in range(X.shape[0]):
-        scores = X[i].toarray().flatten()
-        top_indices = scores.argsort()[-3:][::-1]
-        keywords.extend(feature_names[top_indices])
-    
+    keywords = feature_names[top_terms(X.tocsr())]
+
     # Return just the words as a list
     return [word for word, count in Counter(keywords).most_common(top_n)]
 
-g = Graph()
-DBO = Namespace("http://sdm_upc.org/ontology/")
-DBR = Namespace("http://sdm_upc.org/resource/")
-
-
-g.bind("dbo", DBO)
-g.bind("dbr", DBR)
-
 def consistent_hash(value):
     return int(hashlib.sha256(str(value).encode()).hexdigest(), 16)
 
-USERS=int(sys.argv[1])
-
-is_gcs_enabled= "False"
-if is_gcs_enabled.lower() == 'true':
-    is_gcs_enabled = True
-else:
-    is_gcs_enabled = False
-
-
-if is_gcs_enabled:
-    conf = (
-        pyspark.conf.SparkConf()
-        .setAppName("LetsTalk")
-        .set(
-            "spark.sql.catalog.spark_catalog",
-            "org.apache.spark.sql.delta.catalog.DeltaCatalog",
-        )
-        .set("spark.sql.extensions", "io.delta.sql.DeltaSparkSessionExtension")
-        .set("spark.hadoop.fs.gs.impl", "com.google.cloud.hadoop.fs.gcs.GoogleHadoopFileSystem")
-        .set("spark.hadoop.google.cloud.auth.service.account.enable", "true")
-        .set("spark.hadoop.google.cloud.auth.service.account.json.keyfile", "gcs/gcs.json")
-        .set("spark.sql.shuffle.partitions", "4")
-        .set("spark.driver.memory", "2g") \
-        .set("spark.executor.memory", "2g") \
-        .set("spark.jars", "gcs/gcs-connector-hadoop.jar")
-        .setMaster(
-            "local[*]"
-        )
-    )
-
-    builder = pyspark.sql.SparkSession.builder.appName("LetsTalk").config(conf=conf)
-    spark = configure_spark_with_delta_pip(builder).getOrCreate()
-    base_path = "gs://"
-else:
-    builder = pyspark.sql.SparkSession.builder.appName("LetsTalk") \
-        .config("spark.sql.extensions", "io.delta.sql.DeltaSparkSessionExtension") \
-        .config("spark.driver.memory", "6g") \
-        .config("spark.executor.memory", "6g") \
-        .config("spark.sql.catalog.spark_catalog", "org.apache.spark.sql.delta.catalog.DeltaCatalog")
-
-    spark = configure_spark_with_delta_pip(builder).getOrCreate()
-
-    base_path = "/data"
-
-
-trusted_path ='..\data\letstalk_trusted_zone_bdma'
-
 #SPORTS
 ## Matches
-print("Creating Sport Instances ...")
-subpath = 'matches'
-path = os.path.join(trusted_path, subpath)
-df = DeltaTable.forPath(spark, path).toDF()
+def add_matches(g, rows):
+    for row in rows:
+        if row.status_long in ('match finished', 'walkover', 'technical loss', 'match abandoned'):
+            subject = URIRef(DBR + f"match_{row.fixture_id}")
 
-for row in df.toLocalIterator():
-    if row.status_long in ('match finished', 'walkover', 'technical loss', 'match abandoned'):
-        subject = URIRef(DBR + f"match_{row.fixture_id}")
+            if row.team_home_id is not None:
+                g.add((subject, DBO.match_home_team, URIRef(DBR + f"team_{row.team_home_id}")))
 
-        if row.team_home_id is not None:
-            g.add((subject, DBO.match_home_team, URIRef(DBR + f"team_{row.team_home_id}")))
+            if row.team_away_id is not None:
+                g.add((subject, DBO.match_away_team, URIRef(DBR + f"team_{row.team_away_id}")))
 
-        if row.team_away_id is not None:
-            g.add((subject, DBO.match_away_team, URIRef(DBR + f"team_{row.team_away_id}")))
+            if row.goals_home is not None:
+                g.add((subject, DBO.match_home_goals, Literal(int(row.goals_home), datatype=XSD.integer)))
 
-        if row.goals_home is not None:
-            g.add((subject, DBO.match_home_goals, Literal(int(row.goals_home), datatype=XSD.integer)))
-            
-        if row.goals_away is not None:
-            g.add((subject, DBO.match_away_goals, Literal(int(row.goals_away), datatype=XSD.integer)))
+            if row.goals_away is not None:
+                g.add((subject, DBO.match_away_goals, Literal(int(row.goals_away), datatype=XSD.integer)))
 
-        if row.fixture_date is not None:
-            g.add((subject, DBO.match_date, Literal(row.fixture_date, datatype=XSD.dateTime)))
+            if row.fixture_date is not None:
+                g.add((subject, DBO.match_date, Literal(row.fixture_date, datatype=XSD.dateTime)))
 
-        if row.status_long is not None:
-            g.add((subject, DBO.match_played, Literal(str(row.status_long), datatype=XSD.string)))
+            if row.status_long is not None:
+                g.add((subject, DBO.match_played, Literal(str(row.status_long), datatype=XSD.string)))
 
-        if row.league is not None:
-            g.add((subject, DBO.match_competition, URIRef(DBR + f"competition_{row.league}")))
+            if row.league is not None:
+                g.add((subject, DBO.match_competition, URIRef(DBR + f"competition_{row.league}")))
 
-        if row.referee is not None:
-            g.add((subject, DBO.match_referee, URIRef(DBR + f"referee_{consistent_hash(row.referee)}")))
-            g.add((URIRef(DBR + f"referee_{consistent_hash(row.referee)}"), DBO.referee_name, Literal(str(row.referee), datatype=XSD.string)))
-
-        if row.venue_id is not None:
-            g.add((subject, DBO.match_venue, URIRef(DBR + f"venue_{consistent_hash(row.venue_id)}")))
+            if row.referee is not None:
+                g.add((subject, DBO.match_referee, URIRef(DBR + f"referee_{consistent_hash(row.referee)}")))
+                g.add((URIRef(DBR + f"referee_{consistent_hash(row.referee)}"), DBO.referee_name, Literal(str(row.referee), datatype=XSD.string)))
 
+            if row.venue_id is not None:
+                g.add((subject, DBO.match_venue, URIRef(DBR + f"venue_{consistent_hash(row.venue_id)}")))
 
 ## Competitions
-
-subpath= 'leagues'
-path = os.path.join(trusted_path, subpath)
-df = DeltaTable.forPath(spark, path).toDF()
-league_ids = df.select("league_id").distinct().rdd.map(lambda row: row.league_id).collect()
-country_ids = df.select("country").distinct().rdd.map(
-    lambda row: row.country.code
-).filter(lambda code: code is not None).collect()
-for row in df.toLocalIterator():
-    subject = URIRef(DBR + f"competition_{row.league_id}")
-    if row.league_type == 'cup':
-        g.add((subject, RDF.type, DBO.Cup))
-    else:
-        g.add((subject, RDF.type, DBO.League))
-    
-    if row.league_name is not None:
-        g.add((subject, DBO.competition_name,Literal(str(row.league_name), datatype=XSD.string)))
-
-    if row.country is not None:
-        if row.country.name== 'World':
-            g.add((subject, DBO.competition_country, URIRef(DBR + f"country_{consistent_hash('world')}")))
-            g.add((URIRef(DBR + f"country_{consistent_hash('world')}"), DBO.country_name, Literal(str(row.country.name), datatype=XSD.string)))
+def add_competitions(g, rows):
+    for row in rows:
+        subject = URIRef(DBR + f"competition_{row.league_id}")
+        if row.league_type == 'cup':
+            g.add((subject, RDF.type, DBO.Cup))
         else:
-            g.add((subject, DBO.competition_country, URIRef(DBR + f"country_{consistent_hash(row.country.code)}")))
-            g.add((URIRef(DBR + f"country_{consistent_hash(row.country.code)}"), DBO.country_name, Literal(str(row.country.name), datatype=XSD.string)))
-        
-            
+            g.add((subject, RDF.type, DBO.League))
+
+        if row.league_name is not None:
+            g.add((subject, DBO.competition_name,Literal(str(row.league_name), datatype=XSD.string)))
+
+        if row.country is not None:
+            if row.country.name== 'World':
+                g.add((subject, DBO.competition_country, URIRef(DBR + f"country_{consistent_hash('world')}")))
+                g.add((URIRef(DBR + f"country_{consistent_hash('world')}"), DBO.country_name, Literal(str(row.country.name), datatype=XSD.string)))
+            else:
+                g.add((subject, DBO.competition_country, URIRef(DBR + f"country_{consistent_hash(row.country.code)}")))
+                g.add((URIRef(DBR + f"country_{consistent_hash(row.country.code)}"), DBO.country_name, Literal(str(row.country.name), datatype=XSD.string)))
+
 ## Teams
-subpath= 'teams'
-path = os.path.join(trusted_path, subpath)
-df = DeltaTable.forPath(spark, path).toDF()
-team_ids = df.select("team_id").distinct().rdd.map(lambda row: row.team_id).collect()
-for row in df.toLocalIterator():
-    subject = URIRef(DBR + f"team_{row.team_id}")
-    if row.team_name is not None:
-        g.add((subject, DBO.team_name, Literal(str(row.team_name), datatype=XSD.string)))
-        
-## Venues
-subpath= 'venues'
-path = os.path.join(trusted_path, subpath)
-df = DeltaTable.forPath(spark, path).toDF()
+def add_teams(g, rows):
+    for row in rows:
+        subject = URIRef(DBR + f"team_{row.team_id}")
+        if row.team_name is not None:
+            g.add((subject, DBO.team_name, Literal(str(row.team_name), datatype=XSD.string)))
 
-for row in df.toLocalIterator():
-    subject = URIRef(DBR + f"venue_{consistent_hash(row.venue_id)}")
-    if row.venue_name is not None:
-        g.add((subject, DBO.venue_name, Literal(str(row.venue_name), datatype=XSD.string)))
-    if row.venue_city is not None:
-        g.add((subject, DBO.venue_city, Literal(str(row.venue_city), datatype=XSD.string)))
+## Venues
+def add_venues(g, rows):
+    for row in rows:
+        subject = URIRef(DBR + f"venue_{consistent_hash(row.venue_id)}")
+        if row.venue_name is not None:
+            g.add((subject, DBO.venue_name, Literal(str(row.venue_name), datatype=XSD.string)))
+        if row.venue_city is not None:
+            g.add((subject, DBO.venue_city, Literal(str(row.venue_city), datatype=XSD.string)))
 
 #ENTERTAINMENT
 ##Movies
-print("Creating Entertainments Instances ...")
-
-subpath= 'movie'
-
-path = os.path.join(trusted_path, subpath)
-df = DeltaTable.forPath(spark, path).toDF()
-film_ids = df.select("film_id").distinct().rdd.map(lambda row: row.film_id).collect()
-
-for row in df.toLocalIterator():
-
-    subject = URIRef(DBR+f"film_{row.film_id}")
-    
-    if row.title is not None:
-        g.add((subject, DBO.movie_title, Literal(str(row.title), datatype=XSD.string )))
-    if row.original_title is not None:
-        g.add((subject, DBO.movie_language, Literal(str(row.original_title), datatype=XSD.string )))
-    if row.release_date is not None:
-        g.add((subject, DBO.movie_release_date, Literal(row.release_date, datatype=XSD.date )))
-    if row.revenue is not None:
-        g.add((subject, DBO.movie_revenue, Literal(int(row.revenue), datatype=XSD.integer)))
-    if row.budget is not None:
-        g.add((subject, DBO.movie_budget, Literal(int(row.budget), datatype=XSD.integer )))
-    runtime_value = row.runtime
-    if runtime_value is not None and not math.isnan(runtime_value):
-        g.add((subject, DBO.movie_runtime, Literal(int(runtime_value), datatype=XSD.integer)))
-    if row.adult is not None:
-        g.add((subject, DBO.movie_adult, Literal(bool(row.adult), datatype=XSD.boolean)))
-    if row.popularity is not None:
-        g.add((subject, DBO.movie_popularity, Literal(float(row.popularity), datatype=XSD.long)))
-    if row.vote_average is not None:
-        g.add((subject, DBO.movie_vote_avg, Literal(float(row.vote_average), datatype=XSD.long)))
-    if row.vote_count is not None:
-        g.add((subject, DBO.movie_vote_cnt, Literal(int(row.vote_count), datatype=XSD.integer)))
-
-subpath= 'movie_genre'
-
-path = os.path.join(trusted_path, subpath)
-df = DeltaTable.forPath(spark, path).toDF()
-
-for row in df.toLocalIterator():
-    subject = URIRef(DBR+f"film_{row.film_id}")
-    object = URIRef(DBR+f"genre_{row.genre_id}")
-    g.add((subject, DBO.has_genre, object))
-
-subpath= 'trending'
-
-path = os.path.join(trusted_path, subpath)
-df = DeltaTable.forPath(spark, path).toDF()
-
-for row in df.toLocalIterator():
-    subject = URIRef(DBR+f"film_{row.film_id}")
-    g.add((subject, DBO.trending_movie, Literal(bool(True), datatype=XSD.boolean)))
-  
-subpath= 'upcoming'
-
-path = os.path.join(trusted_path, subpath)
-df = DeltaTable.forPath(spark, path).toDF()
-
-for row in df.toLocalIterator():
-    subject = URIRef(DBR+f"film_{row.film_id}")
-    g.add((subject, DBO.upcoming_movie, Literal(bool(True), datatype=XSD.boolean)))
-
-subpath= 'now_playing'
-
-path = os.path.join(trusted_path, subpath)
-df = DeltaTable.forPath(spark, path).toDF()
-
-for row in df.toLocalIterator():
-    subject = URIRef(DBR+f"film_{row.film_id}")
-    g.add((subject, DBO.now_playing_movie, Literal(bool(True), datatype=XSD.boolean)))
-    
-## Genres
-subpath= 'genre'
+def add_movies(g, rows):
+    for row in rows:
+
+        subject = URIRef(DBR+f"film_{row.film_id}")
+
+        if row.title is not None:
+            g.add((subject, DBO.movie_title, Literal(str(row.title), datatype=XSD.string )))
+        if row.original_title is not None:
+            g.add((subject, DBO.movie_language, Literal(str(row.original_title), datatype=XSD.string )))
+        if row.release_date is not None:
+            g.add((subject, DBO.movie_release_date, Literal(row.release_date, datatype=XSD.date )))
+        if row.revenue is not None:
+            g.add((subject, DBO.movie_revenue, Literal(int(row.revenue), datatype=XSD.integer)))
+        if row.budget is not None:
+            g.add((subject, DBO.movie_budget, Literal(int(row.budget), datatype=XSD.integer )))
+        runtime_value = row.runtime
+        if runtime_value is not None and not math.isnan(runtime_value):
+            g.add((subject, DBO.movie_runtime, Literal(int(runtime_value), datatype=XSD.integer)))
+        if row.adult is not None:
+            g.add((subject, DBO.movie_adult, Literal(bool(row.adult), datatype=XSD.boolean)))
+        if row.popularity is not None:
+            g.add((subject, DBO.movie_popularity, Literal(float(row.popularity), datatype=XSD.long)))
+        if row.vote_average is not None:
+            g.add((subject, DBO.movie_vote_avg, Literal(float(row.vote_average), datatype=XSD.long)))
+        if row.vote_count is not None:
+            g.add((subject, DBO.movie_vote_cnt, Literal(int(row.vote_count), datatype=XSD.integer)))
+
+def add_movie_genres(g, rows):
+    for row in rows:
+        subject = URIRef(DBR+f"film_{row.film_id}")
+        object = URIRef(DBR+f"genre_{row.genre_id}")
+        g.add((subject, DBO.has_genre, object))
+
+# trending, upcoming and now_playing only flag the films they list
+def add_movie_flags(g, rows, predicate):
+    for row in rows:
+        subject = URIRef(DBR+f"film_{row.film_id}")
+        g.add((subject, predicate, Literal(bool(True), datatype=XSD.boolean)))
 
-path = os.path.join(trusted_path, subpath)
-df = DeltaTable.forPath(spark, path).toDF()
-genre_ids = df.select("genre_id").distinct().rdd.map(lambda row: row.genre_id).collect()
-for row in df.toLocalIterator():
-    subject = URIRef(DBR+f"genre_{row.genre_id}")
-    g.add((subject, DBO.genre_name, Literal(str(row.genre), datatype=XSD.string )))
-    
+## Genres
+def add_genres(g, rows):
+    for row in rows:
+        subject = URIRef(DBR+f"genre_{row.genre_id}")
+        g.add((subject, DBO.genre_name, Literal(str(row.genre), datatype=XSD.string )))
 
 #NEWS
-kws=[]
-print("Creating News Instances ...")
-
-subpath= 'entertainment'
-
-path = os.path.join(trusted_path, subpath)
-df = DeltaTable.forPath(spark, path).toDF()
-kw= extract_column_keywords(df,top_n= 15)
-kws.extend(kw)
-for row in df.toLocalIterator():
-    subject = URIRef(DBR+f"news_{consistent_hash(row.url)}")
-    g.add((subject, RDF.type, DBO.Entertainment_News))
-    if row.author is not None:
-        g.add((subject, DBO.written_by, URIRef(DBR+f"author_{consistent_hash(row.author)}")))
-        g.add((URIRef(DBR+f"author_{consistent_hash(row.author)}"), DBO.author_name, Literal(str(row.author), datatype=XSD.string )))
-    if row.source is not None:
-        g.add((subject, DBO.published_at,  URIRef(DBR+f"source_{consistent_hash(row.source)}")))
-        g.add((URIRef(DBR+f"source_{consistent_hash(row.source)}"), DBO.source_name, Literal(str(row.source), datatype=XSD.string )))
-    if row.title is not None:
-        g.add((subject, DBO.news_title, Literal(str(row.title), datatype=XSD.string )))
-    if row.publishedAt is not None:
-        g.add((subject, DBO.news_date, Literal(row.publishedAt, datatype=XSD.dateTime)))
-    
-    text_fields = [
-        (row.title or "").lower(),
-        (row.content or "").lower(),
-        (row.description or "").lower()
-    ]
-
-    for keyword in kw:
-        keyword_lower = keyword.lower()
-        if any(keyword_lower in field for field in text_fields):
+# entertainment, sports and technology share one schema, only the class differs
+def add_news(g, rows, news_class, kw):
+    matcher = KeywordMatcher(kw)
+    for row in rows:
+        subject = URIRef(DBR+f"news_{consistent_hash(row.url)}")
+        g.add((subject, RDF.type, news_class))
+        if row.author is not None:
+            g.add((subject, DBO.written_by, URIRef(DBR+f"author_{consistent_hash(row.author)}")))
+            g.add((URIRef(DBR+f"author_{consistent_hash(row.author)}"), DBO.author_name, Literal(str(row.author), datatype=XSD.string )))
+        if row.source is not None:
+            g.add((subject, DBO.published_at,  URIRef(DBR+f"source_{consistent_hash(row.source)}")))
+            g.add((URIRef(DBR+f"source_{consistent_hash(row.source)}"), DBO.source_name, Literal(str(row.source), datatype=XSD.string )))
+        if row.title is not None:
+            g.add((subject, DBO.news_title, Literal(str(row.title), datatype=XSD.string )))
+        if row.publishedAt is not None:
+            g.add((subject, DBO.news_date, Literal(row.publishedAt, datatype=XSD.dateTime)))
+
+        # Every keyword contained in the title, content or description, in one pass
+        for k in matcher.find(row.title, row.content, row.description):
+            keyword = kw[k]
             g.add((subject, DBO.related_keyword, URIRef(DBR + f"keyword_{consistent_hash(keyword)}")))
             g.add((URIRef(DBR + f"keyword_{consistent_hash(keyword)}"),DBO.keyword_text, Literal(str(keyword), datatype=XSD.string )))
 
-subpath= 'sports'
-
-path = os.path.join(trusted_path, subpath)
-df = DeltaTable.forPath(spark, path).toDF()
-kw= extract_column_keywords(df,top_n= 15)
-kws.extend(kw)
-for row in df.toLocalIterator():
-    subject = URIRef(DBR+f"news_{consistent_hash(row.url)}")
-    g.add((subject, RDF.type, DBO.Sports_News))
-    if row.author is not None:
-        g.add((subject, DBO.written_by, URIRef(DBR+f"author_{consistent_hash(row.author)}")))
-        g.add((URIRef(DBR+f"author_{consistent_hash(row.author)}"), DBO.author_name, Literal(str(row.author), datatype=XSD.string )))
-    if row.source is not None:
-        g.add((subject, DBO.published_at,  URIRef(DBR+f"source_{consistent_hash(row.source)}")))
-        g.add((URIRef(DBR+f"source_{consistent_hash(row.source)}"), DBO.source_name, Literal(str(row.source), datatype=XSD.string )))
-    if row.title is not None:
-        g.add((subject, DBO.news_title, Literal(str(row.title), datatype=XSD.string )))
-    if row.publishedAt is not None:
-        g.add((subject, DBO.news_date, Literal(row.publishedAt, datatype=XSD.dateTime)))
-    
-    text_fields = [
-        (row.title or "").lower(),
-        (row.content or "").lower(),
-        (row.description or "").lower()
-    ]
-
-    for keyword in kw:
-        keyword_lower = keyword.lower()
-        if any(keyword_lower in field for field in text_fields):
-            g.add((subject, DBO.related_keyword, URIRef(DBR + f"keyword_{consistent_hash(keyword)}")))
-            g.add((URIRef(DBR + f"keyword_{consistent_hash(keyword)}"),DBO.keyword_text, Literal(str(keyword), datatype=XSD.string )))
+def create_spark_session():
+    # Spark and Delta are only needed to read the trusted zone
+    import pyspark
+    from delta import configure_spark_with_delta_pip
 
-subpath= 'technology'
-
-path = os.path.join(trusted_path, subpath)
-df = DeltaTable.forPath(spark, path).toDF()
-kw= extract_column_keywords(df,top_n= 15)
-kws.extend(kw)
-for row in df.toLocalIterator():
-    subject = URIRef(DBR+f"news_{consistent_hash(row.url)}")
-    g.add((subject, RDF.type, DBO.Tech_News))
-    if row.author is not None:
-        g.add((subject, DBO.written_by, URIRef(DBR+f"author_{consistent_hash(row.author)}")))
-        g.add((URIRef(DBR+f"author_{consistent_hash(row.author)}"), DBO.author_name, Literal(str(row.author), datatype=XSD.string )))
-    if row.source is not None:
-        g.add((subject, DBO.published_at,  URIRef(DBR+f"source_{consistent_hash(row.source)}")))
-        g.add((URIRef(DBR+f"source_{consistent_hash(row.source)}"), DBO.source_name, Literal(str(row.source), datatype=XSD.string )))
-    if row.title is not None:
-        g.add((subject, DBO.news_title, Literal(str(row.title), datatype=XSD.string )))
-    if row.publishedAt is not None:
-        g.add((subject, DBO.news_date, Literal(row.publishedAt, datatype=XSD.dateTime)))
-    
-    text_fields = [
-        (row.title or "").lower(),
-        (row.content or "").lower(),
-        (row.description or "").lower()
-    ]
-
-    for keyword in kw:
-        keyword_lower = keyword.lower()
-        if any(keyword_lower in field for field in text_fields):
-            g.add((subject, DBO.related_keyword, URIRef(DBR + f"keyword_{consistent_hash(keyword)}")))
-            g.add((URIRef(DBR + f"keyword_{consistent_hash(keyword)}"),DBO.keyword_text, Literal(str(keyword), datatype=XSD.string )))
+    is_gcs_enabled= "False"
+    if is_gcs_enabled.lower() == 'true':
+        is_gcs_enabled = True
+    else:
+        is_gcs_enabled = False
+
+
+    if is_gcs_enabled:
+        conf = (
+            pyspark.conf.SparkConf()
+            .setAppName("LetsTalk")
+            .set(
+                "spark.sql.catalog.spark_catalog",
+                "org.apache.spark.sql.delta.catalog.DeltaCatalog",
+            )
+            .set("spark.sql.extensions", "io.delta.sql.DeltaSparkSessionExtension")
+            .set("spark.hadoop.fs.gs.impl", "com.google.cloud.hadoop.fs.gcs.GoogleHadoopFileSystem")
+            .set("spark.hadoop.google.cloud.auth.service.account.enable", "true")
+            .set("spark.hadoop.google.cloud.auth.service.account.json.keyfile", "gcs/gcs.json")
+            .set("spark.sql.shuffle.partitions", "4")
+            .set("spark.driver.memory", "2g") \
+            .set("spark.executor.memory", "2g") \
+            .set("spark.jars", "gcs/gcs-connector-hadoop.jar")
+            .setMaster(
+                "local[*]"
+            )
+        )
+
+        builder = pyspark.sql.SparkSession.builder.appName("LetsTalk").config(conf=conf)
+    else:
+        builder = pyspark.sql.SparkSession.builder.appName("LetsTalk") \
+            .config("spark.sql.extensions", "io.delta.sql.DeltaSparkSessionExtension") \
+            .config("spark.driver.memory", "6g") \
+            .config("spark.executor.memory", "6g") \
+            .config("spark.sql.catalog.spark_catalog", "org.apache.spark.sql.delta.catalog.DeltaCatalog")
 
+    return configure_spark_with_delta_pip(builder).getOrCreate()
 
-print(f"Generating {USERS} User Instances ...")
-#USERS
-for i in range(USERS):
-    
-    subject = URIRef(DBR+f"user_{i}")
-    g.add((subject, DBO.user_name, Literal(str(names.get_full_name()), datatype=XSD.string )))
-    
-    g.add((subject, DBO.user_country, URIRef(DBR+f"country_{consistent_hash(random.choice(country_ids))}")))
-   
-     # Likes movies
-    liked_films = random.sample(film_ids, min(len(film_ids), random.randint(1, 3)))
-    for film_id in liked_films:
-        g.add((subject, DBO.likes_movie, URIRef(DBR + f"film_{film_id}")))
-
-    # Likes genres
-    liked_genres = random.sample(genre_ids, min(len(genre_ids), random.randint(1, 3)))
-    for genre_id in liked_genres:
-        g.add((subject, DBO.likes_genre, URIRef(DBR + f"genre_{genre_id}")))
-    
-    # Likes teams
-    liked_teams = random.sample(team_ids, min(len(team_ids), random.randint(1, 3)))
-    for team_id in liked_teams:
-        g.add((subject, DBO.likes_team, URIRef(DBR + f"team_{team_id}")))
-
-    # Likes competitions
-    liked_competitions = random.sample(league_ids, min(len(league_ids), random.randint(1, 3)))
-    for comp_id in liked_competitions:
-        g.add((subject, DBO.likes_competition, URIRef(DBR + f"competition_{comp_id}")))
-    
-    # Interested in keywords
-    interested_keywords = random.sample(kws, min(len(kws), random.randint(1, 5)))
-    
-    for kw in interested_keywords:
-        g.add((subject, DBO.interested_in, URIRef(DBR + f"keyword_{consistent_hash(kw)}")))
-    
-print("Serializing...")
-g.serialize("./docker-import/abox.ttl", format="turtle")
+def read_table(spark, subpath, version=None):
+    from delta import DeltaTable
 
+    path = os.path.join(trusted_path, subpath)
+    if version is None:
+        return DeltaTable.forPath(spark, path).toDF()
+    return spark.read.format("delta").option("versionAsOf", version).load(path)
 
+def table_version(spark, subpath):
+    """Latest Delta version of a trusted zone table."""
+    from delta import DeltaTable
+
+    path = os.path.join(trusted_path, subpath)
+    return DeltaTable.forPath(spark, path).history(1).collect()[0]["version"]
+
+def read_changes(spark, subpath, start, end):
+    """
+    Change data feed of versions start..end, with the table's columns and
+    _change_type. Fails once read if the table did not record change data for
+    all of them (delta.enableChangeDataFeed).
+    """
+    return (spark.read.format("delta")
+            .option("readChangeFeed", "true")
+            .option("startingVersion", start)
+            .option("endingVersion", end)
+            .load(os.path.join(trusted_path, subpath)))
+
+def distinct_values(df, column):
+    """Sorted distinct non-null values of a column, e.g. the ids users can link to."""
+    return sorted(row[0] for row in df.select(column).distinct().collect() if row[0] is not None)
+
+def partition_triples(add_rows, *args):
+    """mapPartitions function: the N-Triples lines add_rows makes from one partition."""
+    def triplify(rows):
+        g = NTriplesLines(DEDUPE_PREDICATES)
+        add_rows(g, rows, *args)
+        return g.lines
+    return triplify
+
+def partition_changes(add_rows, *args):
+    """
+    mapPartitions function over change data feed rows: (line, 1) for every
+    N-Triples line of an inserted row or postimage, (line, -1) for those of a
+    deleted row or preimage. Summed by line, they give the net change of the
+    table's triples whatever the order of the versions.
+    """
+    def triplify(rows):
+        for row in rows:
+            g = NTriplesLines()
+            add_rows(g, [row], *args)
+            sign = -1 if row._change_type in ("delete", "update_preimage") else 1
+            for line in g.lines:
+                yield line, sign
+    return triplify
+
+def main(users, output="./docker-import/abox.nt.gz", shard_bytes=None, spark_output=None, seed=0, workers=None):
+    spark = create_spark_session()
+
+    if spark_output:
+        # Each table is triplified on the executors and written as gzip text parts,
+        # <spark_output>/<table>/part-*.gz. Names repeated across partitions are left
+        # for GraphDB to merge.
+        here = os.path.dirname(os.path.abspath(__file__))
+        spark.sparkContext.addPyFile(os.path.join(here, "ntriples_sink.py"))
+        spark.sparkContext.addPyFile(os.path.join(here, "keyword_matcher.py"))
+        spark.sparkContext.addPyFile(os.path.join(here, "user_generator.py"))
+        spark.sparkContext.addPyFile(os.path.join(here, "abox.py"))
+        shutil.rmtree(spark_output, ignore_errors=True)
+
+        def emit(name, df, add_rows, *args):
+            rdd = df.rdd if hasattr(df, "rdd") else df
+            rdd.mapPartitions(partition_triples(add_rows, *args)).saveAsTextFile(
+                os.path.join(spark_output, name), compressionCodecClass=GZIP_CODEC)
+    else:
+        if output.endswith(".ttl"):
+            # The old in-memory Graph, serialised as Turtle at the end
+            g = Graph()
+            g.bind("dbo", DBO)
+            g.bind("dbr", DBR)
+        else:
+            g = NTriplesSink(output, max_shard_bytes=shard_bytes, dedupe_predicates=DEDUPE_PREDICATES)
+
+        def emit(name, df, add_rows, *args):
+            add_rows(g, df.toLocalIterator() if hasattr(df, "toLocalIterator") else df, *args)
+
+    print("Creating Sport Instances ...")
+    emit('matches', read_table(spark, 'matches'), add_matches)
+
+    df = read_table(spark, 'leagues')
+    # Sorted, so the same --seed gives the same users whatever the partitioning
+    league_ids = distinct_values(df, "league_id")
+    country_ids = distinct_values(df, "country.code")
+    emit('leagues', df, add_competitions)
+
+    df = read_table(spark, 'teams')
+    team_ids = distinct_values(df, "team_id")
+    emit('teams', df, add_teams)
+
+    emit('venues', read_table(spark, 'venues'), add_venues)
+
+    print("Creating Entertainments Instances ...")
+    df = read_table(spark, 'movie')
+    film_ids = distinct_values(df, "film_id")
+    emit('movie', df, add_movies)
+
+    emit('movie_genre', read_table(spark, 'movie_genre'), add_movie_genres)
+    emit('trending', read_table(spark, 'trending'), add_movie_flags, DBO.trending_movie)
+    emit('upcoming', read_table(spark, 'upcoming'), add_movie_flags, DBO.upcoming_movie)
+    emit('now_playing', read_table(spark, 'now_playing'), add_movie_flags, DBO.now_playing_movie)
+
+    df = read_table(spark, 'genre')
+    genre_ids = distinct_values(df, "genre_id")
+    emit('genre', df, add_genres)
+
+    kws=[]
+    print("Creating News Instances ...")
+    for subpath, news_class in (('entertainment', DBO.Entertainment_News),
+                                ('sports', DBO.Sports_News),
+                                ('technology', DBO.Tech_News)):
+        df = read_table(spark, subpath)
+        kw= extract_column_keywords(df,top_n= 15)
+        kws.extend(kw)
+        emit(subpath, df, add_news, news_class, kw)
+
+    print(f"Generating {users} User Instances ...")
+    # Same users for the same seed, however they are split between processes
+    generator = UserGenerator(
+        build_candidates(country_ids, film_ids, genre_ids, team_ids, league_ids, kws, consistent_hash), seed)
+    n_blocks = generator.n_blocks(users)
+    if spark_output:
+        spark.sparkContext.parallelize(range(n_blocks), max(1, n_blocks)) \
+            .flatMap(lambda block: generator.block_lines(block, users)) \
+            .saveAsTextFile(os.path.join(spark_output, 'users'), compressionCodecClass=GZIP_CODEC)
+        print(f"Wrote the triples of every table under {spark_output}")
+    elif isinstance(g, Graph):
+        for block in range(n_blocks):
+            g.parse(data="\n".join(generator.block_lines(block, users)), format="nt")
+        print("Serializing...")
+        g.serialize(output, format="turtle")
+    else:
+        g.close()
+        # One gzip shard per block of users, written by `workers` processes
+        user_paths = write_users(generator, users, g.base + "-users", workers)
+        print(f"Wrote {len(g)} triples to {', '.join(g.paths)} and the users to {len(user_paths)} shards")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the ABox from the trusted zone")
+    parser.add_argument("users", type=int, help="Number of synthetic users")
+    parser.add_argument("--output", default="./docker-import/abox.nt.gz",
+                        help="N-Triples file (.nt or .nt.gz), or .ttl for a single Turtle file built in memory")
+    parser.add_argument("--shard-mb", type=int, default=None,
+                        help="Split the N-Triples output into shards of about this many MB (uncompressed)")
+    parser.add_argument("--spark-output", default=None,
+                        help="Triplify on the Spark executors instead, into one folder of gzip parts per table")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic users")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes writing the user shards (all cores by default)")
+    args = parser.parse_args()
+    main(args.users, args.output, args.shard_mb and args.shard_mb * 2 ** 20, args.spark_output,
+         args.seed, args.workers)
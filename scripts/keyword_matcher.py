@@ -0,0 +1,69 @@
+"""
+Aho-Corasick matcher: finds which of many keywords occur in a text in one pass.
+
+The keywords are compiled into an automaton whose transitions are complete
+for every character used by a keyword (any other character goes back to the
+start), so scanning costs one dictionary lookup per character however many
+keywords there are. Matching is plain case-insensitive substring matching,
+the same as `keyword.lower() in text.lower()` for each keyword, overlaps
+included.
+"""
+from collections import deque
+
+
+class KeywordMatcher:
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        patterns = [k.lower() for k in self.keywords]
+        # An empty keyword is in every text
+        self._always = [i for i, p in enumerate(patterns) if not p]
+
+        # Trie of the patterns: goto[state] maps a character to the next state
+        goto = [{}]
+        outputs = [[]]
+        for i, pattern in enumerate(patterns):
+            if not pattern:
+                continue
+            state = 0
+            for ch in pattern:
+                if ch not in goto[state]:
+                    goto.append({})
+                    outputs.append([])
+                    goto[state][ch] = len(goto) - 1
+                state = goto[state][ch]
+            outputs[state].append(i)
+
+        # Failure links in breadth-first order, turning the trie into a complete
+        # automaton over the keyword alphabet and merging the outputs of suffixes
+        alphabet = {ch for pattern in patterns for ch in pattern}
+        fail = [0] * len(goto)
+        delta = [dict(g) for g in goto]
+        queue = deque(goto[0].values())
+        for ch in alphabet:
+            delta[0].setdefault(ch, 0)
+        while queue:
+            state = queue.popleft()
+            outputs[state] = outputs[state] + outputs[fail[state]]
+            for ch in alphabet:
+                child = goto[state].get(ch)
+                if child is None:
+                    delta[state][ch] = delta[fail[state]][ch]
+                else:
+                    fail[child] = delta[fail[state]][ch]
+                    queue.append(child)
+        self._delta = delta
+        self._outputs = [tuple(o) for o in outputs]
+
+    def find(self, *texts) -> list:
+        """Indices (in keyword order) of the keywords found in any of `texts`."""
+        found = set(self._always)
+        delta, outputs = self._delta, self._outputs
+        for text in texts:
+            if not text:
+                continue
+            state = 0
+            for ch in text.lower():
+                state = delta[state].get(ch, 0)
+                if outputs[state]:
+                    found.update(outputs[state])
+        return sorted(found)
@@ -0,0 +1,129 @@
+"""
+Streaming N-Triples writer with the `add((s, p, o))` of an rdflib Graph.
+
+Triples are written as they are added instead of being kept in memory until
+a final Turtle serialisation, so memory does not grow with the number of
+users or rows. Output can be gzip-compressed and split into shards of about
+`max_shard_bytes` (uncompressed), named <name>-00000.nt[.gz], <name>-00001...
+
+Unlike a Graph, the sink does not deduplicate on its own. Triples whose
+predicate is in `dedupe_predicates` (names of authors, sources, keywords...
+which are added again for every news item or match that mentions them) are
+only written the first time; the seen-set keeps a 64-bit hash per distinct
+triple, so it is bounded by the number of such entities, not by the data.
+"""
+import gzip
+import os
+
+from rdflib import Literal, URIRef
+
+
+def _escape(value: str) -> str:
+    return (value.replace("\\", "\\\\").replace('"', '\\"')
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def term_to_nt(term) -> str:
+    if isinstance(term, Literal):
+        if term.language:
+            return f'"{_escape(str(term))}"@{term.language}'
+        if term.datatype:
+            return f'"{_escape(str(term))}"^^<{term.datatype}>'
+        return f'"{_escape(str(term))}"'
+    if isinstance(term, URIRef):
+        return f"<{term}>"
+    raise ValueError(f"Blank nodes and variables are not supported: {term!r}")
+
+
+def format_triple(triple) -> str:
+    s, p, o = triple
+    return f"{term_to_nt(s)} {term_to_nt(p)} {term_to_nt(o)} ."
+
+
+class _Deduplicated:
+    def __init__(self, dedupe_predicates=()):
+        self.dedupe_predicates = {str(p) for p in dedupe_predicates}
+        self._seen = set()
+
+    def _is_new(self, triple, line: str) -> bool:
+        if str(triple[1]) not in self.dedupe_predicates:
+            return True
+        # hash() is only compared within this process, so its per-run seed does not matter
+        key = hash(line)
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        return True
+
+
+class NTriplesLines(_Deduplicated):
+    """N-Triples lines of the added triples kept in a list, e.g. for one Spark partition."""
+
+    def __init__(self, dedupe_predicates=()):
+        super().__init__(dedupe_predicates)
+        self.lines = []
+
+    def add(self, triple):
+        line = format_triple(triple)
+        if self._is_new(triple, line):
+            self.lines.append(line)
+
+    def __len__(self):
+        return len(self.lines)
+
+
+class NTriplesSink(_Deduplicated):
+    def __init__(self, path, compress=None, max_shard_bytes=None, dedupe_predicates=()):
+        super().__init__(dedupe_predicates)
+        compress = path.endswith(".gz") if compress is None else compress
+        base = path[:-3] if path.endswith(".gz") else path
+        base = base[:-3] if base.endswith(".nt") else base
+        self.base = base
+        self.suffix = ".nt.gz" if compress else ".nt"
+        self.compress = compress
+        self.max_shard_bytes = max_shard_bytes
+        self.paths = []
+        self._file = None
+        self._shard_bytes = 0
+        self._count = 0
+
+    def _open_shard(self):
+        if self._file is not None:
+            self._file.close()
+        if self.max_shard_bytes:
+            path = f"{self.base}-{len(self.paths):05d}{self.suffix}"
+        else:
+            path = self.base + self.suffix
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if self.compress:
+            # Level 6: nearly the size of 9 at a fraction of the time
+            self._file = gzip.open(path, "wt", encoding="utf-8", compresslevel=6)
+        else:
+            self._file = open(path, "w", encoding="utf-8")
+        self.paths.append(path)
+        self._shard_bytes = 0
+
+    def add(self, triple):
+        line = format_triple(triple) + "\n"
+        if not self._is_new(triple, line):
+            return
+
+        if self._file is None or (self.max_shard_bytes and self._shard_bytes >= self.max_shard_bytes):
+            self._open_shard()
+        self._file.write(line)
+        self._shard_bytes += len(line)
+        self._count += 1
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        if self._file is None:
+            self._open_shard()  # Still leave an (empty) file behind
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,171 @@
+"""
+Synthetic users of the ABox, generated in bulk.
+
+Every user gets a name, a country, 1-3 liked movies, genres, teams and
+competitions and 1-5 keywords of interest, as before, but all of them are
+drawn with a seeded NumPy generator and written straight as N-Triples lines.
+Names are drawn from the frequency tables of the `names` package, like
+names.get_full_name(), and the URIs of the candidate entities (hashed ones
+included) are built once.
+
+Users are generated in blocks of `block_size`. Block b always uses the seed
+sequence (seed, b) and goes to its own shard, so the output is the same for a
+given seed whatever the number of worker processes.
+"""
+import gzip
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+
+import names
+
+BLOCK_SIZE = 100000
+
+DBO = "http://sdm_upc.org/ontology/"
+DBR = "http://sdm_upc.org/resource/"
+XSD_STRING = "http://www.w3.org/2001/XMLSchema#string"
+
+
+def _read_names(filename):
+    """Names of a names package table, capitalised, and their cumulative frequencies."""
+    table, cumulative = [], []
+    with open(names.FILES[filename]) as f:
+        for line in f:
+            name, _, cummulative, _ = line.split()
+            table.append(name.capitalize())
+            cumulative.append(float(cummulative))
+    # "" when the draw is past the end of the table, as names.get_name does
+    return np.array(table + [""], dtype=object), np.array(cumulative)
+
+
+@dataclass(frozen=True)
+class Candidates:
+    """N-Triples terms of everything a user can be linked to."""
+    countries: np.ndarray
+    films: np.ndarray
+    genres: np.ndarray
+    teams: np.ndarray
+    competitions: np.ndarray
+    keywords: np.ndarray
+
+
+def build_candidates(country_ids, film_ids, genre_ids, team_ids, league_ids, kws, consistent_hash) -> Candidates:
+    def terms(template, values):
+        return np.array([f"<{DBR}{template.format(v)}>" for v in values], dtype=object)
+
+    return Candidates(
+        countries=terms("country_{}", [consistent_hash(c) for c in country_ids]),
+        films=terms("film_{}", film_ids),
+        genres=terms("genre_{}", genre_ids),
+        teams=terms("team_{}", team_ids),
+        competitions=terms("competition_{}", league_ids),
+        keywords=terms("keyword_{}", [consistent_hash(k) for k in kws]),
+    )
+
+
+def sample_without_replacement(rng, n_users: int, pool: int, most: int):
+    """
+    1..most distinct indices below `pool` for every user, as random.sample of a
+    random.randint(1, most) sized subset would give. Returns an (n_users, m)
+    array in draw order and the number of valid leading columns of each row.
+    """
+    counts = np.minimum(rng.integers(1, most + 1, size=n_users), pool)
+    columns = min(most, pool)
+    drawn = np.empty((n_users, columns), dtype=np.int64)
+    taken = np.empty((n_users, 0), dtype=np.int64)  # Chosen so far, sorted per user
+    for j in range(columns):
+        # Draw among the pool - j unchosen items, then skip over the chosen ones below it
+        pick = rng.integers(0, pool - j, size=n_users)
+        for column in taken.T:
+            pick += column <= pick
+        drawn[:, j] = pick
+        taken = np.sort(np.concatenate([taken, pick[:, None]], axis=1), axis=1)
+    return drawn, counts
+
+
+class UserGenerator:
+    def __init__(self, candidates: Candidates, seed: int = 0, block_size: int = BLOCK_SIZE):
+        self.candidates = candidates
+        self.seed = seed
+        self.block_size = block_size
+        self._names = {gender: _read_names(f"first:{gender}") for gender in ("male", "female")}
+        self._last = _read_names("last")
+
+    def _names_of(self, rng, n):
+        def draw(table):
+            labels, cumulative = table
+            return labels[np.searchsorted(cumulative, rng.random(n) * 90, side="right")]
+
+        male = rng.random(n) < 0.5
+        first = np.where(male, draw(self._names["male"]), draw(self._names["female"]))
+        return [f"{a} {b}" for a, b in zip(first, draw(self._last))]
+
+    def block_lines(self, block: int, n_users: int) -> list:
+        """N-Triples lines of the users of one block, in user order."""
+        start = block * self.block_size
+        stop = min(n_users, start + self.block_size)
+        n = stop - start
+        rng = np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(block,)))
+        c = self.candidates
+
+        full_names = self._names_of(rng, n)
+        countries = c.countries[rng.integers(0, len(c.countries), size=n)] if len(c.countries) else None
+        links = [
+            (f"<{DBO}{link}>", pool, sample_without_replacement(rng, n, len(pool), most))
+            for link, pool, most in (("likes_movie", c.films, 3), ("likes_genre", c.genres, 3),
+                                     ("likes_team", c.teams, 3), ("likes_competition", c.competitions, 3),
+                                     ("interested_in", c.keywords, 5))
+        ]
+
+        user_name = f"<{DBO}user_name>"
+        user_country = f"<{DBO}user_country>"
+        lines = []
+        for k in range(n):
+            subject = f"<{DBR}user_{start + k}>"
+            escaped = full_names[k].replace("\\", "\\\\").replace('"', '\\"')
+            lines.append(f'{subject} {user_name} "{escaped}"^^<{XSD_STRING}> .')
+            if countries is not None:
+                lines.append(f"{subject} {user_country} {countries[k]} .")
+            for predicate, pool, (drawn, counts) in links:
+                for item in pool[drawn[k, :counts[k]]]:
+                    lines.append(f"{subject} {predicate} {item} .")
+        return lines
+
+    def n_blocks(self, n_users: int) -> int:
+        return (n_users + self.block_size - 1) // self.block_size
+
+    def write_block(self, block: int, n_users: int, base: str) -> str:
+        path = f"{base}-{block:05d}.nt.gz"
+        # mtime=0 so that the same seed gives byte-identical shards
+        with gzip.GzipFile(path, "wb", compresslevel=6, mtime=0) as raw, \
+                io.TextIOWrapper(raw, encoding="utf-8") as f:
+            for line in self.block_lines(block, n_users):
+                f.write(line + "\n")
+        return path
+
+
+_worker_generator = None
+
+
+def _init_worker(generator: UserGenerator):
+    global _worker_generator
+    _worker_generator = generator
+
+
+def _write_block(block: int, n_users: int, base: str) -> str:
+    return _worker_generator.write_block(block, n_users, base)
+
+
+def write_users(generator: UserGenerator, n_users: int, base: str, workers: int = None) -> list:
+    """Write <base>-00000.nt.gz, ... one shard per block, over `workers` processes."""
+    os.makedirs(os.path.dirname(base) or ".", exist_ok=True)
+    blocks = range(generator.n_blocks(n_users))
+    workers = min(workers or os.cpu_count() or 1, len(blocks))
+    if workers <= 1:
+        return [generator.write_block(block, n_users, base) for block in blocks]
+    # The generator (with its name tables) is sent once per worker, not with every block
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(generator,)) as pool:
+        return list(pool.map(_write_block, blocks, [n_users] * len(blocks), [base] * len(blocks)))
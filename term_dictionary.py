@@ -0,0 +1,115 @@
+"""
+Integer-encoded triples with a shared term dictionary.
+
+    python term_dictionary.py [triples.tsv]
+
+encodes an existing export; download_kg.py --int-triples writes the same
+files while it exports. Next to triples.tsv it writes:
+
+    triples.npy              # int64 (N, 3): head, relation, tail ids
+    triples.json             # counts and the fingerprint of the triples.tsv they match
+    entity_to_id.tsv.gz      # PyKEEN mapping layout (id, label), quoted as pandas does
+    relation_to_id.tsv.gz
+    entity_labels.bin, entity_offsets.npy, entity_ids.npy, entity_positions.npy
+    relation_*               # the labels as the serving artifact stores them
+
+Subjects and objects (literals included) are entities and predicates are
+relations, numbered in sorted label order as TriplesFactory.from_path
+numbers them. So a model trained with
+TriplesFactory(mapped_triples=..., entity_to_id=..., relation_to_id=...)
+has the ids of this dictionary. The labels files are those of the serving
+artifact (serving_artifact.write_labels); since ids follow label order,
+entity_ids.npy and entity_positions.npy are simply 0..n-1.
+"""
+import csv
+import gzip
+import json
+import os
+import sys
+from array import array
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "python-backend"))
+
+from encoded_triples import triples_fingerprint
+from serving_artifact import write_labels
+
+
+class TermEncoder:
+    """Numbers terms as triples are added and writes the dictionary at the end."""
+
+    def __init__(self):
+        self.entities = {}
+        self.relations = {}
+        self._rows = array("q")
+
+    def add(self, s: str, p: str, o: str):
+        entities = self.entities
+        self._rows.append(entities.setdefault(s, len(entities)))
+        self._rows.append(self.relations.setdefault(p, len(self.relations)))
+        self._rows.append(entities.setdefault(o, len(entities)))
+
+    def __len__(self):
+        return len(self._rows) // 3
+
+    def write(self, out_dir: str, source_path: str = None) -> dict:
+        # Ids were handed out in order of appearance; renumber them in label order
+        entity_rank, entity_labels = _sorted_ids(self.entities)
+        relation_rank, relation_labels = _sorted_ids(self.relations)
+        triples = np.frombuffer(self._rows, dtype=np.int64).reshape(-1, 3)
+        encoded = np.empty_like(triples)
+        encoded[:, 0] = entity_rank[triples[:, 0]]
+        encoded[:, 1] = relation_rank[triples[:, 1]]
+        encoded[:, 2] = entity_rank[triples[:, 2]]
+
+        os.makedirs(out_dir, exist_ok=True)
+        np.save(os.path.join(out_dir, "triples.npy"), encoded)
+        _write_dictionary(out_dir, "entity", entity_labels)
+        _write_dictionary(out_dir, "relation", relation_labels)
+        meta = {
+            "triples": len(encoded),
+            "entities": len(entity_labels),
+            "relations": len(relation_labels),
+            "source_fingerprint": triples_fingerprint(source_path) if source_path else None,
+        }
+        # Written last: readers only trust the arrays once it matches triples.tsv
+        with open(os.path.join(out_dir, "triples.json"), "w") as f:
+            json.dump(meta, f)
+        return meta
+
+
+def _sorted_ids(term_to_id: dict):
+    labels = sorted(term_to_id)
+    rank = np.empty(len(labels), dtype=np.int64)
+    rank[[term_to_id[label] for label in labels]] = np.arange(len(labels))
+    return rank, labels
+
+
+def _write_dictionary(out_dir: str, prefix: str, labels: list):
+    # PyKEEN numbers labels in sorted order. Literals can hold tabs and newlines,
+    # so labels are quoted like the triples.tsv they come from
+    with gzip.open(os.path.join(out_dir, f"{prefix}_to_id.tsv.gz"), "wt", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+        writer.writerow(["id", "label"])
+        writer.writerows(enumerate(labels))
+    write_labels(out_dir, prefix, {label: i for i, label in enumerate(labels)})
+
+
+def encode_tsv(triples_path: str) -> dict:
+    """Encode a triples.tsv as download_kg.py exports it, next to it."""
+    encoder = TermEncoder()
+    csv.field_size_limit(sys.maxsize)
+    with open(triples_path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f, delimiter="\t")
+        next(reader, None)  # Header
+        for row in reader:
+            if len(row) == 3:
+                encoder.add(*row)
+    return encoder.write(os.path.dirname(triples_path) or ".", triples_path)
+
+
+if __name__ == "__main__":
+    triples_path = sys.argv[1] if len(sys.argv) > 1 else "drive-embeddings/data/triples.tsv"
+    meta = encode_tsv(triples_path)
+    print(f"Encoded {meta['triples']} triples: {meta['entities']} entities, {meta['relations']} relations")
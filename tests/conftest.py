@@ -0,0 +1,7 @@
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+# The backend, the scripts and the benchmarks are run as plain scripts, not installed
+for path in ("python-backend", "scripts", "benchmarks", "."):
+    sys.path.insert(0, os.path.join(ROOT, path))
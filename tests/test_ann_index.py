@@ -0,0 +1,39 @@
+import dataclasses
+
+import pytest
+
+import synthetic_kg
+from ann_index import similar_users
+from model_registry import load_model
+from user_index import build_user_index
+
+
+@pytest.fixture(scope="module")
+def kg(tmp_path_factory):
+    paths = synthetic_kg.generate(str(tmp_path_factory.mktemp("kg")), 500, seed=1)
+    model = load_model(paths["model_path"])
+    return model, build_user_index(model, paths["triples_path"])
+
+
+def test_similar_users_leaves_the_query_out(kg):
+    model, users = kg
+    uri = synthetic_kg.user_uri(7)
+    result = similar_users(model, users, [uri], k=5)["results"][0]
+    assert len(result["neighbours"]) == 5
+    assert uri not in [n["user_uri"] for n in result["neighbours"]]
+
+
+@pytest.mark.parametrize("uri", [synthetic_kg.item_uri("film", 3), "http://sdm_upc.org/resource/nobody"])
+def test_similar_users_rejects_non_users(kg, uri):
+    model, users = kg
+    with pytest.raises(ValueError, match="Unknown users"):
+        similar_users(model, users, [synthetic_kg.user_uri(1), uri])
+
+
+def test_similar_users_rejects_entities_sorting_after_every_user(kg):
+    model, users = kg
+    # The model knows the last users, but the index does not
+    fewer = dataclasses.replace(users, rows=users.rows[:-10])
+    last = users.labels(model, users.rows[-1:])[0]
+    with pytest.raises(ValueError, match="Unknown users"):
+        similar_users(model, fewer, [last])
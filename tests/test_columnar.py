@@ -0,0 +1,62 @@
+import json
+import struct
+
+import pytest
+
+import columnar
+
+RESULTS = {
+    "cluster_distribution": {"0": 2, "1": 1},
+    "user_clusters": [
+        {"user_uri": "http://sdm_upc.org/resource/user_1", "cluster": 0},
+        {"user_uri": "http://sdm_upc.org/resource/user_2", "cluster": 1},
+        {"user_uri": "http://example.org/people#Zoë", "cluster": 0},
+    ],
+    "embeddings_2d": [[0.5, -1.25], [2.0, 3.5], [-0.75, 0.0]],
+    "cluster_labels": [0, 1, 0],
+    "parameters": {"algorithm": "kmeans", "n_clusters": 2},
+}
+
+
+@pytest.mark.parametrize("compression", columnar.COMPRESSIONS)
+def test_decode_inverts_encode(compression):
+    assert columnar.decode(columnar.encode(RESULTS, compression)) == RESULTS
+
+
+def test_columns_are_aligned_and_prefixes_sent_once():
+    payload = columnar.encode(RESULTS)
+    (header_length,) = struct.unpack("<I", payload[4:8])
+    header = json.loads(payload[8:8 + header_length])
+    assert all(column["offset"] % columnar.ALIGNMENT == 0 for column in header["columns"])
+    prefixes = next(c for c in header["columns"] if c["name"] == "uri_prefix_offsets")
+    assert prefixes["shape"] == [3]  # Two namespaces
+
+
+def test_empty_results_round_trip():
+    empty = dict(RESULTS, cluster_distribution={}, user_clusters=[], embeddings_2d=[], cluster_labels=[])
+    assert columnar.decode(columnar.encode(empty, "zlib")) == empty
+
+
+@pytest.mark.parametrize("accept, expected", [
+    ("application/json", None),
+    (None, None),
+    ("application/json, application/vnd.kg-clusters.columnar", "none"),
+    ('application/vnd.kg-clusters.columnar; compression="zlib"', "zlib"),
+])
+def test_negotiate(accept, expected):
+    assert columnar.negotiate(accept) == expected
+
+
+@pytest.mark.parametrize("accept", ["", "*/*", "text/html, */*;q=0.8", "application/*"])
+def test_negotiate_falls_back_to_json(accept):
+    assert columnar.negotiate(accept) is None
+
+
+def test_negotiate_rejects_unknown_compression():
+    with pytest.raises(ValueError, match="Unsupported compression"):
+        columnar.negotiate("application/vnd.kg-clusters.columnar; compression=br")
+
+
+def test_negotiate_rejects_other_media_types():
+    with pytest.raises(ValueError, match="Cannot answer"):
+        columnar.negotiate("application/xml, text/csv")
@@ -0,0 +1,164 @@
+import gzip
+import os
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+import abox
+import synthetic_kg
+from abox import DBO
+from create_kg import SHARED_PREDICATES, Manifest, NameChanged, apply_changes, write_table
+from synthetic_kg import Country, League
+
+
+def save_parts(parts_dir, rows, add_rows, *args, n_parts=2):
+    """The gzip parts Spark saves for `rows` split in `n_parts` partitions."""
+    os.makedirs(parts_dir)
+    triplify = abox.partition_triples(add_rows, *args)
+    for k in range(n_parts):
+        with gzip.open(os.path.join(parts_dir, f"part-{k:05d}.gz"), "wt", encoding="utf-8") as f:
+            f.writelines(line + "\n" for line in triplify(rows[k::n_parts]))
+    open(os.path.join(parts_dir, "_SUCCESS"), "w").close()
+
+
+def build(tmp_path, rows, add_rows, *args):
+    path = str(tmp_path / "abox-table.nt.gz")
+    parts_dir = str(tmp_path / ".abox-table.parts")
+    save_parts(parts_dir, rows, add_rows, *args)
+    write_table(path, parts_dir)
+    return path
+
+
+def change(row, change_type):
+    return SimpleNamespace(**row._asdict(), _change_type=change_type)
+
+
+def net_change(changes, add_rows, *args):
+    deltas = Counter()
+    for line, sign in abox.partition_changes(add_rows, *args)(changes):
+        deltas[line] += sign
+    return dict(deltas)
+
+
+def contents(path):
+    """Lines of a triples file and the names in it, which a rebuild may repeat across partitions."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        lines = Counter(line.rstrip("\n") for line in f)
+    names = {line for line in lines if line.split(" ", 2)[1] in SHARED_PREDICATES}
+    return {line: n for line, n in lines.items() if line not in names}, names
+
+
+def assert_rebuilt(path, rebuilt_path):
+    """The patched file has the lines of a rebuild, and names of entities no longer mentioned."""
+    lines, names = contents(path)
+    rebuilt_lines, rebuilt_names = contents(rebuilt_path)
+    assert lines == rebuilt_lines
+    assert names >= rebuilt_names
+
+
+def leagues(*specs):
+    return [League(league_id, "league", f"League {league_id}", Country(code, f"Country {code}"))
+            for league_id, code in specs]
+
+
+def test_write_table_joins_the_parts(tmp_path):
+    rows = synthetic_kg.catalogue_rows(seed=0, n_matches=50, n_news=10)["matches"]
+    path = build(tmp_path, rows, abox.add_matches)
+
+    expected = Counter(abox.partition_triples(abox.add_matches)(rows))
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        written = Counter(line.rstrip("\n") for line in f)
+    # Names are only deduplicated within a partition
+    assert {line: min(n, 1) for line, n in written.items()} == {line: min(n, 1) for line, n in expected.items()}
+    assert sum(written.values()) >= len(expected)
+    assert not os.path.exists(tmp_path / ".abox-table.parts")
+
+
+def test_write_table_of_an_empty_table(tmp_path):
+    path = build(tmp_path, [], abox.add_matches)
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        assert f.read() == ""
+
+
+def test_apply_changes_inserts_updates_and_deletes(tmp_path):
+    before = leagues((1, "ES"), (2, "FR"), (3, "IT"))
+    path = build(tmp_path, before, abox.add_competitions)
+
+    updated = before[1]._replace(league_name="Ligue 1")
+    inserted = leagues((4, "DE"))[0]
+    changes = [change(before[0], "delete"),
+               change(before[1], "update_preimage"), change(updated, "update_postimage"),
+               change(inserted, "insert")]
+    removed, added = apply_changes(path, net_change(changes, abox.add_competitions))
+
+    after = [updated, before[2], inserted]
+    assert_rebuilt(path, build(tmp_path / "rebuilt", after, abox.add_competitions))
+    assert removed == 4  # Type, name and country of league 1, old name of league 2
+    assert added == 5  # New name of league 2; type, name, country and country name of league 4
+
+
+def test_apply_changes_keeps_lines_of_other_rows(tmp_path):
+    # Two rows of the same competition, and a film flagged twice
+    duplicates = leagues((39, "GB"), (39, "GB"), (40, "GB"))
+    path = build(tmp_path, duplicates, abox.add_competitions)
+    apply_changes(path, net_change([change(duplicates[0], "delete")], abox.add_competitions))
+    assert_rebuilt(path, build(tmp_path / "leagues", duplicates[1:], abox.add_competitions))
+
+    flags = [synthetic_kg.FilmRef(7), synthetic_kg.FilmRef(7), synthetic_kg.FilmRef(8)]
+    path = build(tmp_path / "trending", flags, abox.add_movie_flags, DBO.trending_movie)
+    apply_changes(path, net_change([change(flags[0], "delete")], abox.add_movie_flags, DBO.trending_movie))
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        assert sum("film_7" in line for line in f) == 1
+
+
+def test_apply_changes_over_several_versions(tmp_path):
+    before = leagues((1, "ES"))
+    path = build(tmp_path, before, abox.add_competitions)
+
+    # Version 2 inserts league 2 and version 3 deletes it; the rows come in any order
+    inserted = leagues((2, "FR"))[0]
+    changes = [change(inserted, "delete"), change(before[0], "update_preimage"),
+               change(before[0]._replace(league_type="cup"), "update_postimage"), change(inserted, "insert")]
+    apply_changes(path, net_change(changes, abox.add_competitions))
+
+    after = [before[0]._replace(league_type="cup")]
+    assert_rebuilt(path, build(tmp_path / "rebuilt", after, abox.add_competitions))
+
+
+def test_apply_changes_refuses_renamed_entities(tmp_path):
+    before = leagues((1, "ES"), (2, "ES"))
+    path = build(tmp_path, before, abox.add_competitions)
+    with open(path, "rb") as f:
+        written = f.read()
+
+    renamed = before[0]._replace(country=Country("ES", "Spain"))
+    changes = [change(before[0], "update_preimage"), change(renamed, "update_postimage")]
+    with pytest.raises(NameChanged):
+        apply_changes(path, net_change(changes, abox.add_competitions))
+    with open(path, "rb") as f:
+        assert f.read() == written
+
+
+def test_manifest_round_trip(tmp_path):
+    output_dir = str(tmp_path)
+    for name in ("abox-users-00000.nt.gz", "abox-users-00001.nt.gz"):
+        open(os.path.join(output_dir, name), "w").close()
+    inputs = {"code": "abc", "users": 10}
+    Manifest(output_dir).record("users", inputs, ["abox-users-00000.nt.gz", "abox-users-00001.nt.gz"],
+                                mode="rebuilt")
+
+    manifest = Manifest(output_dir)
+    assert manifest.up_to_date("users", inputs)
+    assert not manifest.up_to_date("users", {"code": "abc", "users": 5})
+    assert not manifest.up_to_date("leagues", inputs)
+    assert manifest.stages["users"]["mode"] == "rebuilt"
+    assert not Manifest(output_dir, full=True).up_to_date("users", inputs)
+
+    # Fewer shards: the one left over goes
+    manifest.record("users", {"code": "abc", "users": 5}, ["abox-users-00000.nt.gz"], mode="rebuilt")
+    assert not os.path.exists(os.path.join(output_dir, "abox-users-00001.nt.gz"))
+    assert Manifest(output_dir).up_to_date("users", {"code": "abc", "users": 5})
+
+    os.remove(os.path.join(output_dir, "abox-users-00000.nt.gz"))
+    assert not Manifest(output_dir).up_to_date("users", {"code": "abc", "users": 5})
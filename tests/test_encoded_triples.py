@@ -0,0 +1,56 @@
+import csv
+import gzip
+import os
+
+import numpy as np
+
+from encoded_triples import load_encoded_triples
+from term_dictionary import encode_tsv
+
+TRIPLES = [
+    ("http://sdm_upc.org/resource/user_1", "http://sdm_upc.org/ontology/likes", "http://sdm_upc.org/resource/film_1"),
+    ("http://sdm_upc.org/resource/film_1", "http://sdm_upc.org/ontology/overview", "Two lines,\nand\ta tab"),
+    ("http://sdm_upc.org/resource/film_1", "http://sdm_upc.org/ontology/title", '"Quoted" \\ title'),
+]
+
+
+def write_tsv(path, triples):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter="\t")
+        writer.writerow(["subject", "predicate", "object"])
+        writer.writerows(triples)
+
+
+def read_mapping(path):
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f, delimiter="\t")
+        return {row["label"]: int(row["id"]) for row in reader}
+
+
+def test_labels_with_tabs_and_newlines_survive(tmp_path):
+    path = str(tmp_path / "triples.tsv")
+    write_tsv(path, TRIPLES)
+    encode_tsv(path)
+
+    entities = read_mapping(tmp_path / "entity_to_id.tsv.gz")
+    labels = sorted({t for s, _, o in TRIPLES for t in (s, o)})
+    assert entities == {label: i for i, label in enumerate(labels)}
+
+    encoded = load_encoded_triples(path)
+    assert [encoded.entities[k] for k in range(len(encoded.entities))] == labels
+    assert encoded.entities.get("Two lines,\nand\ta tab") == entities["Two lines,\nand\ta tab"]
+    decoded = [(encoded.entities.label_of(h), encoded.relations.label_of(r), encoded.entities.label_of(t))
+               for h, r, t in np.asarray(encoded.triples)]
+    assert decoded == TRIPLES
+
+
+def test_rewritten_triples_of_the_same_size_are_stale(tmp_path):
+    path = str(tmp_path / "triples.tsv")
+    write_tsv(path, TRIPLES)
+    encode_tsv(path)
+    assert load_encoded_triples(path) is not None
+
+    size = os.path.getsize(path)
+    write_tsv(path, [(s, p, o.replace("film_1", "film_2")) for s, p, o in TRIPLES])
+    assert os.path.getsize(path) == size
+    assert load_encoded_triples(path) is None
@@ -0,0 +1,44 @@
+import os
+import signal
+import time
+
+import pytest
+
+import synthetic_kg
+from jobs import JobManager
+from model_registry import load_model
+
+PARAMS = {"algorithm": "minibatch_kmeans", "n_clusters": 3, "max_users": 50}
+
+
+@pytest.fixture(scope="module")
+def manager(tmp_path_factory):
+    paths = synthetic_kg.generate(str(tmp_path_factory.mktemp("kg")), 200, seed=1)
+    manager = JobManager(paths["model_path"], paths["triples_path"], max_workers=1)
+    manager.start()
+    manager.version = load_model(paths["model_path"]).version
+    yield manager
+    manager.stop()
+
+
+def wait(manager, job, timeout=120):
+    deadline = time.time() + timeout
+    while manager.status(job)["status"] not in ("succeeded", "failed", "cancelled"):
+        assert time.time() < deadline, "job did not finish"
+        time.sleep(0.05)
+    return manager.status(job)
+
+
+def test_jobs_run_again_after_a_worker_dies(manager):
+    job = manager.submit("clustering", PARAMS, manager.version)
+    # As the OOM killer would
+    for process in list(manager._executor._processes.values()):
+        os.kill(process.pid, signal.SIGKILL)
+    status = wait(manager, job)
+    assert status["status"] == "failed"
+    assert "worker running the job died" in status["message"]
+
+    job = manager.submit("clustering", PARAMS, manager.version)
+    status = wait(manager, job)
+    assert status["status"] == "succeeded", status.get("message")
+    assert manager.result(job)["cluster_labels"]
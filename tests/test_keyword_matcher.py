@@ -0,0 +1,40 @@
+import random
+
+from keyword_matcher import KeywordMatcher
+
+
+def test_overlapping_keywords_are_all_found():
+    matcher = KeywordMatcher(["she", "he", "hers", "his"])
+    assert matcher.find("ushers") == [0, 1, 2]
+
+
+def test_keyword_inside_another_is_found():
+    matcher = KeywordMatcher(["world cup", "cup", "world"])
+    assert matcher.find("The World Cup final") == [0, 1, 2]
+
+
+def test_adjacent_keywords_are_found():
+    matcher = KeywordMatcher(["goal", "keeper", "messi"])
+    assert matcher.find("goalkeeper") == [0, 1]
+    assert matcher.find("messimessi") == [2]
+
+
+def test_matches_are_case_insensitive_and_span_texts():
+    matcher = KeywordMatcher(["Oscar", "premiere", "box office"])
+    assert matcher.find("OSCAR night", None, "", "Box Office record") == [0, 2]
+
+
+def test_empty_keyword_always_matches():
+    matcher = KeywordMatcher(["", "film"])
+    assert matcher.find("") == [0]
+    assert matcher.find("a film") == [0, 1]
+
+
+def test_agrees_with_substring_search():
+    rng = random.Random(0)
+    keywords = ["".join(rng.choice("abc") for _ in range(rng.randint(1, 4))) for _ in range(30)]
+    matcher = KeywordMatcher(keywords)
+    for _ in range(200):
+        text = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 12)))
+        expected = [i for i, k in enumerate(keywords) if k in text]
+        assert matcher.find(text) == expected
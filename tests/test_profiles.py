@@ -0,0 +1,33 @@
+import numpy as np
+from scipy import sparse
+
+from profiles import CATEGORIES, CategoryIndex, ProfileIndex, _pack_strings, cluster_profiles
+
+
+def index_of(likes, n_items):
+    """Profile index where user i (embedding row i) likes the items of likes[i], in every category."""
+    users = np.repeat(np.arange(len(likes)), [len(items) for items in likes])
+    items = np.concatenate([np.asarray(items, dtype=np.int64) for items in likes])
+    adjacency = sparse.csr_matrix((np.ones(len(items), dtype=np.int32), (users, items)),
+                                  shape=(len(likes), n_items))
+    uris = [f"http://sdm_upc.org/resource/item_{k}" for k in range(n_items)]
+    categories = {
+        category: CategoryIndex(adjacency, *_pack_strings(uris), *_pack_strings([f"Item {k}" for k in range(n_items)]))
+        for category, _, _ in CATEGORIES
+    }
+    return ProfileIndex("test", np.arange(len(likes)), categories)
+
+
+def test_ties_at_the_cut_off_go_by_item():
+    # Item 9 is liked by everyone, items 0-8 by one user each
+    index = index_of([[9, k] for k in range(9)][::-1], 10)
+    profiles = cluster_profiles(index, np.arange(9), np.zeros(9, dtype=int), top_k=3)
+    genres = [p for p in profiles["0"] if p["category"] == "Genre"]
+    assert [(p["name"], p["count"]) for p in genres] == [("Item 9", 9), ("Item 0", 1), ("Item 1", 1)]
+
+
+def test_clusters_get_their_own_counts():
+    index = index_of([[0, 1], [1], [2], [2, 3]], 4)
+    profiles = cluster_profiles(index, [0, 1, 2, 3], [5, 5, 7, 7], top_k=1)
+    assert [p["name"] for p in profiles["5"] if p["category"] == "Movie"] == ["Item 1"]
+    assert [p["name"] for p in profiles["7"] if p["category"] == "Movie"] == ["Item 2"]
@@ -0,0 +1,42 @@
+import pytest
+
+import synthetic_kg
+from model_registry import load_model
+from profiles import ONTOLOGY, build_profile_index
+from recommend import recommend
+from user_index import build_user_index
+
+
+@pytest.fixture(scope="module")
+def kg(tmp_path_factory):
+    paths = synthetic_kg.generate(str(tmp_path_factory.mktemp("kg")), 100, seed=1)
+    model = load_model(paths["model_path"])
+    users = build_user_index(model, paths["triples_path"])
+    return model, build_profile_index(model, users, paths["triples_path"]), paths["triples_path"]
+
+
+def subjects(triples_path, predicate):
+    with open(triples_path, encoding="utf-8") as f:
+        return {line.split("\t")[0] for line in f if line.split("\t")[1:2] == [predicate]}
+
+
+def test_every_film_is_a_candidate(kg):
+    model, index, triples_path = kg
+    films = subjects(triples_path, ONTOLOGY + "movie_title")
+    liked = index.categories["Movie"].adjacency.sum(axis=0)
+    assert (liked == 0).any()  # Some films nobody likes
+
+    result = recommend(model, index, [synthetic_kg.user_uri(0)], "likes_movie", k=5)
+    assert result["candidates"] == len(films)
+
+
+def test_known_items_are_left_out(kg):
+    model, index, triples_path = kg
+    uri = synthetic_kg.user_uri(0)
+    with open(triples_path, encoding="utf-8") as f:
+        known = {line.rstrip("\n").split("\t")[2] for line in f
+                 if line.startswith(uri + "\t" + ONTOLOGY + "likes_movie\t")}
+    assert known
+    items = recommend(model, index, [uri], "likes_movie", k=50)["recommendations"][0]["items"]
+    assert len(items) == 50
+    assert not known & {item["uri"] for item in items}
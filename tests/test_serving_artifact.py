@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+import time
+
+from serving_artifact import shared_file
+
+
+def write_text(text):
+    def write(tmp_path):
+        with open(tmp_path, "w") as f:
+            f.write(text)
+    return write
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_lock_of_a_dead_process_is_taken_over(tmp_path):
+    path = str(tmp_path / "cache" / "index.npy")
+    os.makedirs(os.path.dirname(path))
+    with open(path + ".lock", "w") as f:
+        f.write(str(dead_pid()))
+
+    started = time.monotonic()
+    shared_file(path, write_text("built"), timeout=60)
+    assert time.monotonic() - started < 5
+    with open(path) as f:
+        assert f.read() == "built"
+    assert not os.path.exists(path + ".lock")
+
+
+def test_lock_held_past_the_timeout_is_taken_over(tmp_path):
+    path = str(tmp_path / "index.npy")
+    with open(path + ".lock", "w") as f:
+        f.write(str(os.getpid()))  # A live owner that never finishes
+
+    shared_file(path, write_text("built"), timeout=0.2)
+    with open(path) as f:
+        assert f.read() == "built"
+    assert not os.path.exists(path + ".lock")
+
+
+def test_existing_file_is_not_rebuilt(tmp_path):
+    path = str(tmp_path / "index.npy")
+    shared_file(path, write_text("first"))
+    shared_file(path, write_text("second"))
+    with open(path) as f:
+        assert f.read() == "first"
+    assert not os.path.exists(path + ".lock")